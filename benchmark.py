@@ -0,0 +1,539 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC benchmark. Measures the throughput of the SmartDOC-MOC tools.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program generates a synthetic corpus and measures the throughput of
+`check.py', `normalize.py' and `explore.py' on it, both end to end (running
+the programs) and per stage (calling `moclib' in process).
+
+Stages are cumulative: "decode" reads and decodes the files, "check" also
+checks them, "normalize" also normalizes them and "write" also writes the
+normalized files. "explore" describes each character of the explore sample.
+
+Before timing anything, the normalization is verified: test inputs must give
+`test/output-expected-utf8.txt', the fast normalization path must agree with
+the reference one, and `normalize.py' must give the same output as `moclib'.
+A program failing (with another code than 0 or 50) stops the benchmark.
+
+Results are written as JSON, and can be compared with the results of a
+previous version.
+
+Sample usage:
+    benchmark.py
+    benchmark.py --size 100M --eol crlf --non-ascii 0.1 --illegal 0.001
+    benchmark.py --files 200 --size 20M --output new.json --compare old.json
+
+
+Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+                   - L3i / University of La Rochelle, France
+This program comes with ABSOLUTELY NO WARRANTY; for details see `LICENCE' file.
+This is free software, and you are welcome to redistribute it under certain
+conditions; see `LICENCE' file for details.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import os
+import json
+import multiprocessing
+import platform
+import random
+import shutil
+import string
+import subprocess
+import tempfile
+import time
+import unicodedata
+
+import moclib
+from moclib import (ERRCODE_OK, ERRCODE_EXTRACHAR, ALLOWED_INPUT, BUFFER_SIZE, is_legal,
+                    read_text, open_input, check_file, normalize_file,
+                    normalize_stream, explore_lines, normalize_line, transform)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_DESCR = "Benchmark of the OCR Result tools for ICDAR15 SmartDOC"
+PROG_NAME = "moc_bench"
+
+ERRCODE_MISMATCH = 60
+
+RESULTS_VERSION = 1
+
+_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+_TEST_DIR = os.path.join(_ROOT_DIR, "test")
+_EXPECTED_OUTPUT = os.path.join(_TEST_DIR, "output-expected-utf8.txt")
+_TEST_INPUTS = ["input-nixEOL-utf8.txt", "input-dosEOL-utf8.txt",
+                "input-macEOL-utf8.txt"]
+
+_EOLS = {"lf": [b"\n"], "crlf": [b"\r\n"], "cr": [b"\r"],
+         "mixed": [b"\n", b"\r\n", b"\r"]}
+
+# Characters the corpus is made of.
+_ASCII_CHARS = string.ascii_letters + string.digits + string.punctuation
+_NON_ASCII_CHARS = [char for char in ALLOWED_INPUT if ord(char) > 0x7F]
+_ILLEGAL_CHARS = [char for char in map(unichr, range(0x0370, 0x0400))
+                  if unicodedata.category(char) != "Cn" and not is_legal(char)]
+_SPACE_RATIO = 0.17
+
+# Number of distinct lines the corpus is drawn from.
+_LINE_POOL_SIZE = 4096
+
+# ==============================================================================
+# Utility private functions
+def _dumpArgs(args, logger=logger):
+    logger.debug("Arguments:")
+    for (k, v) in args.__dict__.items():
+        logger.debug("    %-20s = %s" % (k, v))
+
+_DBGLINELEN = 80
+_DBGSEP = "-"*_DBGLINELEN
+
+def _programHeader(logger, prog_name, prog_version):
+    logger.debug(_DBGSEP)
+    dbg_head = "%s - v. %s" % (prog_name, prog_version)
+    dbg_head_pre = " " * (max(0, (_DBGLINELEN - len(dbg_head)))/2)
+    logger.debug(dbg_head_pre + dbg_head)
+
+def _initLogger(logger, debug=False):
+    format="%(module)-9s %(levelname)-7s: %(message)s"
+    formatter = logging.Formatter(format)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+    logger.setLevel(level)
+
+def _parseSize(value):
+    """Parses a size in bytes, with an optional K, M or G suffix."""
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    try:
+        if value[-1:].upper() in units:
+            return int(float(value[:-1]) * units[value[-1:].upper()])
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: %r" % value)
+
+class _NullWriter(object):
+    """Output discarding whatever is written to it."""
+    def write(self, text):
+        pass
+
+# ==============================================================================
+# Corpus generation
+def _makeLine(rnd, length, non_ascii, illegal):
+    """Returns a random line of `length' characters, without EOL."""
+    chars = []
+    for _ in range(length):
+        draw = rnd.random()
+        if draw < illegal:
+            chars.append(rnd.choice(_ILLEGAL_CHARS))
+        elif draw < illegal + non_ascii:
+            chars.append(rnd.choice(_NON_ASCII_CHARS))
+        elif rnd.random() < _SPACE_RATIO:
+            chars.append(u" ")
+        else:
+            chars.append(unicode(rnd.choice(_ASCII_CHARS)))
+    return u"".join(chars)
+
+def _makeLinePool(rnd, args):
+    """Returns the list of distinct lines the corpus is drawn from."""
+    pool = []
+    for _ in range(_LINE_POOL_SIZE):
+        length = rnd.randint(args.line_length // 2, args.line_length * 3 // 2)
+        pool.append(_makeLine(rnd, length, args.non_ascii, args.illegal))
+    return pool
+
+def _writeCorpusFile(rnd, path, size, pool, eols):
+    """Writes about `size' bytes of lines drawn from `pool'. Returns the number
+    of lines written."""
+    encoded = [line.encode("UTF-8") for line in pool]
+    line_count = 0
+    written = 0
+    with open(path, "wb") as out:
+        while written < size:
+            data = rnd.choice(encoded) + rnd.choice(eols)
+            out.write(data)
+            written += len(data)
+            line_count += 1
+    return line_count
+
+def _generateCorpus(args, work_dir):
+    """Generates the synthetic corpus described by the command line options.
+
+    Returns a dict describing the corpus, with the list of its files and the
+    path of the (smaller) explore sample.
+    """
+    rnd = random.Random(args.seed)
+    pool = _makeLinePool(rnd, args)
+    eols = _EOLS[args.eol]
+    corpus_dir = os.path.join(work_dir, "corpus")
+    if os.path.isdir(corpus_dir):
+        shutil.rmtree(corpus_dir)
+    os.makedirs(corpus_dir)
+    files = []
+    line_count = 0
+    file_size = max(1, args.size // args.files)
+    for index in range(args.files):
+        path = os.path.join(corpus_dir, "file-%05d.txt" % index)
+        line_count += _writeCorpusFile(rnd, path, file_size, pool, eols)
+        files.append(path)
+    explore_path = os.path.join(work_dir, "explore.txt")
+    explore_lines_count = _writeCorpusFile(
+        rnd, explore_path, min(args.size, args.explore_size), pool, eols)
+    return {
+        "size": args.size, "files": args.files,
+        "line_length": args.line_length, "eol": args.eol,
+        "non_ascii": args.non_ascii, "illegal": args.illegal,
+        "seed": args.seed,
+        "bytes": sum(os.path.getsize(path) for path in files),
+        "lines": line_count,
+        "explore_bytes": os.path.getsize(explore_path),
+        "explore_lines": explore_lines_count,
+        "paths": files, "explore_path": explore_path, "pool": pool}
+
+# ==============================================================================
+# Verification
+def _readBytes(path):
+    with open(path, "rb") as file_input:
+        return file_input.read()
+
+def _verifyExpectedOutput(work_dir):
+    """Normalizes the test inputs, returns the list of those whose output
+    differs from the expected one."""
+    expected = _readBytes(_EXPECTED_OUTPUT)
+    failures = []
+    for name in _TEST_INPUTS:
+        output_path = os.path.join(work_dir, "expected-" + name)
+        normalize_file(os.path.join(_TEST_DIR, name), output_path)
+        if _readBytes(output_path) != expected:
+            failures.append(name)
+    return failures
+
+def _verifyFastPath(lines):
+    """Compares the fast normalization and transformation paths to the
+    reference ones, returns the list of lines they disagree on."""
+    failures = []
+    for line in lines:
+        if (normalize_line(line) != moclib._normalize_full(line)
+                or transform(line) != moclib._transform_chain(line)):
+            failures.append(line)
+    return failures
+
+def _verifyProgramOutput(corpus, work_dir):
+    """Runs `normalize.py' on the first corpus file, returns True if its
+    output is the same as the one of `moclib.normalize_file'."""
+    input_path = corpus["paths"][0]
+    program_output = os.path.join(work_dir, "verify-program.txt")
+    library_output = os.path.join(work_dir, "verify-library.txt")
+    _runProgram(["normalize.py", input_path, program_output])
+    normalize_file(input_path, library_output)
+    return _readBytes(program_output) == _readBytes(library_output)
+
+# ==============================================================================
+# Timing
+class _ProgramError(Exception):
+    """Raised when a program fails, so that it is not timed as a success."""
+
+def _runProgram(argv):
+    """Runs one of the programs, discarding its output. Raises _ProgramError
+    unless it exits with ERRCODE_OK or ERRCODE_EXTRACHAR (the corpus has
+    illegal characters)."""
+    command = [sys.executable, os.path.join(_ROOT_DIR, argv[0])] + argv[1:]
+    with open(os.devnull, "wb") as devnull:
+        ret_code = subprocess.call(command, stdout=devnull, stderr=devnull)
+    if ret_code not in (ERRCODE_OK, ERRCODE_EXTRACHAR):
+        raise _ProgramError("%s exited with code %d."
+                            % (" ".join(argv), ret_code))
+
+def _timeIt(function, repeat):
+    """Returns the best wall clock time of `repeat' calls of `function'."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _stageFunctions(corpus, work_dir, buffer_size):
+    """Returns the (name, function, explore sample) list of in-process
+    stages."""
+    paths = corpus["paths"]
+    output_dir = os.path.join(work_dir, "stage-output")
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    def decode():
+        for path in paths:
+            with open(path, "rb") as raw:
+                for _ in read_text(raw, buffer_size):
+                    pass
+
+    def check():
+        for path in paths:
+            check_file(path, buffer_size=buffer_size)
+
+    def normalize():
+        for path in paths:
+            with open(path, "rb") as raw:
+                normalize_stream(read_text(raw, buffer_size), _NullWriter())
+
+    def write():
+        for path in paths:
+            normalize_file(path, os.path.join(output_dir,
+                                              os.path.basename(path)),
+                           buffer_size=buffer_size)
+
+    def explore():
+        with open_input(corpus["explore_path"], newline='') as file_input:
+            for _ in explore_lines(file_input):
+                pass
+
+    return [("decode", decode, False), ("check", check, False),
+            ("normalize", normalize, False), ("write", write, False),
+            ("explore", explore, True)]
+
+def _programFunctions(corpus, work_dir, jobs):
+    """Returns the (name, function, explore sample) list of end to end runs."""
+    paths = corpus["paths"]
+    output_dir = os.path.join(work_dir, "program-output")
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    def check():
+        for path in paths:
+            _runProgram(["check.py", path])
+
+    def normalize():
+        for path in paths:
+            _runProgram(["normalize.py", path,
+                         os.path.join(output_dir, os.path.basename(path))])
+
+    def explore():
+        _runProgram(["explore.py", corpus["explore_path"]])
+
+    functions = [("check.py", check, False), ("normalize.py", normalize, False)]
+    if len(paths) > 1:
+        def batch():
+            argv = ["normalize.py", "--batch", os.path.dirname(paths[0]),
+                    os.path.join(work_dir, "batch-output")]
+            if jobs:
+                argv[1:1] = ["--jobs", str(jobs)]
+            _runProgram(argv)
+        functions.append(("normalize.py --batch", batch, False))
+    functions.append(("explore.py", explore, True))
+    return functions
+
+def _result(kind, name, seconds, corpus, explore_sample):
+    if explore_sample:
+        size, lines = corpus["explore_bytes"], corpus["explore_lines"]
+    else:
+        size, lines = corpus["bytes"], corpus["lines"]
+    seconds = max(seconds, 1e-9)
+    return {"kind": kind, "name": name, "seconds": seconds, "bytes": size,
+            "lines": lines, "mb_per_s": size / seconds / 1e6,
+            "lines_per_s": lines / seconds}
+
+def _runBenchmark(corpus, work_dir, args):
+    """Times every stage and program on the corpus, returns the results."""
+    results = []
+    for kind, functions in (
+            ("stage", _stageFunctions(corpus, work_dir, args.buffer_size)),
+            ("program", _programFunctions(corpus, work_dir, args.jobs))):
+        for name, function, explore_sample in functions:
+            logger.debug("Timing %s %s." % (kind, name))
+            seconds = _timeIt(function, args.repeat)
+            result = _result(kind, name, seconds, corpus, explore_sample)
+            logger.info("%-8s %-22s %8.3fs %9.2f MB/s %12.0f lines/s"
+                        % (kind, name, seconds, result["mb_per_s"],
+                           result["lines_per_s"]))
+            results.append(result)
+    return results
+
+def _compareResults(results, previous_path):
+    """Logs the speed of each result relative to a previous results file."""
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)
+    previous_results = dict(((result["kind"], result["name"]), result)
+                            for result in previous["results"])
+    logger.info("Compared to %s (> 1 is faster):" % previous_path)
+    for result in results:
+        old = previous_results.get((result["kind"], result["name"]))
+        if old is not None:
+            logger.info("%-8s %-22s %6.2fx"
+                        % (result["kind"], result["name"],
+                           result["mb_per_s"] / old["mb_per_s"]))
+
+# ==============================================================================
+# Main function
+def main():
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=PROG_DESCR,
+        epilog=__doc__,
+        version=PROG_VERSION)
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+    parser.add_argument('--size',
+        type=_parseSize, default=_parseSize("10M"),
+        help="Total size of the corpus, in bytes, with an optional K, M or G "
+             "suffix (default: 10M).")
+    parser.add_argument('--files',
+        type=int, default=1,
+        help="Number of files the corpus is split into (default: "
+             "%(default)s).")
+    parser.add_argument('--line-length',
+        type=int, default=80,
+        help="Average line length, in characters (default: %(default)s).")
+    parser.add_argument('--eol',
+        choices=sorted(_EOLS), default="lf",
+        help="End of line style (default: %(default)s).")
+    parser.add_argument('--non-ascii',
+        type=float, default=0.02,
+        help="Share of legal non-ASCII characters (default: %(default)s).")
+    parser.add_argument('--illegal',
+        type=float, default=0.0001,
+        help="Share of illegal characters (default: %(default)s).")
+    parser.add_argument('--explore-size',
+        type=_parseSize, default=_parseSize("1M"),
+        help="Size of the sample explore.py is timed on, as explore output "
+             "is much larger than its input (default: 1M).")
+    parser.add_argument('--seed',
+        type=int, default=2015,
+        help="Seed of the corpus generator (default: %(default)s).")
+    parser.add_argument('--repeat',
+        type=int, default=3,
+        help="Number of runs of each measure, the best one is kept "
+             "(default: %(default)s).")
+    parser.add_argument('--buffer-size',
+        type=int, default=BUFFER_SIZE,
+        help="Size of the blocks files are read and written by, in bytes "
+             "(default: %(default)s).")
+    parser.add_argument('-j', '--jobs',
+        type=int, default=None,
+        help="Number of worker processes in batch mode (default: number of "
+             "CPUs).")
+    parser.add_argument('--work-dir',
+        default=None,
+        help="Directory where the corpus is generated, kept after the run "
+             "(default: a temporary directory, removed after the run).")
+    parser.add_argument('-o', '--output',
+        default="benchmark-results.json",
+        help="Path to the JSON results file (default: %(default)s).")
+    parser.add_argument('--compare',
+        default=None,
+        help="Results file of a previous run to compare with.")
+    args = parser.parse_args()
+
+    # --------------------------------------------------------------------------
+    # Logger activation
+    _initLogger(logger)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    # --------------------------------------------------------------------------
+    # Output log header
+    _programHeader(logger, PROG_NAME, PROG_VERSION)
+    logger.debug(_DBGSEP)
+    _dumpArgs(args, logger)
+    logger.debug(_DBGSEP)
+
+    # --------------------------------------------------------------------------
+    work_dir = args.work_dir
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="moc_bench-")
+    elif not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    try:
+        logger.debug("--- Corpus generation started. ---")
+        corpus = _generateCorpus(args, work_dir)
+        logger.info("Corpus: %d file(s), %d bytes, %d lines."
+                    % (corpus["files"], corpus["bytes"], corpus["lines"]))
+
+        logger.debug("--- Verification started. ---")
+        verification = {
+            "expected_output": _verifyExpectedOutput(work_dir),
+            "fast_path": len(_verifyFastPath(corpus["pool"])),
+            "program_output": _verifyProgramOutput(corpus, work_dir)}
+        ret_code = ERRCODE_OK
+        for name in verification["expected_output"]:
+            logger.error("Normalized %s differs from %s."
+                         % (name, os.path.basename(_EXPECTED_OUTPUT)))
+            ret_code = ERRCODE_MISMATCH
+        if verification["fast_path"]:
+            logger.error("Fast normalization path differs from the reference "
+                         "one on %d line(s)." % verification["fast_path"])
+            ret_code = ERRCODE_MISMATCH
+        if not verification["program_output"]:
+            logger.error("normalize.py output differs from moclib output.")
+            ret_code = ERRCODE_MISMATCH
+
+        logger.debug("--- Timing started. ---")
+        results = _runBenchmark(corpus, work_dir, args)
+    except _ProgramError as exc:
+        logger.error(str(exc))
+        return ERRCODE_MISMATCH
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    corpus_info = dict((key, value) for key, value in corpus.items()
+                       if key not in ("paths", "explore_path", "pool"))
+    document = {
+        "version": RESULTS_VERSION,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "unidata_version": unicodedata.unidata_version,
+        "numpy": moclib.USE_NUMPY,
+        "corpus": corpus_info,
+        "verification": verification,
+        "results": results}
+    with open(args.output, "w") as results_file:
+        json.dump(document, results_file, indent=2, sort_keys=True)
+    logger.info("Results written to %s." % args.output)
+
+    if args.compare:
+        _compareResults(results, args.compare)
+
+    logger.debug("Clean exit.")
+    logger.debug(_DBGSEP)
+    return ret_code
+    # --------------------------------------------------------------------------
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
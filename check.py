@@ -21,6 +21,8 @@
 
 """
 This program checks text files to ensure they contain only legal characters.
+Invalid UTF-8 byte sequences are all reported with their byte offset and line,
+and the rest of the file is checked as well.
 
 This file is part of the tools used for the evaluation of OCR accuracy in the 
 context of the challenge 2 "Mobile OCR Challenge" of the SmartDOC competition 
@@ -28,6 +30,10 @@ at ICDAR 2015.
 
 Sample usage:
     check.py /path/to/utf-8/text/file.txt
+    check.py --fail-fast /path/to/utf-8/text/file.txt
+    check.py --format jsonl /path/to/utf-8/text/file.txt > diagnostics.jsonl
+    gunzip -c result.txt.gz | check.py -
+    check.py /path/to/results.zip
 
 
 Copyright (c) 2015 - J. Chazalon, S. Eskenazi 
@@ -42,8 +48,15 @@ conditions; see `LICENCE' file for details.
 import logging
 import argparse
 import sys
-import unicodedata
-import io
+
+from moclib import (BUFFER_SIZE, check_file, format_line_error,
+                    format_char_counts, DIAGNOSTIC_FORMATS, DiagnosticWriter,
+                    STDIO_PATH, Report, is_archive, check_archive,
+                    format_encoding_errors)
+# Not used here: constants this program used to define itself, which other
+# programs may still import from it.
+from moclib import (ERRCODE_OK, ERRCODE_NOFILE, ERRCODE_EXTRACHAR,
+                    ALLOWED_INPUT, CHAR_ERR_LIM)
 
 # ==============================================================================
 # Logging
@@ -55,40 +68,6 @@ PROG_VERSION = "1.1"
 PROG_DESCR = "OCR Result Checker for ICDAR15 SmartDOC"
 PROG_NAME = "moc_check"
 
-ERRCODE_OK = 0
-ERRCODE_NOFILE = 10
-ERRCODE_EXTRACHAR = 50
-
-ALLOWED_INPUT = (
-    u""" !"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abc"""
-    u"""defghijklmnopqrstuvwxyz{|}~ ¡¢£¤¥¦§¨©ª«¬­®¯°±²³´µ¶·¸¹º»¼½¾¿ÀÁÂÃÄÅÆÇÈÉ"""
-    u"""ÊËÌÍÎÏÐÑÒÓÔÕÖ×ØÙÚÛÜÝÞßàáâãäåæçèéêëìíîïðñòóôõö÷øùúûüýþÿŒœŠšŸŽžƒˆ˜–—‘’"""
-    u"""‚“”„†‡•…‰‹›€™ﬁﬂﬀﬃﬄ"""
-# Horizontal tab added separately for convenience
-    u"\u0009"
-# additions due to Unicode normalization:
-# - 0308 COMBINING DIAERESIS
-# - 0301 COMBINING ACUTE ACCENT 
-# - 03BC GREEK SMALL LETTER MU  
-# - 0327 COMBINING CEDILLA  
-# - 0303 COMBINING TILDE
-# - 0304 COMBINING MACRON   
-# - 2044 FRACTION SLASH 
-    u"\u0308\u0301\u03BC\u0327\u0303\u0304\u2044"
-# ZERO WIDTH NO-BREAK SPACE    
-    u"\ufeff"
-    )
-
-
-CHAR_ERR_LIM = 5
-
-# ==============================================================================
-def _transform(unistr):
-    s2 = unistr
-    for fr, to in TRANSFORMATIONS:
-        s2 = s2.replace(fr, to)
-    return s2
-
 # ==============================================================================
 # Utility private functions
 def _dumpArgs(args, logger=logger):
@@ -116,8 +95,60 @@ def _initLogger(logger, debug=False):
         level = logging.DEBUG
     logger.setLevel(level)
 
-def _unichr2str(unichar):
-    return unicodedata.name(unichar, repr(unichar))
+def _logLineError(line_error):
+    for message in format_line_error(line_error):
+        logger.error(message)
+
+def _openDiagnostics(args):
+    """Returns the DiagnosticWriter selected by the command line options, or
+    None for text diagnostics."""
+    if args.format == "text":
+        return None
+    stream = sys.stdout
+    if args.diagnostics != STDIO_PATH:
+        stream = open(args.diagnostics, "wb")
+    return DiagnosticWriter(stream, args.format, args.per_line)
+
+class _MemberLogger(object):
+    """Logs the LineError of archive members, naming each member before its
+    first error."""
+    def __init__(self):
+        self.name = None
+
+    def __call__(self, name, line_error):
+        if name != self.name:
+            logger.error("In %s:" % name)
+            self.name = name
+        _logLineError(line_error)
+
+def _memberCallbacks(args, diagnostics):
+    """Returns the (on_error, on_chars) pair of callbacks for the members of
+    an archive (see `check_archive')."""
+    if diagnostics is None:
+        return _MemberLogger(), None
+    if args.per_line:
+        return (lambda name, line_error: diagnostics.write(
+                    "%s:%s" % (args.input, name), line_error)), None
+    return None, lambda name, chars: diagnostics.write_chars(
+        "%s:%s" % (args.input, name), chars)
+
+def _checkArchive(args, diagnostics, max_errors):
+    """Checks the members of an archive. Returns a Report with the total
+    number of illegal characters, and the name of the last member read."""
+    on_error, on_chars = _memberCallbacks(args, diagnostics)
+    total = Report()
+    name = args.input
+    for name, report in check_archive(args.input, on_error, args.buffer_size,
+                                      max_errors, on_chars=on_chars):
+        logger.debug("%s: %d illegal character(s)."
+                     % (name, report.err_count))
+        for message in format_encoding_errors(report):
+            logger.error("%s: %s" % (name, message))
+        total.err_count += report.err_count
+        total.encoding_err_count += report.encoding_err_count
+        total.line_count = report.line_count
+        total.truncated = report.truncated
+    return total, "%s:%s" % (args.input, name)
 
 # ==============================================================================
 # Main function
@@ -131,8 +162,35 @@ def main():
     parser.add_argument('-d', '--debug', 
         action="store_true", 
         help="Activate debug output.")
+    parser.add_argument('--buffer-size', 
+        type=int, default=BUFFER_SIZE, 
+        help="Size of the blocks files are read by, in bytes "
+             "(default: %(default)s).")
+    parser.add_argument('--max-errors', 
+        type=int, default=None, metavar='N',
+        help="Stop reading the file after N illegal characters.")
+    parser.add_argument('--fail-fast', 
+        action="store_true", 
+        help="Stop reading the file at the first illegal character "
+             "(same as --max-errors 1).")
+    parser.add_argument('--format', 
+        choices=("text",) + DIAGNOSTIC_FORMATS, default="text", 
+        help="Format of the illegal character diagnostics: text messages in "
+             "the log, or records streamed as JSON Lines or CSV with file, "
+             "line, column, code_point, name and count fields "
+             "(default: %(default)s).")
+    parser.add_argument('--per-line', 
+        action="store_true", 
+        help="With --format jsonl or csv, write one record per line with "
+             "illegal characters instead of one per illegal character.")
+    parser.add_argument('--diagnostics', 
+        default=STDIO_PATH, metavar='FILE',
+        help="File the jsonl or csv diagnostics are written to "
+             "(default: standard output).")
     parser.add_argument('input', 
-        help='File to control.')
+        help="File to control, or %s for the standard input. It may be "
+             "compressed (.gz, .bz2, .xz), or be a zip or tar archive "
+             "whose files are all checked." % STDIO_PATH)
     args = parser.parse_args()
 
     # -----------------------------------------------------------------------------
@@ -149,43 +207,50 @@ def main():
     logger.debug(_DBGSEP)
 
     # --------------------------------------------------------------------------
-    charset = ALLOWED_INPUT + u'\u000a' # Tolerate '\n' (LF) EOL
+    max_errors = args.max_errors
+    if args.fail_fast:
+        max_errors = 1
+
+    diagnostics = _openDiagnostics(args)
+    on_error, on_chars = _logLineError, None
+    if diagnostics is not None:
+        on_error, on_chars = diagnostics.callbacks(args.input)
 
     logger.debug("--- Process started. ---")
-    line_no = 0
-    err_count = 0
-    with io.open(args.input, "rt", encoding="UTF-8", newline=None, 
-                 errors="strict") as file_input:
-        for line in file_input:
-            line_no += 1
-            extra_chars = []
-            char_no = 0
-            for char in line:
-                char_no += 1
-                if char not in charset:
-                    extra_chars.append((char, char_no))
-                    err_count += 1
-            if extra_chars:
-                logger.error("Got %d illegal character(s) in line %d : " 
-                             % (len(extra_chars), line_no))
-                for i in range(min(CHAR_ERR_LIM, len(extra_chars))):
-                    char, pos = extra_chars[i]
-                    logger.error("\tl:%03d c:%03d %s" 
-                                 % (line_no, pos, _unichr2str(char)))
-                if len(extra_chars) > CHAR_ERR_LIM:
-                    logger.error("\t ... and %d other(s)." 
-                                 % (len(extra_chars) - CHAR_ERR_LIM))
+    if is_archive(args.input):
+        report, last_name = _checkArchive(args, diagnostics, max_errors)
+    else:
+        report = check_file(args.input, on_error=on_error, 
+                            buffer_size=args.buffer_size,
+                            max_errors=max_errors, on_chars=on_chars)
+        last_name = args.input
+    if diagnostics is not None and args.diagnostics != STDIO_PATH:
+        diagnostics.stream.close()
 
     logger.debug("--- Process complete. ---")
     # --------------------------------------------------------------------------
-    ret_code = ERRCODE_OK
-    if err_count > 0:
+    ret_code = report.ret_code
+    if report.err_count > 0 or report.encoding_err_count > 0:
         logger.error(_DBGSEP)
-        logger.error("Input file contains %d illegal characters." % err_count)
+        if report.encoding_err_count > 0:
+            for message in format_encoding_errors(report):
+                logger.error(message)
+            logger.error("Input file contains %d invalid UTF-8 sequence(s), "
+                         "each counted as an illegal U+FFFD REPLACEMENT "
+                         "CHARACTER." % report.encoding_err_count)
+        if report.truncated:
+            logger.error("Stopped reading at line %d of %s after %d illegal "
+                         "character(s)." % (report.line_count, last_name,
+                                            report.err_count))
+        else:
+            logger.error("Input file contains %d illegal characters."
+                         % report.err_count)
+        logger.debug("Illegal characters by code point:")
+        for message in format_char_counts(report):
+            logger.debug(message)
         logger.error("Please review previous error messages and "
                      "fix them before submitting your results.")
         logger.error(_DBGSEP)
-        ret_code = ERRCODE_EXTRACHAR
     else:
         logger.info("Input file contains only legal characters. Great!")
 
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC client. Checks and normalizes files through a SmartDOC-MOC server.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program checks or normalizes a file through a running `server.py', with
+the same messages and return codes as `check.py' and `normalize.py'.
+
+Files are read by the server, which must be able to access them, unless
+`--inline' is given: the content of the file is then sent with the request,
+and the normalized text is sent back.
+
+Sample usage:
+    client.py check /path/to/utf-8/text/file.txt
+    client.py normalize /path/to/utf-8/text/file.txt /path/to/output.txt
+    client.py --address /tmp/moc.sock --inline check file.txt
+    client.py ping
+
+
+Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+                   - L3i / University of La Rochelle, France
+This program comes with ABSOLUTELY NO WARRANTY; for details see `LICENCE' file.
+This is free software, and you are welcome to redistribute it under certain
+conditions; see `LICENCE' file for details.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import os
+import socket
+
+from moclib import (ERRCODE_IOERROR, DEFAULT_SERVER_ADDRESS,
+                    STDIO_PATH, ServerClient, line_error_from_json,
+                    format_line_error, open_input, open_output,
+                    encoding_error_from_json, format_encoding_error)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_DESCR = "OCR Result Checking and Normalization Client for ICDAR15 SmartDOC"
+PROG_NAME = "moc_client"
+
+# ==============================================================================
+# Utility private functions
+def _dumpArgs(args, logger=logger):
+    logger.debug("Arguments:")
+    for (k, v) in args.__dict__.items():
+        logger.debug("    %-20s = %s" % (k, v))
+
+_DBGLINELEN = 80
+_DBGSEP = "-"*_DBGLINELEN
+
+def _programHeader(logger, prog_name, prog_version):
+    logger.debug(_DBGSEP)
+    dbg_head = "%s - v. %s" % (prog_name, prog_version)
+    dbg_head_pre = " " * (max(0, (_DBGLINELEN - len(dbg_head)))/2)
+    logger.debug(dbg_head_pre + dbg_head)
+
+def _initLogger(logger, debug=False):
+    format="%(module)-9s %(levelname)-7s: %(message)s"
+    formatter = logging.Formatter(format)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+    logger.setLevel(level)
+
+def _makeRequest(args):
+    """Returns the request described by the command line options."""
+    request = {"command": args.command}
+    if args.command == "ping":
+        return request
+    if args.inline:
+        with open_input(args.input) as file_input:
+            request["text"] = file_input.read()
+    else:
+        request["input"] = os.path.abspath(args.input)
+        if args.command == "normalize":
+            request["output"] = os.path.abspath(args.output)
+    if args.command == "check" and args.max_errors:
+        request["max_errors"] = args.max_errors
+    return request
+
+# ==============================================================================
+# Main function
+def main():
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=PROG_DESCR,
+        epilog=__doc__,
+        version=PROG_VERSION)
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+    parser.add_argument('-a', '--address',
+        default=DEFAULT_SERVER_ADDRESS,
+        help="Address of the server: host:port, or the path of a Unix socket "
+             "(default: %(default)s).")
+    parser.add_argument('--inline',
+        action="store_true",
+        help="Send the content of the input file instead of its path, and "
+             "receive the normalized text.")
+    parser.add_argument('--max-errors',
+        type=int, default=None, metavar='N',
+        help="Stop checking the file after N illegal characters.")
+    parser.add_argument('--timeout',
+        type=float, default=None,
+        help="Seconds to wait for the server (default: no limit).")
+    parser.add_argument('command',
+        choices=("check", "normalize", "ping"),
+        help="Request to send.")
+    parser.add_argument('input',
+        nargs="?",
+        help="Text file with UTF-8 encoding.")
+    parser.add_argument('output',
+        nargs="?",
+        help="Path to normalized output file, for normalize requests.")
+    args = parser.parse_args()
+    if args.command != "ping" and args.input is None:
+        parser.error("an input file is required")
+    if args.command == "normalize" and args.output is None:
+        parser.error("an output file is required")
+    if args.inline and STDIO_PATH in (args.input, args.output):
+        parser.error("standard input and output cannot be used")
+
+    # --------------------------------------------------------------------------
+    # Logger activation
+    _initLogger(logger)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    # --------------------------------------------------------------------------
+    # Output log header
+    _programHeader(logger, PROG_NAME, PROG_VERSION)
+    logger.debug(_DBGSEP)
+    _dumpArgs(args, logger)
+    logger.debug(_DBGSEP)
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    try:
+        request = _makeRequest(args)
+    except UnicodeError as exc:
+        logger.error("%s is not valid UTF-8 (%s), send its path instead of "
+                     "--inline to locate every invalid sequence."
+                     % (args.input, exc))
+        return ERRCODE_IOERROR
+    try:
+        with ServerClient(args.address, args.timeout) as client:
+            response = client.request(request)
+    except (IOError, socket.error) as exc:
+        logger.error("Cannot reach the server at %s: %s" % (args.address, exc))
+        return ERRCODE_IOERROR
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+
+    ret_code = response["ret_code"]
+    if "error" in response:
+        logger.error(response["error"])
+        return ret_code
+    if args.command == "ping":
+        logger.info("Server is up.")
+        return ret_code
+
+    for line_error in response["line_errors"]:
+        for message in format_line_error(line_error_from_json(line_error)):
+            logger.error(message)
+    # The server only lists the first LINE_ERR_LIM lines and sequences.
+    other_lines = response["line_err_count"] - len(response["line_errors"])
+    if other_lines > 0:
+        logger.error("... and %d other line(s) with illegal characters."
+                     % other_lines)
+    if args.inline and args.command == "normalize":
+        with open_output(args.output) as file_output:
+            file_output.write(response["text"])
+
+    if response["err_count"] > 0 or response["encoding_err_count"] > 0:
+        logger.error(_DBGSEP)
+        if response["encoding_err_count"] > 0:
+            for encoding_error in response["encoding_errors"]:
+                logger.error(format_encoding_error(
+                    encoding_error_from_json(encoding_error)))
+            other_errors = (response["encoding_err_count"]
+                            - len(response["encoding_errors"]))
+            if other_errors > 0:
+                logger.error("... and %d other invalid UTF-8 sequence(s)."
+                             % other_errors)
+            logger.error("Input file contains %d invalid UTF-8 sequence(s), "
+                         "each counted as an illegal U+FFFD REPLACEMENT "
+                         "CHARACTER." % response["encoding_err_count"])
+        if response["truncated"]:
+            logger.error("Stopped reading at line %d of %s after %d illegal "
+                         "character(s)." % (response["line_count"], args.input,
+                                            response["err_count"]))
+        else:
+            logger.error("Input file contains %d illegal characters."
+                         % response["err_count"])
+        logger.error("Please review previous error messages and "
+                     "fix them before submitting your results.")
+        logger.error(_DBGSEP)
+    elif args.command == "check":
+        logger.info("Input file contains only legal characters. Great!")
+
+    logger.debug("Clean exit.")
+    logger.debug(_DBGSEP)
+    return ret_code
+    # --------------------------------------------------------------------------
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC charset compiler. Compiles char_mapping.ods into a profile.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program compiles a charset spreadsheet, in the format of
+`char_mapping.ods', into a profile: the bitmap of the allowed code points and
+the list of transformations applied after Unicode normalization. It checks that
+the profile allows exactly the characters allowed by the spreadsheet and
+normalizes each of them as given there, then prints a summary of the profile.
+
+The programs of this package compile `char_mapping.ods' by themselves, and
+cache the result. Another profile, for another challenge, is selected with the
+MOC_CHARSET environment variable, set to the path of a spreadsheet in the same
+format or of a profile written by this program.
+
+Sample usage:
+    compile_charset.py
+    compile_charset.py --output other.json /path/to/other_mapping.ods
+    compile_charset.py --check other.json /path/to/other_mapping.ods
+    MOC_CHARSET=other.json normalize.py result.txt normalized.txt
+
+
+Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+                   - L3i / University of La Rochelle, France
+This program comes with ABSOLUTELY NO WARRANTY; for details see `LICENCE' file.
+This is free software, and you are welcome to redistribute it under certain
+conditions; see `LICENCE' file for details.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import os
+import io
+import json
+
+from moclib import (ERRCODE_OK, ERRCODE_IOERROR, DEFAULT_CHARSET_PATH,
+                    compile_charset, charset_from_profile, char_name)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_DESCR = "Charset Compiler for ICDAR15 SmartDOC"
+PROG_NAME = "moc_charset"
+
+ERRCODE_MISMATCH = 60
+
+# ==============================================================================
+# Utility private functions
+def _dumpArgs(args, logger=logger):
+    logger.debug("Arguments:")
+    for (k, v) in args.__dict__.items():
+        logger.debug("    %-20s = %s" % (k, v))
+
+_DBGLINELEN = 80
+_DBGSEP = "-"*_DBGLINELEN
+
+def _programHeader(logger, prog_name, prog_version):
+    logger.debug(_DBGSEP)
+    dbg_head = "%s - v. %s" % (prog_name, prog_version)
+    dbg_head_pre = " " * (max(0, (_DBGLINELEN - len(dbg_head)))/2)
+    logger.debug(dbg_head_pre + dbg_head)
+
+def _initLogger(logger, debug=False):
+    format="%(module)-9s %(levelname)-7s: %(message)s"
+    formatter = logging.Formatter(format)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+    logger.setLevel(level)
+
+def _formatChars(text):
+    return u" ".join("U+%04X" % ord(char) for char in text) or u"(empty)"
+
+def _checkProfile(path, allowed_input, transformations):
+    """Compares the profile saved at `path' with the compiled one, returns
+    the list of the differences."""
+    with io.open(path, "rb") as profile_file:
+        other_input, other_transformations = charset_from_profile(
+            json.loads(profile_file.read().decode("utf-8")))
+    differences = []
+    for char in sorted(set(allowed_input) ^ set(other_input)):
+        differences.append("U+%04X is only allowed by the %s." % (
+            ord(char), "spreadsheet" if char in allowed_input else "profile"))
+    if transformations != other_transformations:
+        differences.append("The transformations differ.")
+    return differences
+
+# ==============================================================================
+# Main function
+def main():
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=PROG_DESCR,
+        epilog=__doc__,
+        version=PROG_VERSION)
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output: list the allowed characters and the "
+             "transformations.")
+    parser.add_argument('-o', '--output',
+        help="Path of the profile to write, as JSON.")
+    parser.add_argument('--check',
+        metavar="PROFILE",
+        help="Check that the profile at this path matches the spreadsheet.")
+    parser.add_argument('spreadsheet',
+        nargs="?", default=DEFAULT_CHARSET_PATH,
+        help="Path of the charset spreadsheet (default: char_mapping.ods).")
+    args = parser.parse_args()
+
+    # --------------------------------------------------------------------------
+    # Logger activation
+    _initLogger(logger)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    # --------------------------------------------------------------------------
+    # Output log header
+    _programHeader(logger, PROG_NAME, PROG_VERSION)
+    logger.debug(_DBGSEP)
+    _dumpArgs(args, logger)
+    logger.debug(_DBGSEP)
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    try:
+        with io.open(args.spreadsheet, "rb") as spreadsheet:
+            profile = compile_charset(spreadsheet.read(),
+                                      os.path.basename(args.spreadsheet))
+    except (IOError, OSError) as exc:
+        logger.error("Cannot read %s: %s" % (args.spreadsheet, exc))
+        return ERRCODE_IOERROR
+    except ValueError as exc:
+        logger.error("%s: %s" % (args.spreadsheet, exc))
+        return ERRCODE_MISMATCH
+    allowed_input, transformations = charset_from_profile(profile)
+    logger.info("%s: %d allowed characters (and LF), %d transformations."
+                % (args.spreadsheet, len(allowed_input), len(transformations)))
+    for char in allowed_input:
+        logger.debug("Allowed: U+%04X %s" % (ord(char), char_name(char)))
+    for fr, to in transformations:
+        logger.debug("Transformation: %s to %s"
+                     % (_formatChars(fr), _formatChars(to)))
+
+    ret_code = ERRCODE_OK
+    if args.check:
+        try:
+            differences = _checkProfile(args.check, allowed_input,
+                                        transformations)
+        except (IOError, OSError) as exc:
+            logger.error("Cannot read %s: %s" % (args.check, exc))
+            return ERRCODE_IOERROR
+        except ValueError as exc:
+            differences = [str(exc)]
+        for difference in differences:
+            logger.error("%s: %s" % (args.check, difference))
+        if differences:
+            ret_code = ERRCODE_MISMATCH
+        else:
+            logger.info("%s matches the spreadsheet." % args.check)
+
+    if args.output:
+        try:
+            with io.open(args.output, "wb") as output:
+                output.write(json.dumps(profile, sort_keys=True)
+                             .encode("utf-8"))
+        except (IOError, OSError) as exc:
+            logger.error("Cannot write %s: %s" % (args.output, exc))
+            return ERRCODE_IOERROR
+        logger.info("Profile written to %s." % args.output)
+
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+
+    logger.debug("Clean exit.")
+    logger.debug(_DBGSEP)
+    return ret_code
+    # --------------------------------------------------------------------------
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
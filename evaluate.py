@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC evaluator. Computes the OCR accuracy of normalized results.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program computes the character error rate (CER) and word error rate
+(WER) of OCR results against their ground truth.
+
+Both texts are normalized like `normalize.py' does first, invalid UTF-8
+sequences being read as U+FFFD and listed in the log. Error rates are
+edit distances (insertions, deletions and substitutions) divided by the
+length of the ground truth; words are separated by white space. Aggregate
+rates are the total number of errors divided by the total length of the
+ground truth.
+
+This file is part of the tools used for the evaluation of OCR accuracy in the
+context of the challenge 2 "Mobile OCR Challenge" of the SmartDOC competition
+at ICDAR 2015.
+
+Sample usage:
+    evaluate.py /path/to/result.txt /path/to/ground_truth.txt
+    evaluate.py --batch /path/to/results/dir /path/to/ground_truth/dir
+    evaluate.py --batch --output scores.json results/ ground_truth/
+
+
+Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+                   - L3i / University of La Rochelle, France
+This program comes with ABSOLUTELY NO WARRANTY; for details see `LICENCE' file.
+This is free software, and you are welcome to redistribute it under certain
+conditions; see `LICENCE' file for details.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import json
+
+from moclib import (ERRCODE_OK, ERRCODE_IOERROR, list_batch_jobs, score_batch,
+                    Score)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_DESCR = "OCR Accuracy Evaluator for ICDAR15 SmartDOC"
+PROG_NAME = "moc_eval"
+
+# ==============================================================================
+# Utility private functions
+def _dumpArgs(args, logger=logger):
+    logger.debug("Arguments:")
+    for (k, v) in args.__dict__.items():
+        logger.debug("    %-20s = %s" % (k, v))
+
+_DBGLINELEN = 80
+_DBGSEP = "-"*_DBGLINELEN
+
+def _programHeader(logger, prog_name, prog_version):
+    logger.debug(_DBGSEP)
+    dbg_head = "%s - v. %s" % (prog_name, prog_version)
+    dbg_head_pre = " " * (max(0, (_DBGLINELEN - len(dbg_head)))/2)
+    logger.debug(dbg_head_pre + dbg_head)
+
+def _initLogger(logger, debug=False):
+    format="%(module)-9s %(levelname)-7s: %(message)s"
+    formatter = logging.Formatter(format)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+    logger.setLevel(level)
+
+def _rate(errors, count):
+    """Returns an error rate, or None for an empty ground truth."""
+    if count == 0:
+        return None
+    return float(errors) / count
+
+def _formatRate(rate):
+    if rate is None:
+        return "     n/a"
+    return "%7.2f%%" % (100 * rate)
+
+def _scoreDict(score):
+    return {"char_errors": score.char_errors, "char_count": score.char_count,
+            "word_errors": score.word_errors, "word_count": score.word_count,
+            "cer": _rate(score.char_errors, score.char_count),
+            "wer": _rate(score.word_errors, score.word_count)}
+
+# ==============================================================================
+# Main function
+def main():
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=PROG_DESCR,
+        epilog=__doc__,
+        version=PROG_VERSION)
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+    parser.add_argument('-b', '--batch',
+        action="store_true",
+        help="Batch mode: results is a directory tree or a manifest file "
+             "listing result files (one per line), and ground_truth is the "
+             "directory where the ground truth of each file is found under "
+             "the same relative path.")
+    parser.add_argument('-j', '--jobs',
+        type=int, default=None,
+        help="Number of worker processes in batch mode "
+             "(default: number of CPUs).")
+    parser.add_argument('-p', '--pattern',
+        default="*.txt",
+        help="Files to evaluate when walking a directory in batch mode "
+             "(default: %(default)s).")
+    parser.add_argument('-o', '--output',
+        help="JSON file to write the per-file and aggregate scores to.")
+    parser.add_argument('results',
+        help="OCR result (text file with UTF-8 encoding).")
+    parser.add_argument('ground_truth',
+        help="Ground truth of the OCR result (text file with UTF-8 "
+             "encoding).")
+    args = parser.parse_args()
+
+    # --------------------------------------------------------------------------
+    # Logger activation
+    _initLogger(logger)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    # --------------------------------------------------------------------------
+    # Output log header
+    _programHeader(logger, PROG_NAME, PROG_VERSION)
+    logger.debug(_DBGSEP)
+    _dumpArgs(args, logger)
+    logger.debug(_DBGSEP)
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    if args.batch:
+        pairs = list_batch_jobs(args.results, args.ground_truth, args.pattern)
+    else:
+        pairs = [(args.results, args.ground_truth)]
+    logger.debug("Evaluating %d file(s)." % len(pairs))
+
+    ret_code = ERRCODE_OK
+    total = Score(0, 0, 0, 0)
+    files = []
+    sys.stdout.write("%8s %8s  %s\n" % ("CER", "WER", "file"))
+    for result in score_batch(pairs, args.jobs):
+        if result.score is None:
+            logger.error("%s: %s" % (result.path, result.message))
+            ret_code = ERRCODE_IOERROR
+            continue
+        score = result.score
+        if result.err_count:
+            logger.debug("%s: %d illegal character(s)."
+                         % (result.path, result.err_count))
+        for message in result.encoding_errors:
+            logger.warn(message)
+        total = Score(*[a + b for a, b in zip(total, score)])
+        sys.stdout.write("%s %s  %s\n" % (
+            _formatRate(_rate(score.char_errors, score.char_count)),
+            _formatRate(_rate(score.word_errors, score.word_count)),
+            result.path))
+        files.append(dict(_scoreDict(score), file=result.path,
+                          ground_truth=result.reference_path,
+                          illegal_chars=result.err_count,
+                          invalid_sequences=result.encoding_err_count))
+    sys.stdout.write("%s %s  %s\n" % (
+        _formatRate(_rate(total.char_errors, total.char_count)),
+        _formatRate(_rate(total.word_errors, total.word_count)),
+        "TOTAL (%d file(s))" % len(files)))
+    if args.output:
+        with open(args.output, "wb") as file_output:
+            json.dump({"files": files, "total": _scoreDict(total)},
+                      file_output, indent=2, sort_keys=True)
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+
+    logger.debug("Clean exit.")
+    logger.debug(_DBGSEP)
+    return ret_code
+    # --------------------------------------------------------------------------
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,6 +29,11 @@ at ICDAR 2015.
 
 Sample usage:
     check.py /path/to/utf-8/text/file.txt
+    explore.py --lines 3000000-3000010 /path/to/huge/file.txt
+    explore.py --lines 42 --columns 80-120 /path/to/utf-8/text/file.txt
+    explore.py --only-illegal /path/to/utf-8/text/file.txt
+    explore.py --histogram /path/to/corpus/ other/file.txt
+    explore.py --histogram --format json /path/to/corpus/ > histogram.json
 
 
 Copyright (c) 2015 - J. Chazalon, S. Eskenazi 
@@ -43,10 +48,17 @@ conditions; see `LICENCE' file for details.
 import logging
 import argparse
 import sys
-import unicodedata
 import codecs
 import locale
-import io
+import os
+import json
+
+from moclib import (ERRCODE_OK, ERRCODE_IOERROR, read_lines,
+                    LINE_INDEX_SUFFIX, char_name, scan_illegal, is_ascii,
+                    char_histogram, list_batch_jobs, CHUNK_SIZE)
+# Not used here: constant this program used to define itself, which other
+# programs may still import from it.
+from moclib import ERRCODE_NOFILE
 
 # ==============================================================================
 # Logging
@@ -58,9 +70,8 @@ PROG_VERSION = "1.2"
 PROG_DESCR = "OCR Result Explorer for ICDAR15 SmartDOC"
 PROG_NAME = "moc_expl"
 
-ERRCODE_OK = 0
-ERRCODE_NOFILE = 10
-ERRCODE_IOERROR = 20
+# Number of characters of output written at once.
+_OUTPUT_BUFFER_SIZE = 256 * 1024
 
 # ==============================================================================
 # Utility private functions
@@ -89,8 +100,103 @@ def _initLogger(logger, debug=False):
         level = logging.DEBUG
     logger.setLevel(level)
 
-def _unichr2str(unichar):
-    return unicodedata.name(unichar, repr(unichar))
+def _parseRange(text):
+    """Parses "A-B", "A-", "-B" or "A" as a (first, last) pair of 1-based
+    numbers, last being None for no limit."""
+    first, sep, last = text.partition("-")
+    try:
+        first = int(first) if first else 1
+        last = int(last) if last else None
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid range: %r" % text)
+    if not sep:
+        last = first
+    if first < 1 or (last is not None and last < first):
+        raise argparse.ArgumentTypeError("invalid range: %r" % text)
+    return first, last
+
+class _RowCache(dict):
+    """Maps each character to the end of its row in the output ("U+xxxx"
+    and its name), computed once per code point."""
+    def __missing__(self, char):
+        row = self[char] = u" U+%04x %s\n" % (ord(char), char_name(char))
+        return row
+
+def _illegalPositions(text):
+    """Returns the indexes of the illegal characters of a line, ignoring
+    its end of line."""
+    return [pos - 1 for char, pos in scan_illegal(text.rstrip(u"\r\n"))]
+
+def _nonAsciiPositions(text):
+    """Returns the indexes of the non-ASCII characters of a line."""
+    if is_ascii(text):
+        return []
+    return [pos for pos, char in enumerate(text) if char > u"\x7f"]
+
+def _renderLines(lines, first_line=1, columns=None, select=None):
+    """Yields the description of each line of an iterable of lines, as
+    unicode strings.
+
+    If `select' is given, it is called with the selected columns of each
+    line and returns the indexes of the characters to describe: lines where
+    it returns none are skipped.
+    """
+    rows = _RowCache()
+    prefixes = [] # prefixes[i] starts the row of character i + 1
+    first_col, last_col = columns or (1, None)
+    line_no = first_line - 1
+    for line in lines:
+        line_no += 1
+        selected = line[first_col - 1:last_col]
+        end_col = first_col - 1 + len(selected)
+        while len(prefixes) < end_col:
+            prefixes.append(u"\tc:%03d" % (len(prefixes) + 1))
+        if select is None:
+            body = u"".join([prefix + rows[char] for prefix, char
+                             in zip(prefixes[first_col - 1:end_col],
+                                    selected)])
+        else:
+            positions = select(selected)
+            if not positions:
+                continue
+            body = u"".join([prefixes[first_col - 1 + pos] + rows[selected[pos]]
+                             for pos in positions])
+        yield u"l:%03d (%d char.)\n>>> %s\n%s" % (
+            line_no, len(line), selected.rstrip(u"\r\n"), body)
+
+def _codePoints(text):
+    return u" ".join(u"U+%04X" % ord(char) for char in text) or u"-"
+
+def _listInputs(inputs, pattern):
+    """Returns the files given on the command line, walking directories for
+    files matching `pattern'."""
+    paths = []
+    for path in inputs:
+        if os.path.isdir(path):
+            paths.extend(input_path for input_path, _
+                         in list_batch_jobs(path, "", pattern))
+        else:
+            paths.append(path)
+    return paths
+
+def _renderHistogram(char_counts, format):
+    """Yields the lines describing a list of CharCount, as a table or as a
+    JSON array."""
+    if format == "json":
+        yield json.dumps([{"code_point": "U+%04X" % ord(char), "char": char,
+                           "count": count, "legal": legal,
+                           "normalized": normalized,
+                           "name": char_name(char)}
+                          for char, count, legal, normalized in char_counts],
+                         indent=2)
+        yield u"\n"
+        return
+    yield u"%-8s %12s  %-7s  %-16s %s\n" % (
+        "char", "count", "status", "normalized", "name")
+    for char, count, legal, normalized in char_counts:
+        yield u"U+%04X   %12d  %-7s  %-16s %s\n" % (
+            ord(char), count, "legal" if legal else "ILLEGAL",
+            _codePoints(normalized), char_name(char))
 
 # ==============================================================================
 # Main function
@@ -104,9 +210,48 @@ def main():
     parser.add_argument('-d', '--debug', 
         action="store_true", 
         help="Activate debug output.")
-    parser.add_argument('input', 
-        help='Text file with UTF-8 encoding.')
+    parser.add_argument('--lines', 
+        type=_parseRange, default=(1, None), metavar='A-B',
+        help="Only describe lines A to B (A-, -B and A are accepted too). "
+             "Big files are indexed once, in a %s file saved next to them, "
+             "to find the lines without reading what precedes them."
+             % LINE_INDEX_SUFFIX)
+    parser.add_argument('--columns', 
+        type=_parseRange, default=None, metavar='C-D',
+        help="Only show and describe characters C to D of each line.")
+    only = parser.add_mutually_exclusive_group()
+    only.add_argument('--only-illegal', 
+        action="store_true",
+        help="Only describe illegal characters, and skip lines without "
+             "any.")
+    only.add_argument('--only-non-ascii', 
+        action="store_true",
+        help="Only describe non-ASCII characters, and skip lines without "
+             "any.")
+    parser.add_argument('--histogram', 
+        action="store_true",
+        help="Instead of describing each line, count the occurrences of each "
+             "character over all the input files, and tell whether it is "
+             "legal and what it is normalized to.")
+    parser.add_argument('--format', 
+        choices=("table", "json"), default="table", 
+        help="Output format of --histogram (default: %(default)s).")
+    parser.add_argument('-j', '--jobs', 
+        type=int, default=None, 
+        help="Number of worker processes for --histogram "
+             "(default: number of CPUs).")
+    parser.add_argument('-p', '--pattern', 
+        default="*.txt", 
+        help="Files to count when walking a directory with --histogram "
+             "(default: %(default)s).")
+    parser.add_argument('inputs', 
+        nargs="+", metavar='input',
+        help="Text file with UTF-8 encoding. With --histogram, any number of "
+             "files and directories.")
     args = parser.parse_args()
+    if not args.histogram and len(args.inputs) > 1:
+        parser.error("only one input file can be explored, unless "
+                     "--histogram is given")
 
     # -----------------------------------------------------------------------------
     # Logger activation
@@ -142,26 +287,45 @@ def main():
         except AttributeError:
             sys.stdout = encoder(sys.stdout, 'xmlcharrefreplace')
 
-    line_no = 0
+    first_line, last_line = args.lines
+    errors = []
+    select = None
+    if args.only_illegal:
+        select = _illegalPositions
+    elif args.only_non_ascii:
+        select = _nonAsciiPositions
     try:
-        with io.open(args.input, 'rt', encoding="UTF-8", 
-                     newline='', errors="strict") as file_input:
-            for line in file_input:
-                line_no += 1
-                char_no = 0
-                sys.stdout.write("l:%03d (%d char.)\n" % (line_no, len(line)))
-                sys.stdout.write(u">>> %s\n" % line.rstrip('\r\n'))
-                for char in line:
-                    char_no += 1
-                    sys.stdout.write("\tc:%03d U+%04x %s\n" 
-                                     % (char_no, ord(char), _unichr2str(char)))
-    except IOError:
+        if args.histogram:
+            def on_error(path, message):
+                logger.error("%s: %s" % (path, message))
+                errors.append(path)
+            char_counts = char_histogram(_listInputs(args.inputs, args.pattern),
+                                         args.jobs, CHUNK_SIZE, on_error)
+            texts = _renderHistogram(char_counts, args.format)
+        else:
+            lines = read_lines(args.inputs[0], first_line, last_line)
+            texts = _renderLines(lines, first_line, args.columns, select)
+        buffered = []
+        buffered_size = 0
+        for text in texts:
+            buffered.append(text)
+            buffered_size += len(text)
+            if buffered_size >= _OUTPUT_BUFFER_SIZE:
+                sys.stdout.write(u"".join(buffered))
+                buffered = []
+                buffered_size = 0
+        sys.stdout.write(u"".join(buffered))
+    except (IOError, OSError): # OSError: stat of the file to index
         logger.debug("IO Error.")
         return ERRCODE_IOERROR
 
     logger.debug("--- Process complete. ---")
     # --------------------------------------------------------------------------
 
+    if errors:
+        logger.error("%d file(s) could not be read entirely." % len(errors))
+        return ERRCODE_IOERROR
+
     logger.debug("Clean exit.")
     logger.debug(_DBGSEP)
     return ERRCODE_OK
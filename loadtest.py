@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC server load test. Measures the latency of a SmartDOC-MOC server.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program sends check requests to a running `server.py' from several
+concurrent connections, and reports the latency percentiles and throughput
+of the server.
+
+Each connection sends its requests one after the other, cycling through the
+input files. Files are read by the server, unless `--inline' is given.
+
+Sample usage:
+    loadtest.py /path/to/corpus/*.txt
+    loadtest.py --connections 8 --requests 200 --inline file.txt
+    loadtest.py --address /tmp/moc.sock --output results.json file.txt
+
+
+Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+                   - L3i / University of La Rochelle, France
+This program comes with ABSOLUTELY NO WARRANTY; for details see `LICENCE' file.
+This is free software, and you are welcome to redistribute it under certain
+conditions; see `LICENCE' file for details.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import os
+import json
+import math
+import threading
+from timeit import default_timer
+
+from moclib import (ERRCODE_OK, ERRCODE_IOERROR, ERRCODE_EXTRACHAR,
+                    DEFAULT_SERVER_ADDRESS, ServerClient, open_input)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_DESCR = "Load Test of the OCR Result Checking Server for ICDAR15 SmartDOC"
+PROG_NAME = "moc_loadtest"
+
+PERCENTILES = (50, 90, 99)
+
+# ==============================================================================
+# Utility private functions
+def _dumpArgs(args, logger=logger):
+    logger.debug("Arguments:")
+    for (k, v) in args.__dict__.items():
+        logger.debug("    %-20s = %s" % (k, v))
+
+_DBGLINELEN = 80
+_DBGSEP = "-"*_DBGLINELEN
+
+def _programHeader(logger, prog_name, prog_version):
+    logger.debug(_DBGSEP)
+    dbg_head = "%s - v. %s" % (prog_name, prog_version)
+    dbg_head_pre = " " * (max(0, (_DBGLINELEN - len(dbg_head)))/2)
+    logger.debug(dbg_head_pre + dbg_head)
+
+def _initLogger(logger, debug=False):
+    format="%(module)-9s %(levelname)-7s: %(message)s"
+    formatter = logging.Formatter(format)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+    logger.setLevel(level)
+
+def _percentile(values, percent):
+    """Returns the nearest-rank percentile of sorted values."""
+    rank = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+def _connection(args, requests, latencies, failures):
+    """Sends requests one after the other on a new connection, appends their
+    latencies in seconds, and the unexpected responses."""
+    try:
+        with ServerClient(args.address) as client:
+            for request in requests:
+                start = default_timer()
+                response = client.request(request)
+                latencies.append(default_timer() - start)
+                if response["ret_code"] not in (ERRCODE_OK, ERRCODE_EXTRACHAR):
+                    failures.append(response)
+    except EnvironmentError as exc:
+        failures.append({"error": str(exc)})
+
+# ==============================================================================
+# Main function
+def main():
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=PROG_DESCR,
+        epilog=__doc__,
+        version=PROG_VERSION)
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+    parser.add_argument('-a', '--address',
+        default=DEFAULT_SERVER_ADDRESS,
+        help="Address of the server: host:port, or the path of a Unix socket "
+             "(default: %(default)s).")
+    parser.add_argument('-c', '--connections',
+        type=int, default=4,
+        help="Number of concurrent connections (default: %(default)s).")
+    parser.add_argument('-n', '--requests',
+        type=int, default=100,
+        help="Number of requests sent by each connection "
+             "(default: %(default)s).")
+    parser.add_argument('--inline',
+        action="store_true",
+        help="Send the content of the files instead of their paths.")
+    parser.add_argument('-o', '--output',
+        help="JSON file to write the results to.")
+    parser.add_argument('inputs',
+        nargs="+",
+        help="Text files with UTF-8 encoding to check.")
+    args = parser.parse_args()
+    if args.connections < 1 or args.requests < 1:
+        parser.error("--connections and --requests must be at least 1")
+
+    # --------------------------------------------------------------------------
+    # Logger activation
+    _initLogger(logger)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    # --------------------------------------------------------------------------
+    # Output log header
+    _programHeader(logger, PROG_NAME, PROG_VERSION)
+    logger.debug(_DBGSEP)
+    _dumpArgs(args, logger)
+    logger.debug(_DBGSEP)
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    requests = []
+    for path in args.inputs:
+        if args.inline:
+            with open_input(path) as file_input:
+                requests.append({"command": "check", "text": file_input.read()})
+        else:
+            requests.append({"command": "check",
+                             "input": os.path.abspath(path)})
+
+    latencies = []
+    failures = []
+    threads = []
+    for index in range(args.connections):
+        sequence = [requests[(index + i) % len(requests)]
+                    for i in range(args.requests)]
+        threads.append(threading.Thread(
+            target=_connection, args=(args, sequence, latencies, failures)))
+    start = default_timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = default_timer() - start
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+
+    for failure in failures[:5]:
+        logger.error("Unexpected response: %s" % json.dumps(failure))
+    if not latencies:
+        logger.error("No request succeeded.")
+        return ERRCODE_IOERROR
+
+    latencies.sort()
+    results = {"connections": args.connections,
+               "requests": len(latencies),
+               "failures": len(failures),
+               "seconds": elapsed,
+               "throughput": len(latencies) / elapsed,
+               "latency": dict(("p%d" % percent,
+                                _percentile(latencies, percent))
+                               for percent in PERCENTILES)}
+    results["latency"]["max"] = latencies[-1]
+    logger.info("%d requests in %.2fs from %d connections: %.1f requests/s."
+                % (len(latencies), elapsed, args.connections,
+                   results["throughput"]))
+    for percent in PERCENTILES:
+        logger.info("    p%-3d latency: %8.2f ms"
+                    % (percent, 1000 * results["latency"]["p%d" % percent]))
+    logger.info("    max  latency: %8.2f ms" % (1000 * latencies[-1]))
+    if args.output:
+        with open(args.output, "wb") as file_output:
+            json.dump(results, file_output, indent=2, sort_keys=True)
+
+    ret_code = ERRCODE_OK
+    if failures:
+        logger.error("%d request(s) failed." % len(failures))
+        ret_code = ERRCODE_IOERROR
+
+    logger.debug("Clean exit.")
+    logger.debug(_DBGSEP)
+    return ret_code
+    # --------------------------------------------------------------------------
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
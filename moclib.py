@@ -0,0 +1,3236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC shared library. Character set definition and checking engine.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module contains the definitions shared by the SmartDOC-MOC tools: the
+allowed character set and the engine used to find illegal characters.
+
+The programs `check.py', `normalize.py' and `explore.py' are thin command line
+wrappers around the functions of this module, so it must be kept in the same
+directory as those programs. It can also be imported to check and normalize
+many files from a single Python process:
+
+    import moclib
+    report = moclib.normalize_file("result.txt", "normalized.txt")
+    if report.ret_code != moclib.ERRCODE_OK:
+        for line_error in report.line_errors:
+            print("\n".join(moclib.format_line_error(line_error)))
+
+
+Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+                   - L3i / University of La Rochelle, France
+This program comes with ABSOLUTELY NO WARRANTY; for details see `LICENCE' file.
+This is free software, and you are welcome to redistribute it under certain
+conditions; see `LICENCE' file for details.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import io
+import codecs
+import os
+import fnmatch
+import multiprocessing
+import re
+import unicodedata
+import hashlib
+import json
+import csv
+import sys
+import gzip
+import bz2
+import zipfile
+import tarfile
+import tempfile
+import shutil
+import time
+import struct
+import base64
+import functools
+import errno
+import socket
+import threading
+import select
+from collections import namedtuple, OrderedDict
+from xml.etree import ElementTree
+from timeit import default_timer
+
+try:
+    import fcntl
+except ImportError: # Windows, see `ResultCache.evict'
+    fcntl = None
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError: # optional, see `_Inotify'
+    ctypes = None
+
+try:
+    import lzma
+except ImportError: # Python 2: optional backport, see `open_compressed'
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+ERRCODE_OK = 0
+ERRCODE_NOFILE = 10
+ERRCODE_IOERROR = 20
+ERRCODE_BADREQUEST = 30
+ERRCODE_EXTRACHAR = 50
+
+CHAR_ERR_LIM = 5
+
+# ==============================================================================
+# Character set profiles
+# The allowed character set and the transformations are compiled from a
+# spreadsheet, `char_mapping.ods' by default: the "mapping" sheet gives, for
+# each character, whether it is allowed in input, the code points it is
+# normalized to, and whether this results from Unicode normalization or from a
+# manual transformation. Another profile, for another challenge, can be chosen
+# with the MOC_CHARSET environment variable: the path of a spreadsheet in the
+# same format, or of a profile compiled by `compile_charset.py'.
+#
+# Compiled profiles hold a bitmap of the allowed code points and the list of
+# transformations. They are cached on disk, keyed on the content of the
+# spreadsheet, so that programs do not parse it again on each start.
+CHARSET_VERSION = 1
+
+# Directory where the compiled profiles and the normalization table are cached.
+# May be overridden with the MOC_CACHE_DIR environment variable.
+CACHE_DIR = os.environ.get(
+    "MOC_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "moc_normalization"))
+
+DEFAULT_CHARSET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    "char_mapping.ods")
+CHARSET_PATH = os.environ.get("MOC_CHARSET", DEFAULT_CHARSET_PATH)
+
+# Sheet and column titles of the spreadsheet.
+CHARSET_SHEET = "mapping"
+_CHARSET_COLUMNS = ("Code point", "Allowed in input?",
+                    "Normalized code point sequence", "Final char?",
+                    "Tr. stage")
+
+# Transformation stages done by Unicode normalization alone, or followed by
+# the manual transformations of the characters it outputs: no rule is needed
+# for the characters of these stages.
+_NORMALIZATION_STAGES = ("normalization", "norm+manual")
+
+# End of lines never reach the checker, as files are read with universal
+# newlines: LF is allowed separately (see ALLOWED_CHARS), CR is not a
+# character of the text.
+_EOL_CHARS = u"\n\r"
+
+_ODS_TABLE = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+_ODS_TEXT = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+_ODS_MAX_REPEAT = 64
+_CODE_POINT_RE = re.compile(r"^U\+([0-9A-Fa-f]{4,6})$")
+_NONZERO_BYTE_RE = re.compile(b"[^\x00]")
+
+def _unichr(code):
+    """Returns the character of a code point, as a surrogate pair on narrow
+    Python builds."""
+    try:
+        return unichr(code)
+    except NameError: # Python 3
+        return chr(code)
+    except ValueError:
+        return struct.pack("<I", code).decode("UTF-32-LE")
+
+def _ods_rows(data, sheet):
+    """Yields the rows of a sheet of an OpenDocument spreadsheet (the content
+    of an .ods file) as lists of cell texts. Repeated empty rows and cells
+    are only given once."""
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            root = ElementTree.fromstring(archive.read("content.xml"))
+    except (zipfile.BadZipfile, KeyError, ElementTree.ParseError) as exc:
+        raise ValueError("Not an OpenDocument spreadsheet: %s" % exc)
+    for table in root.iter(_ODS_TABLE + "table"):
+        if table.get(_ODS_TABLE + "name") == sheet:
+            break
+    else:
+        raise ValueError("No sheet named %r." % sheet)
+    for row in table.iter(_ODS_TABLE + "table-row"):
+        cells = []
+        for cell in row: # Both table-cell and covered-table-cell
+            text = u"\n".join(u"".join(paragraph.itertext())
+                              for paragraph in cell.findall(_ODS_TEXT + "p"))
+            repeat = int(cell.get(_ODS_TABLE + "number-columns-repeated", 1))
+            cells.extend([text] * min(repeat, _ODS_MAX_REPEAT))
+        yield cells
+
+def _parse_code_points(text):
+    """Parses a "U+0041 U+0045" sequence, or "NONE (discarded)"."""
+    if text.startswith("NONE"):
+        return u""
+    sequence = []
+    for code in text.split():
+        match = _CODE_POINT_RE.match(code)
+        if match is None:
+            raise ValueError("Invalid code point: %r." % code)
+        sequence.append(_unichr(int(match.group(1), 16)))
+    return u"".join(sequence)
+
+def _read_charset_sheet(data):
+    """Returns the (code, char, allowed, normalized, status, stage) tuples of
+    the rows of the mapping sheet which describe a character, code being the
+    "U+XXXX" code point. A character described again further down, as in the
+    "Extra characters" part, takes the last description, at the place of the
+    first one."""
+    rows = _ods_rows(data, CHARSET_SHEET)
+    for header in rows:
+        if _CHARSET_COLUMNS[0] in header:
+            break
+    else:
+        raise ValueError("No header row in sheet %r." % CHARSET_SHEET)
+    try:
+        columns = [header.index(title) for title in _CHARSET_COLUMNS]
+    except ValueError:
+        raise ValueError("Sheet %r must have the columns: %s."
+                         % (CHARSET_SHEET, ", ".join(_CHARSET_COLUMNS)))
+    entries = OrderedDict()
+    for cells in rows:
+        cells = [cell.strip() for cell in cells]
+        cells += [u""] * (max(columns) + 1 - len(cells))
+        code, allowed, normalized, status, stage = [cells[column]
+                                                    for column in columns]
+        if _CODE_POINT_RE.match(code) is None: # Titles, totals and notes
+            continue
+        char = _parse_code_points(code)
+        entries[char] = (code, char, allowed == "YES",
+                         _parse_code_points(normalized) if allowed == "YES"
+                         else None, status, stage)
+    return list(entries.values())
+
+def _check_charset(entries, allowed_input, transformations):
+    """Returns the list of the rows of the sheet the profile disagrees with,
+    as messages."""
+    allowed_chars = frozenset(allowed_input + u"\n")
+    errors = []
+    for code, char, allowed, normalized, status, stage in entries:
+        if char in _EOL_CHARS:
+            continue
+        if not allowed:
+            if char in allowed_chars:
+                errors.append("%s is allowed but should not be." % code)
+            continue
+        # Combining marks are given with the SPACE they must follow.
+        source = normalized if status == "SAME SEQ." else char
+        result = unicodedata.normalize("NFKC", source)
+        for fr, to in transformations:
+            result = result.replace(fr, to)
+        if result != normalized:
+            errors.append("%s is normalized to %r instead of %r."
+                          % (code, result, normalized))
+        elif not allowed_chars.issuperset(result):
+            errors.append("%s is normalized to illegal characters." % code)
+    return errors
+
+def _charset_bitmap(chars):
+    """Packs a set of characters into a bitmap of their code points, bit
+    `code % 8' of byte `code // 8' being set for each of them."""
+    codes = [ord(char) for char in chars]
+    bitmap = bytearray(max(codes) // 8 + 1)
+    for code in codes:
+        bitmap[code >> 3] |= 1 << (code & 7)
+    return bitmap
+
+def _charset_chars(bitmap):
+    """Unpacks a bitmap built by `_charset_bitmap' into a sorted string."""
+    # The bitmap is mostly made of zero bytes, skipped by the regex.
+    return u"".join(_unichr(match.start() << 3 | bit)
+                    for match in _NONZERO_BYTE_RE.finditer(bytes(bitmap))
+                    for bit in range(8) if bitmap[match.start()] >> bit & 1)
+
+def compile_charset(data, name=None):
+    """Compiles a charset spreadsheet into a profile.
+
+    `data' is the content of an .ods file in the format of `char_mapping.ods'.
+    The allowed characters are the allowed characters of the spreadsheet and
+    the characters they are normalized to, end of lines excepted. Characters
+    which are not transformed by Unicode normalization get a transformation
+    rule, in the order of the spreadsheet. The profile is then checked
+    against every row of the spreadsheet: it must allow exactly the allowed
+    characters, and normalize each of them as given. Raises ValueError if it
+    does not.
+
+    Returns the profile as a dict which can be saved as JSON, with the
+    base64-encoded bitmap of the allowed code points under "allowed" and the
+    list of [from, to] rules under "transformations".
+    """
+    entries = _read_charset_sheet(data)
+    allowed_chars = set()
+    transformations = []
+    for code, char, allowed, normalized, status, stage in entries:
+        if not allowed or char in _EOL_CHARS:
+            continue
+        allowed_chars.add(char)
+        allowed_chars.update(normalized)
+        if status == "TRANSFORMED" and stage not in _NORMALIZATION_STAGES:
+            transformations.append((char, normalized))
+    if not allowed_chars:
+        raise ValueError("No allowed character.")
+    allowed_input = u"".join(sorted(allowed_chars))
+    errors = _check_charset(entries, allowed_input, transformations)
+    if errors:
+        raise ValueError("The profile does not match the spreadsheet: %s"
+                         % " ".join(errors))
+    return {
+        "version": CHARSET_VERSION,
+        "name": name,
+        "source_sha1": hashlib.sha1(data).hexdigest(),
+        "unidata_version": unicodedata.unidata_version,
+        "allowed": base64.b64encode(bytes(_charset_bitmap(allowed_chars)))
+                   .decode("ascii"),
+        "transformations": [[fr, to] for fr, to in transformations],
+        }
+
+def charset_from_profile(profile):
+    """Returns the (allowed input, transformations) pair of a compiled
+    profile, see ALLOWED_INPUT and TRANSFORMATIONS. Raises ValueError if it
+    is not a profile of this version."""
+    try:
+        if profile["version"] != CHARSET_VERSION:
+            raise ValueError("Unsupported charset profile version: %r."
+                             % profile["version"])
+        bitmap = bytearray(base64.b64decode(profile["allowed"]))
+        transformations = [(fr, to) for fr, to in profile["transformations"]]
+    except (KeyError, TypeError) as exc:
+        raise ValueError("Invalid charset profile: %r." % exc)
+    return _charset_chars(bitmap), transformations
+
+def load_charset(path=CHARSET_PATH, cache_dir=CACHE_DIR):
+    """Loads the charset profile of a spreadsheet or a compiled profile.
+
+    Returns the (allowed input, transformations) pair of the profile. Files
+    ending with ".json" are compiled profiles. Spreadsheets are compiled once
+    and cached: the cache is only an optimization, used if it can be read or
+    written. Raises IOError if the file cannot be read, ValueError if it is
+    not a valid profile.
+    """
+    with open(path, "rb") as charset_file:
+        data = charset_file.read()
+    if path.endswith(".json"):
+        return charset_from_profile(json.loads(data.decode("utf-8")))
+    digest = hashlib.sha1()
+    digest.update(repr((CHARSET_VERSION, unicodedata.unidata_version))
+                  .encode("utf-8"))
+    digest.update(data)
+    key = digest.hexdigest()
+    cache_path = os.path.join(cache_dir, "charset-%s.json" % key)
+    try:
+        with open(cache_path, "rb") as cache_file:
+            content = json.loads(cache_file.read().decode("utf-8"))
+        if content["key"] == key:
+            return charset_from_profile(content["profile"])
+        logger.debug("Ignoring charset profile %s: key mismatch." % cache_path)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        logger.debug("No valid charset profile at %s." % cache_path)
+
+    profile = compile_charset(data, os.path.basename(path))
+    tmp_path = "%s.%d.tmp" % (cache_path, os.getpid())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(tmp_path, "wb") as cache_file:
+            cache_file.write(json.dumps({"key": key, "profile": profile})
+                             .encode("utf-8"))
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        logger.debug("Could not cache charset profile to %s." % cache_path)
+    return charset_from_profile(profile)
+
+def _load_default_charset():
+    """Loads the profile of CHARSET_PATH when this module is imported.
+
+    Every program imports this module before it can handle errors itself: if
+    the profile cannot be loaded, we exit with ERRCODE_IOERROR and a message
+    naming it, rather than with a traceback.
+    """
+    try:
+        return load_charset()
+    except (IOError, OSError, ValueError) as exc:
+        sys.stderr.write("ERROR  : Cannot load the character set profile %s "
+                         "(%s). It must sit next to moclib.py, or be given "
+                         "with the MOC_CHARSET environment variable.\n"
+                         % (CHARSET_PATH, exc))
+        raise SystemExit(ERRCODE_IOERROR)
+
+# Characters allowed in input files, besides LF, and transformations applied
+# after Unicode normalization, as (from, to) rules applied in turn.
+ALLOWED_INPUT, TRANSFORMATIONS = _load_default_charset()
+
+# ==============================================================================
+# Character set checking engine
+# Characters accepted in input files: allowed set plus '\n' (LF) EOL, as files
+# are read with universal newlines.
+ALLOWED_CHARS = frozenset(ALLOWED_INPUT + u'\u000a')
+
+# Matches any character outside of the allowed set. Lines without illegal
+# characters are accepted with a single regex scan, and we only loop in Python
+# over the characters which were actually reported.
+_ILLEGAL_RE = re.compile(
+    u"[^%s]" % u"".join(re.escape(char) for char in sorted(ALLOWED_CHARS)))
+
+def is_legal(char):
+    """Tells whether a single character belongs to the allowed set."""
+    return char in ALLOWED_CHARS
+
+def find_illegal(line):
+    """Returns the list of (char, char_no) for each illegal character of a line.
+
+    Character positions start at 1. An empty list means the line is clean.
+    """
+    return [(match.group(), match.start() + 1)
+            for match in _ILLEGAL_RE.finditer(line)]
+
+def iter_illegal(line):
+    """Iterates over the illegal characters of a line, see `find_illegal'.
+
+    Characters are found as they are consumed, so the caller can stop early.
+    """
+    for match in _ILLEGAL_RE.finditer(line):
+        yield match.group(), match.start() + 1
+
+# Optional NumPy backend: long texts are checked at once by looking their code
+# points up in a boolean table. It is used if NumPy is installed, unless the
+# MOC_NO_NUMPY environment variable is set or USE_NUMPY is set to False.
+# Shorter texts are faster to check with the regex. NumPy is only imported
+# when a long text comes, so that checking small files does not pay for it.
+USE_NUMPY = not os.environ.get("MOC_NO_NUMPY")
+NUMPY_MIN_LENGTH = 4096
+
+numpy = None
+
+def _use_numpy(length):
+    """Tells whether a text of `length' code units is processed with NumPy,
+    importing it on first use."""
+    global numpy, USE_NUMPY
+    if not USE_NUMPY or length < NUMPY_MIN_LENGTH:
+        return False
+    if numpy is None:
+        try:
+            import numpy
+        except ImportError: # optional, see `scan_illegal'
+            USE_NUMPY = False
+            return False
+    return True
+
+# Size and encoding of the code units of unicode strings, which are UTF-16 code
+# units on narrow Python builds.
+if sys.maxunicode > 0xFFFF:
+    _UNIT_SIZE, _UNIT_ENCODING = 4, "UTF-32-LE"
+else:
+    _UNIT_SIZE, _UNIT_ENCODING = 2, "UTF-16-LE"
+
+_legal_table = None
+
+def _get_legal_table():
+    """Returns the NumPy boolean table of legal code points, built once."""
+    global _legal_table
+    if _legal_table is None:
+        codes = [ord(char) for char in ALLOWED_CHARS]
+        # The last entry stands for all the code points above: illegal.
+        _legal_table = numpy.zeros(max(codes) + 2, dtype=bool)
+        _legal_table[codes] = True
+    return _legal_table
+
+def _code_units(text):
+    """Returns the code units of a non-empty unicode string as a NumPy array."""
+    try:
+        # Python 2 unicode strings expose their code units without a copy.
+        return numpy.frombuffer(text, dtype="=u%d" % _UNIT_SIZE)
+    except (TypeError, ValueError):
+        return numpy.frombuffer(text.encode(_UNIT_ENCODING),
+                                dtype="<u%d" % _UNIT_SIZE)
+
+def _iter_illegal_numpy(text):
+    """Same as `iter_illegal', vectorized with NumPy."""
+    legal = _get_legal_table().take(_code_units(text), mode="clip")
+    for pos in numpy.flatnonzero(~legal).tolist():
+        yield text[pos], pos + 1
+
+def scan_illegal(text):
+    """Iterates over the illegal characters of a text like `iter_illegal',
+    using the NumPy backend for long texts when it is enabled."""
+    if _use_numpy(len(text)):
+        return _iter_illegal_numpy(text)
+    return iter_illegal(text)
+
+# ==============================================================================
+# Transformation engine
+def _transform_chain(unistr, transformations=TRANSFORMATIONS):
+    """Reference implementation: applies each rule in turn with `replace`."""
+    s2 = unistr
+    for fr, to in transformations:
+        s2 = s2.replace(fr, to)
+    return s2
+
+# Matches any text some rule of TRANSFORMATIONS applies to.
+_RULE_SOURCES_RE = re.compile(
+    u"|".join(re.escape(fr) for fr, to in TRANSFORMATIONS))
+
+def _transform_counted(unistr, rule_counts):
+    """Same as `transform', also adding to `rule_counts' the number of times
+    each rule fired."""
+    if _RULE_SOURCES_RE.search(unistr) is None:
+        return unistr
+    for index, (fr, to) in enumerate(TRANSFORMATIONS):
+        count = unistr.count(fr)
+        if count:
+            rule_counts[index] += count
+            unistr = unistr.replace(fr, to)
+    return unistr
+
+def _compile_transformations(transformations):
+    """Compiles a list of (from, to) rules into a list of steps.
+
+    Consecutive rules replacing a single character are merged into one
+    `translate` table: each source character is mapped to the result of the
+    whole group of rules applied to it, which is exactly what the chained
+    `replace` calls produce. `translate` handles empty and multi-character
+    outputs natively. Rules with a multi-character source cannot go into a
+    table and are kept as plain (from, to) replace steps.
+
+    Tables are lists indexed by code point, which `translate` reads much
+    faster than a dict. Characters past the end of a table raise IndexError,
+    which `translate` takes as "leave unchanged".
+    """
+    steps = []
+    group = []
+    for rule in transformations + [None]:
+        if rule is not None and len(rule[0]) == 1:
+            group.append(rule)
+            continue
+        if group:
+            table = list(range(max(ord(fr) for fr, _to in group) + 1))
+            for fr, _to in group:
+                table[ord(fr)] = _transform_chain(fr, group)
+            steps.append(table)
+            group = []
+        if rule is not None:
+            steps.append(rule)
+    return steps
+
+_TRANSFORM_STEPS = _compile_transformations(TRANSFORMATIONS)
+
+def transform(unistr):
+    """Applies TRANSFORMATIONS to a Unicode string in a single pass."""
+    for step in _TRANSFORM_STEPS:
+        if isinstance(step, list):
+            unistr = unistr.translate(step)
+        else:
+            unistr = unistr.replace(*step)
+    return unistr
+
+# ==============================================================================
+# Normalization
+_NON_ASCII_RE = re.compile(u"[^\x00-\x7f]")
+
+# NFKC leaves ASCII text untouched, so on ASCII-only input normalization boils
+# down to the transformations of ASCII characters (HTAB to SPACE). All rules
+# replace single characters, so each ASCII character can be resolved alone.
+_ASCII_RULES = [(unichr(code), transform(unichr(code))) for code in range(128)
+                if transform(unichr(code)) != unichr(code)]
+
+def is_ascii(unistr):
+    """Tells whether a Unicode string contains only ASCII characters."""
+    return _NON_ASCII_RE.search(unistr) is None
+
+def _normalize_full(unistr):
+    """Reference normalization: NFKC then TRANSFORMATIONS, for any input."""
+    return transform(unicodedata.normalize('NFKC', unistr))
+
+# ------------------------------------------------------------------------------
+# Per-code-point normalization table
+#
+# The allowed alphabet is small and closed, so the result of NFKC followed by
+# TRANSFORMATIONS can be precomputed for each allowed character. A string made
+# only of such characters is then normalized by a table lookup, and NFKC is only
+# needed when a combining mark (or any character outside of the table) calls
+# for canonical reordering or composition.
+#
+# This only holds for starters whose decomposition starts with a starter: NFKC
+# can then only compose two adjacent characters, so the table is checked
+# against NFKC on every pair of characters when it is built. The table is
+# cached on disk, keyed on the character set, the transformations and the
+# version of the Unicode database.
+NORM_TABLE_VERSION = 1
+
+def _norm_table_key():
+    """Returns the fingerprint identifying a normalization table."""
+    digest = hashlib.sha1()
+    digest.update(repr((NORM_TABLE_VERSION, unicodedata.unidata_version,
+                        ALLOWED_INPUT, TRANSFORMATIONS)).encode("utf-8"))
+    return digest.hexdigest()
+
+def build_norm_table():
+    """Computes the normalization table of the allowed character set.
+
+    Returns a dict mapping each character which can be normalized alone to
+    its normalized form (NFKC then TRANSFORMATIONS).
+    """
+    candidates = []
+    for char in sorted(ALLOWED_CHARS):
+        decomposed = unicodedata.normalize('NFKD', char)
+        if (unicodedata.combining(char) == 0
+                and unicodedata.combining(decomposed[0]) == 0):
+            candidates.append(char)
+    table = dict((char, _normalize_full(char)) for char in candidates)
+    for first in candidates:
+        for second in candidates:
+            if (_normalize_full(first + second)
+                    != table.get(first, first) + table.get(second, second)):
+                table.pop(first, None)
+                table.pop(second, None)
+    return table
+
+def load_norm_table(cache_dir=CACHE_DIR):
+    """Loads the normalization table from the cache, building it if needed.
+
+    The cache is only an optimization: if it cannot be read or written, the
+    table is simply built in memory.
+    """
+    key = _norm_table_key()
+    path = os.path.join(cache_dir, "normtable-%s.json" % key)
+    try:
+        with open(path, "rb") as cache_file:
+            content = json.loads(cache_file.read().decode("utf-8"))
+        if content["key"] == key:
+            return dict(content["table"])
+        logger.debug("Ignoring normalization table %s: key mismatch." % path)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        logger.debug("No valid normalization table at %s." % path)
+
+    table = build_norm_table()
+    content = {
+        "key": key,
+        "version": NORM_TABLE_VERSION,
+        "unidata_version": unicodedata.unidata_version,
+        "table": sorted(table.items()),
+        }
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        with open(tmp_path, "wb") as cache_file:
+            cache_file.write(json.dumps(content).encode("utf-8"))
+        os.rename(tmp_path, path)
+    except (IOError, OSError):
+        logger.debug("Could not cache normalization table to %s." % path)
+    return table
+
+_norm_tables = None
+
+def _get_norm_tables():
+    """Returns the compiled (translate table, fallback regex) pair.
+
+    The translate table maps each code point of the normalization table to
+    its normalized form; the regex matches any character which is not in the
+    normalization table. Both are loaded on first use.
+    """
+    global _norm_tables
+    if _norm_tables is None:
+        table = load_norm_table()
+        translate_table = list(range(max(ord(char) for char in table) + 1))
+        for char, normalized in table.items():
+            translate_table[ord(char)] = normalized
+        fallback_re = re.compile(
+            u"[^%s]" % u"".join(re.escape(char) for char in sorted(table)))
+        _norm_tables = (translate_table, fallback_re)
+    return _norm_tables
+
+# ------------------------------------------------------------------------------
+def _normalize_table(line):
+    """Normalizes a line made only of characters of the normalization table."""
+    if is_ascii(line):
+        for fr, to in _ASCII_RULES:
+            line = line.replace(fr, to)
+        return line
+    return line.translate(_get_norm_tables()[0])
+
+def normalize_line(line):
+    """Normalizes a line: Unicode NFKC normalization then TRANSFORMATIONS.
+
+    ASCII-only lines skip NFKC and only get the ASCII rules applied. Lines
+    made only of characters from the normalization table are translated in
+    one pass. Both give the same result as the full pipeline at a fraction of
+    the cost, which is only used for the remaining lines.
+    """
+    if _get_norm_tables()[1].search(line) is None:
+        return _normalize_table(line)
+    return _normalize_full(line)
+
+def _check_normalize(line):
+    """Checks and normalizes a line, scanning it only once when it is clean.
+
+    Returns a (illegal characters, normalized line) tuple, where illegal
+    characters are given by an iterable as returned by `iter_illegal'. Every
+    character of the normalization table is legal, so lines made only of such
+    characters need no further check.
+    """
+    if _get_norm_tables()[1].search(line) is None:
+        return (), _normalize_table(line)
+    return scan_illegal(line), _normalize_full(line)
+
+def _check_normalize_stats(line, stats):
+    """Same as `_check_normalize', recording statistics in `stats'.
+
+    NFKC and transformations are applied as separate steps, so that they can
+    be timed and counted.
+    """
+    start = default_timer()
+    if _get_norm_tables()[1].search(line) is None:
+        illegal_chars = ()
+    else:
+        illegal_chars = list(scan_illegal(line))
+    check_end = default_timer()
+    nfkc = unicodedata.normalize("NFKC", line)
+    stats._add_nfkc_lines(line, nfkc)
+    nfkc_end = default_timer()
+    normalized = _transform_counted(nfkc, stats.rule_counts)
+    transform_end = default_timer()
+    stats.times["check"] += check_end - start
+    stats.times["nfkc"] += nfkc_end - check_end
+    stats.times["transform"] += transform_end - nfkc_end
+    return illegal_chars, normalized
+
+def check_normalize_line(line):
+    """Checks and normalizes a line, scanning it only once when it is clean.
+
+    Returns a (extra_chars, normalized line) tuple, where extra_chars is the
+    list returned by `find_illegal`.
+    """
+    illegal_chars, normalized = _check_normalize(line)
+    return list(illegal_chars), normalized
+
+# ==============================================================================
+# Library API
+# Size of the blocks files are read and written by, in bytes.
+BUFFER_SIZE = 1024 * 1024
+
+# Number of characters searched backwards for a safe place to cut a line.
+_CUT_LOOKBEHIND = 64
+
+# Maximum number of LineError kept in a Report.
+LINE_ERR_LIM = 1000
+
+# One entry per line containing illegal characters. err_count is the number of
+# illegal characters in the line, extra_chars the list of (char, char_no) for
+# the first CHAR_ERR_LIM of them (or another limit, see `check_text').
+LineError = namedtuple("LineError", ["line_no", "err_count", "extra_chars"])
+
+# Description of one line for exploration. chars is a list of
+# (char_no, char, name) tuples.
+LineInfo = namedtuple("LineInfo", ["line_no", "line", "chars"])
+
+class Report(object):
+    """Outcome of checking (and possibly normalizing) a text.
+
+    Memory use does not depend on the number of illegal characters: only
+    counters and a bounded sample of their positions are kept.
+
+    Attributes:
+        line_count: number of lines read.
+        err_count: total number of illegal characters found.
+        line_err_count: number of lines containing illegal characters.
+        line_errors: list of the first LINE_ERR_LIM LineError, in line order.
+        char_counts: dict mapping each illegal character found to its number
+            of occurrences.
+        char_positions: dict mapping each illegal character found to the list
+            of (line_no, char_no) of its first CHAR_ERR_LIM occurrences.
+        truncated: True if reading stopped before the end of the text because
+            enough illegal characters were found.
+        encoding_err_count: number of invalid UTF-8 sequences found, each of
+            them also counted as an illegal U+FFFD REPLACEMENT CHARACTER.
+        encoding_errors: list of the first LINE_ERR_LIM EncodingError, in
+            byte order.
+    """
+    def __init__(self):
+        self.line_count = 0
+        self.err_count = 0
+        self.line_err_count = 0
+        self.line_errors = []
+        self.char_counts = {}
+        self.char_positions = {}
+        self.truncated = False
+        self.encoding_err_count = 0
+        self.encoding_errors = []
+
+    def add_char(self, line_no, char, char_no):
+        """Records an occurrence of an illegal character."""
+        self.err_count += 1
+        count = self.char_counts.get(char, 0)
+        self.char_counts[char] = count + 1
+        if count < CHAR_ERR_LIM:
+            self.char_positions.setdefault(char, []).append((line_no, char_no))
+
+    def add_line_error(self, line_no, err_count, extra_chars):
+        """Records a line containing `err_count' illegal characters, already
+        recorded with `add_char'. Returns its LineError."""
+        line_error = LineError(line_no, err_count, extra_chars)
+        self.line_err_count += 1
+        if len(self.line_errors) < LINE_ERR_LIM:
+            self.line_errors.append(line_error)
+        return line_error
+
+    def merge(self, other, on_error=None):
+        """Appends the report of the text following the one of this report.
+
+        Line numbers of `other' are shifted to follow the lines already read.
+        If given, `on_error' is called with each shifted LineError (only the
+        ones kept in `other').
+        """
+        line_offset = self.line_count
+        for line_no, err_count, extra_chars in other.line_errors:
+            line_error = LineError(line_no + line_offset, err_count,
+                                   extra_chars)
+            if len(self.line_errors) < LINE_ERR_LIM:
+                self.line_errors.append(line_error)
+            if on_error:
+                on_error(line_error)
+        for char, count in other.char_counts.items():
+            self.char_counts[char] = self.char_counts.get(char, 0) + count
+            positions = self.char_positions.setdefault(char, [])
+            for line_no, char_no in other.char_positions[char]:
+                if len(positions) < CHAR_ERR_LIM:
+                    positions.append((line_no + line_offset, char_no))
+        for encoding_error in other.encoding_errors:
+            if len(self.encoding_errors) < LINE_ERR_LIM:
+                self.encoding_errors.append(encoding_error._replace(
+                    line_no=encoding_error.line_no + line_offset))
+        self.encoding_err_count += other.encoding_err_count
+        self.err_count += other.err_count
+        self.line_err_count += other.line_err_count
+        self.line_count += other.line_count
+        self.truncated = self.truncated or other.truncated
+
+    @property
+    def ret_code(self):
+        """ERRCODE_OK for a clean text, ERRCODE_EXTRACHAR otherwise."""
+        if self.err_count > 0 or self.encoding_err_count > 0:
+            return ERRCODE_EXTRACHAR
+        return ERRCODE_OK
+
+class Stats(object):
+    """Statistics of a normalization, filled by `normalize_stream' and
+    `normalize_file' when given.
+
+    Attributes:
+        times: dict mapping each stage of STAGES to the seconds spent in it:
+            reading and UTF-8 decoding, legality check, NFKC, transformations
+            and writing.
+        bytes_read, bytes_written: number of bytes read from the input file
+            and written as UTF-8.
+        chars_read, chars_written: number of characters read and written.
+        line_count: number of lines read.
+        nfkc_changed_lines: number of lines changed by NFKC.
+        rule_counts: list of the number of times each rule of TRANSFORMATIONS
+            fired, in the same order.
+    """
+    STAGES = ("decode", "check", "nfkc", "transform", "write")
+
+    def __init__(self):
+        self.times = dict((stage, 0.0) for stage in self.STAGES)
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.chars_read = 0
+        self.chars_written = 0
+        self.line_count = 0
+        self.nfkc_changed_lines = 0
+        self.rule_counts = [0] * len(TRANSFORMATIONS)
+        # Whether the line left unfinished by the last piece already changed.
+        self._pending_changed = False
+
+    def _add_nfkc_lines(self, piece, nfkc):
+        """Counts the lines of a piece of text changed by NFKC, which never
+        adds nor removes LF."""
+        if nfkc == piece:
+            if u"\n" in piece:
+                self._pending_changed = False
+            return
+        changed = [old != new for old, new in zip(piece.split(u"\n"),
+                                                  nfkc.split(u"\n"))]
+        count = sum(changed)
+        if self._pending_changed:
+            count -= changed[0] # Already counted with the previous piece
+            changed[0] = True
+        self._pending_changed = changed[-1]
+        self.nfkc_changed_lines += count
+
+    def merge(self, other):
+        """Adds the statistics of another normalization to these ones."""
+        for stage in self.STAGES:
+            self.times[stage] += other.times[stage]
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        self.chars_read += other.chars_read
+        self.chars_written += other.chars_written
+        self.line_count += other.line_count
+        self.nfkc_changed_lines += other.nfkc_changed_lines
+        self.rule_counts = [count + other_count for count, other_count
+                            in zip(self.rule_counts, other.rule_counts)]
+
+    def as_dict(self):
+        """Returns the statistics as a dict, ready to be dumped as JSON."""
+        return {
+            "times": dict(self.times),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "chars_read": self.chars_read,
+            "chars_written": self.chars_written,
+            "line_count": self.line_count,
+            "nfkc_changed_lines": self.nfkc_changed_lines,
+            "rules": [{"from": fr, "to": to,
+                       "code_point": "U+%04X" % ord(fr[0]), "count": count}
+                      for (fr, to), count in zip(TRANSFORMATIONS,
+                                                 self.rule_counts)]}
+
+class _TimedWriter(object):
+    """Output wrapper recording the time spent writing in a Stats."""
+    def __init__(self, dst, stats):
+        self.dst = dst
+        self.stats = stats
+
+    def write(self, text):
+        start = default_timer()
+        self.dst.write(text)
+        self.stats.times["write"] += default_timer() - start
+        self.stats.chars_written += len(text)
+        self.stats.bytes_written += len(text.encode("UTF-8"))
+
+class _CountingReader(object):
+    """Binary input wrapper counting the bytes read in a Stats."""
+    def __init__(self, raw, stats):
+        self.raw = raw
+        self.stats = stats
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.stats.bytes_read += len(data)
+        return data
+
+def _timed_pieces(lines, stats):
+    """Iterates over `lines', recording the time spent reading them in a
+    Stats."""
+    lines = iter(lines)
+    while True:
+        start = default_timer()
+        try:
+            piece = next(lines)
+        except StopIteration:
+            return
+        finally:
+            stats.times["decode"] += default_timer() - start
+        stats.chars_read += len(piece)
+        yield piece
+
+def char_name(char):
+    """Returns the Unicode name of a character, or its repr if it has none."""
+    return unicodedata.name(char, repr(char))
+
+def format_line_error(line_error, char_err_lim=CHAR_ERR_LIM):
+    """Returns the messages describing a LineError, as a list of strings.
+
+    At most `char_err_lim' characters are described individually.
+    """
+    line_no, err_count, extra_chars = line_error
+    messages = ["Got %d illegal character(s) in line %d : "
+                % (err_count, line_no)]
+    extra_chars = extra_chars[:char_err_lim]
+    for char, pos in extra_chars:
+        messages.append("\tl:%03d c:%03d %s"
+                        % (line_no, pos, char_name(char)))
+    if err_count > len(extra_chars):
+        messages.append("\t ... and %d other(s)."
+                        % (err_count - len(extra_chars)))
+    return messages
+
+def format_char_counts(report):
+    """Returns messages describing the illegal characters of a Report by code
+    point, most frequent first, as a list of strings."""
+    messages = []
+    for char, count in sorted(report.char_counts.items(),
+                              key=lambda item: (-item[1], item[0])):
+        positions = ", ".join("l:%03d c:%03d" % position
+                              for position in report.char_positions[char])
+        if count > len(report.char_positions[char]):
+            positions += ", ..."
+        messages.append("\tU+%04X %s: %d occurrence(s) (%s)"
+                        % (ord(char), char_name(char), count, positions))
+    return messages
+
+# Path standing for the standard input or output.
+STDIO_PATH = "-"
+
+def open_path(path, mode="rb", **kwargs):
+    """Opens a file like `io.open', STDIO_PATH standing for the standard input
+    (for reading) or output (for writing).
+
+    Standard streams are used through their file descriptor, in binary mode,
+    and are left open when the returned file is closed.
+    """
+    if path != STDIO_PATH:
+        return io.open(path, mode, **kwargs)
+    if "r" in mode:
+        stream = sys.stdin
+    else:
+        stream = sys.stdout
+        stream.flush()
+    if sys.platform == "win32":
+        import msvcrt
+        msvcrt.setmode(stream.fileno(), os.O_BINARY)
+    return io.open(stream.fileno(), mode, closefd=False, **kwargs)
+
+def open_input(path, newline=None):
+    """Opens a UTF-8 text file for reading, with universal newlines unless
+    another `newline' mode is given (see `io.open')."""
+    return open_path(path, "rt", encoding="UTF-8", newline=newline,
+                     errors="strict")
+
+def open_output(path, buffer_size=BUFFER_SIZE):
+    """Opens a file for writing UTF-8 text with LF end of lines, compressed
+    according to its extension (see `open_compressed')."""
+    if _compression(path) is not None:
+        return _EncodedOutput(open_compressed(path, "wb"))
+    return open_path(path, "wt", encoding="UTF-8", newline='',
+                     errors="strict", buffering=buffer_size)
+
+def _find_cut(text):
+    """Returns the index where `text' can be cut without altering NFKC.
+
+    Characters below U+0300 have no combining class and never compose with
+    a previous character, so NFKC can be applied separately to what precedes
+    and what follows them. We look for such a character close to the end of
+    the text, then for any character with no combining class which does not
+    compose with the previous ones (unlike Hangul jamos, for instance).
+    Returns 0 if none is found.
+    """
+    start = max(0, len(text) - _CUT_LOOKBEHIND)
+    for index in range(len(text) - 1, start - 1, -1):
+        if text[index] < u"\u0300":
+            return index
+    for index in range(len(text) - 1, max(start, 1) - 1, -1):
+        before = text[max(0, index - 3):index]
+        if (not unicodedata.combining(text[index])
+                and unicodedata.normalize('NFKC', before + text[index])
+                == unicodedata.normalize('NFKC', before)
+                + unicodedata.normalize('NFKC', text[index])):
+            return index
+    return 0
+
+def read_text(raw, buffer_size=BUFFER_SIZE, validator=None):
+    """Reads UTF-8 text from a binary file object by blocks of bytes.
+
+    Yields pieces of Unicode text with LF end of lines, which put together
+    are exactly the content read with universal newlines. Pieces may contain
+    several lines, or only a part of a line, and are cut where NFKC
+    normalization can be applied to each of them separately. Memory use only
+    depends on `buffer_size', and never on the length of lines.
+
+    Invalid UTF-8 raises UnicodeDecodeError, unless a Utf8Validator is given
+    to record it.
+    """
+    decoder = validator
+    if decoder is None:
+        decoder = codecs.getincrementaldecoder("UTF-8")("strict")
+    tail = u"" # End of the previous block, waiting for a safe cut
+    cr = u""   # CR ending the previous block, which may start a CRLF
+    while True:
+        data = raw.read(buffer_size)
+        final = not data
+        text = cr + decoder.decode(data, final)
+        cr = u""
+        if not final and text.endswith(u"\r"):
+            cr = u"\r"
+            text = text[:-1]
+        if u"\r" in text:
+            text = text.replace(u"\r\n", u"\n").replace(u"\r", u"\n")
+        text = tail + text
+        if final:
+            if text:
+                yield text
+            return
+        cut = _find_cut(text)
+        if cut == 0 and len(text) > max(buffer_size, _CUT_LOOKBEHIND):
+            # Endless combining sequence: give up on exact NFKC
+            cut = len(text)
+        if cut > 0:
+            yield text[:cut]
+        tail = text[cut:]
+
+def _end_line(report, line_no, err_count, extra_chars, on_error):
+    """Reports a line with illegal characters, see `_process_lines'."""
+    line_error = report.add_line_error(line_no, err_count, extra_chars)
+    if on_error:
+        on_error(line_error)
+
+def _process_lines(lines, on_error=None, dst=None, max_errors=None,
+                   stats=None, char_err_lim=CHAR_ERR_LIM, on_chars=None):
+    """Checks, and normalizes to `dst' if given, an iterable of text pieces.
+
+    Pieces may contain several lines or only a part of a line: positions of
+    illegal characters are mapped back to lines. Stops reading as soon as
+    `max_errors' illegal characters are found, if given. Statistics of the
+    normalization are added to `stats' if given. If given, `on_chars' is
+    called after each piece with the list of the (line_no, char, char_no) of
+    its illegal characters. Returns a Report.
+    """
+    if char_err_lim is None:
+        char_err_lim = sys.maxsize
+    check_normalize = _check_normalize
+    if stats is not None:
+        lines = _timed_pieces(lines, stats)
+        dst = _TimedWriter(dst, stats)
+        check_normalize = lambda piece: _check_normalize_stats(piece, stats)
+    report = Report()
+    line_no = 1      # Number of the current line
+    char_offset = 0  # Characters of the current line in previous pieces
+    err_count = 0    # Illegal characters of the current line
+    extra_chars = [] # First char_err_lim of them, with their position
+    for piece in lines:
+        if dst is None:
+            piece_chars = scan_illegal(piece)
+        else:
+            piece_chars, piece_tr = check_normalize(piece)
+            dst.write(piece_tr)
+        line_start = 0 # Offset of the current line in the piece
+        searched = 0   # No LF in piece[line_start:searched]
+        found = []     # Illegal characters of the piece, for `on_chars'
+        for char, pos in piece_chars:
+            eol = piece.find(u"\n", searched, pos - 1)
+            while eol >= 0:
+                if err_count:
+                    _end_line(report, line_no, err_count, extra_chars,
+                              on_error)
+                    err_count = 0
+                    extra_chars = []
+                line_no += 1
+                char_offset = 0
+                line_start = eol + 1
+                eol = piece.find(u"\n", line_start, pos - 1)
+            searched = pos - 1
+            char_no = pos - line_start + char_offset
+            report.add_char(line_no, char, char_no)
+            err_count += 1
+            if err_count <= char_err_lim:
+                extra_chars.append((char, char_no))
+            if on_chars:
+                found.append((line_no, char, char_no))
+            if max_errors and report.err_count >= max_errors:
+                if found:
+                    on_chars(found)
+                _end_line(report, line_no, err_count, extra_chars, on_error)
+                report.line_count = line_no
+                report.truncated = True
+                return report
+        if found:
+            on_chars(found)
+        eol = piece.find(u"\n", searched)
+        if eol >= 0:
+            if err_count:
+                _end_line(report, line_no, err_count, extra_chars, on_error)
+                err_count = 0
+                extra_chars = []
+            line_no += 1 + piece.count(u"\n", eol + 1)
+            char_offset = len(piece) - piece.rfind(u"\n") - 1
+        else:
+            char_offset += len(piece) - line_start
+    if char_offset:
+        if err_count:
+            _end_line(report, line_no, err_count, extra_chars, on_error)
+        report.line_count = line_no
+    else:
+        report.line_count = line_no - 1
+    if stats is not None:
+        stats.line_count += report.line_count
+    return report
+
+def check_text(pieces, on_error=None, max_errors=None,
+               char_err_lim=CHAR_ERR_LIM, on_chars=None):
+    """Checks a Unicode text given as an iterable of pieces, returns a Report.
+
+    Pieces may contain several lines or only a part of a line, as yielded by
+    `read_text' for instance: lines are only delimited by LF. If given,
+    `on_error' is called with each LineError as soon as it is found. If
+    `max_errors' is given, reading stops as soon as this number of illegal
+    characters is found. Each LineError gives the position of the first
+    `char_err_lim' illegal characters of its line, or of all of them if None.
+
+    To get every illegal character without keeping them until the end of
+    their line, pass `on_chars': it is called as each piece is checked, with
+    the list of the (line_no, char, char_no) of its illegal characters.
+    """
+    return _process_lines(pieces, on_error, max_errors=max_errors,
+                          char_err_lim=char_err_lim, on_chars=on_chars)
+
+def check_lines(lines, on_error=None, max_errors=None,
+                char_err_lim=CHAR_ERR_LIM):
+    """Checks an iterable of Unicode lines, returns a Report.
+
+    Each item is one line, with or without its LF end of line, and must not
+    contain any other LF. Other arguments are used as in `check_text'.
+    """
+    return check_text((line if line.endswith(u"\n") else line + u"\n"
+                       for line in lines), on_error, max_errors, char_err_lim)
+
+def check_file(path, on_error=None, buffer_size=BUFFER_SIZE,
+               max_errors=None, char_err_lim=CHAR_ERR_LIM, on_chars=None):
+    """Checks a UTF-8 text file, returns a Report. See `check_text'.
+
+    The file is read by blocks of `buffer_size' bytes, `path' may be
+    STDIO_PATH for the standard input, or a compressed file (see
+    `open_compressed'). Invalid UTF-8 sequences are recorded in the report
+    (see `Utf8Validator').
+    """
+    validator = Utf8Validator()
+    with open_compressed(path, "rb") as raw:
+        report = check_text(read_text(raw, buffer_size, validator),
+                             on_error, max_errors, char_err_lim, on_chars)
+    return validator.add_to(report)
+
+def normalize_text(text):
+    """Returns the normalized form of a Unicode text.
+
+    End of lines are normalized to LF first, as when reading a file.
+    """
+    return u"".join(normalize_line(line)
+                    for line in io.StringIO(text, newline=None))
+
+def normalize_stream(src, dst, on_error=None, stats=None,
+                     char_err_lim=CHAR_ERR_LIM, on_chars=None):
+    """Checks and normalizes Unicode lines from `src', writing them to `dst'.
+
+    `src' is an iterable of Unicode lines (with LF end of lines), or of any
+    pieces of text as in `check_text', `dst' is an object with a `write'
+    method accepting Unicode strings. Returns a Report; `on_error',
+    `char_err_lim' and `on_chars' are used as in `check_text'. If a Stats is
+    given, statistics of the normalization are added to it, at the cost of a
+    slightly slower normalization.
+    """
+    return _process_lines(src, on_error, dst, stats=stats,
+                          char_err_lim=char_err_lim, on_chars=on_chars)
+
+def normalize_file(input_path, output_path, on_error=None,
+                   buffer_size=BUFFER_SIZE, stats=None,
+                   char_err_lim=CHAR_ERR_LIM, on_chars=None):
+    """Normalizes a UTF-8 text file to a new file, returns a Report.
+
+    Both files are read and written by blocks of `buffer_size' bytes. Either
+    may be STDIO_PATH for the standard input or output, or a compressed file
+    (see `open_compressed'). Invalid UTF-8 sequences are written as U+FFFD
+    REPLACEMENT CHARACTER and recorded in the report. See `normalize_stream'.
+    """
+    validator = Utf8Validator()
+    with open_output(output_path, buffer_size) as file_output:
+        with open_compressed(input_path, "rb") as raw:
+            if stats is not None:
+                raw = _CountingReader(raw, stats)
+            report = normalize_stream(read_text(raw, buffer_size, validator),
+                                      file_output, on_error, stats,
+                                      char_err_lim, on_chars)
+            validator.add_to(report)
+        if stats is not None:
+            start = default_timer()
+            file_output.flush()
+            stats.times["write"] += default_timer() - start
+    return report
+
+def explore_lines(lines, first_line=1, columns=None):
+    """Describes each character of an iterable of lines.
+
+    Yields a LineInfo for each line, numbering lines from `first_line'. If
+    `columns' is a (first, last) pair of 1-based character numbers (last may
+    be None), only these characters are described.
+    """
+    first_col, last_col = columns or (1, None)
+    line_no = first_line - 1
+    for line in lines:
+        line_no += 1
+        chars = []
+        char_no = first_col - 1
+        for char in line[first_col - 1:last_col]:
+            char_no += 1
+            chars.append((char_no, char, char_name(char)))
+        yield LineInfo(line_no, line, chars)
+
+# Fields of the records written by DiagnosticWriter, and their formats.
+DIAGNOSTIC_FIELDS = ("file", "line", "column", "code_point", "name", "count")
+DIAGNOSTIC_FORMATS = ("jsonl", "csv")
+
+class DiagnosticWriter(object):
+    """Streams illegal characters as machine-readable records.
+
+    Records are written to `stream' as JSON Lines, or as CSV with a header
+    line, with the DIAGNOSTIC_FIELDS fields. With `per_line', there is one
+    record per line with illegal characters, describing the first of them,
+    and count is their number in the line: records are written from each
+    LineError (`write'). Otherwise there is one record per illegal character,
+    with a count of 1, written as the text is read (`write_chars'), so that
+    a long line is not kept in memory until its end. `callbacks' returns the
+    callbacks to pass for either. The stream is flushed after each call.
+    """
+    def __init__(self, stream, format="jsonl", per_line=False):
+        self.stream = stream
+        self.per_line = per_line
+        self._csv = None
+        if format == "csv":
+            self._csv = csv.writer(stream, lineterminator="\n")
+            self._csv.writerow(DIAGNOSTIC_FIELDS)
+
+    def callbacks(self, file_name):
+        """Returns the (on_error, on_chars) pair of callbacks (see
+        `check_text') writing the records of the file `file_name'. One of
+        them is None."""
+        if self.per_line:
+            return functools.partial(self.write, file_name), None
+        return None, functools.partial(self.write_chars, file_name)
+
+    def _write_record(self, file_name, line_no, char, char_no, count):
+        values = (file_name, line_no, char_no, "U+%04X" % ord(char),
+                  char_name(char), count)
+        if self._csv is not None:
+            self._csv.writerow(values)
+        else:
+            self.stream.write(json.dumps(
+                OrderedDict(zip(DIAGNOSTIC_FIELDS, values))) + "\n")
+
+    def write(self, file_name, line_error):
+        """Writes the records of a LineError of the file `file_name'."""
+        line_no, err_count, extra_chars = line_error
+        if self.per_line:
+            extra_chars, count = extra_chars[:1], err_count
+        else:
+            count = 1
+        for char, char_no in extra_chars:
+            self._write_record(file_name, line_no, char, char_no, count)
+        self.stream.flush()
+
+    def write_chars(self, file_name, chars):
+        """Writes one record for each (line_no, char, char_no) of the file
+        `file_name', as given to `on_chars'."""
+        for line_no, char, char_no in chars:
+            self._write_record(file_name, line_no, char, char_no, 1)
+        self.stream.flush()
+
+# ==============================================================================
+# UTF-8 validation
+# Files which are not valid UTF-8 are still checked and normalized: invalid
+# byte sequences are decoded as U+FFFD REPLACEMENT CHARACTER, which is itself
+# an illegal character, and reported with their byte offset so that they can
+# all be fixed at once. Overlong encodings, encoded surrogates (which Python 2
+# decodes silently) and code points beyond U+10FFFF are invalid too.
+
+# Invalid byte sequence found at byte `offset' (from the start of the file) of
+# line `line_no'. data holds its bytes, reason tells what is wrong with them.
+EncodingError = namedtuple("EncodingError",
+                           ["offset", "line_no", "data", "reason"])
+
+# Encoded surrogate, accepted by the UTF-8 decoder of Python 2, and the
+# characters it decodes to (which form pairs for other characters on narrow
+# Python builds).
+_ENCODED_SURROGATE_RE = re.compile(b"\xed[\xa0-\xbf][\x80-\xbf]")
+if sys.maxunicode > 0xffff:
+    _SURROGATE_RE = re.compile(u"[\ud800-\udfff]")
+else:
+    _SURROGATE_RE = re.compile(u"[\ud800-\udbff](?![\udc00-\udfff])|"
+                               u"(?<![\ud800-\udbff])[\udc00-\udfff]")
+
+# Sizes of the windows blocks with invalid sequences are decoded by, in bytes.
+# Windows start small after each invalid sequence, and grow while they decode
+# without error, so that files full of invalid sequences are scanned in linear
+# time.
+_MIN_VALIDATION_WINDOW = 64
+_VALIDATION_WINDOW = 4096
+
+# Number of replacements made by the "moclib.replace" error handler in each
+# thread, which tells the validator which blocks to scan without searching
+# their text.
+_replacements = threading.local()
+
+def _count_replacement(exc):
+    _replacements.count = getattr(_replacements, "count", 0) + 1
+    return u"\ufffd", exc.end
+
+codecs.register_error("moclib.replace", _count_replacement)
+
+def _byte(data, index):
+    return ord(data[index:index + 1])
+
+def _invalid_reason(sequence):
+    """Returns the reason why a sequence of bytes, as replaced at once by the
+    UTF-8 decoder, is invalid."""
+    lead = _byte(sequence, 0)
+    if lead < 0xc0:
+        return "unexpected continuation byte"
+    if lead >= 0xf8:
+        return "invalid byte"
+    second = _byte(sequence, 1) if len(sequence) > 1 else None
+    if (lead < 0xc2 or (lead == 0xe0 and second is not None and second < 0xa0)
+            or (lead == 0xf0 and second is not None and second < 0x90)):
+        return "overlong encoding"
+    if lead == 0xed and second is not None and second >= 0xa0:
+        return "encoded surrogate"
+    if lead > 0xf4 or (lead == 0xf4 and second is not None
+                       and second >= 0x90):
+        return "code point beyond U+10FFFF"
+    return "truncated sequence"
+
+def _sequence_end(data):
+    """Returns the length of `data' without the sequence left unfinished at
+    its end, if any."""
+    size = len(data)
+    for back in range(1, min(size, 3) + 1):
+        byte = _byte(data, size - back)
+        if byte < 0x80:
+            break
+        if byte >= 0xc0:
+            need = 1 if byte >= 0xf8 else 2 if byte < 0xe0 else \
+                3 if byte < 0xf0 else 4
+            if back < need:
+                return size - back
+            break
+    return size
+
+def _count_eols(data, start, end, cr):
+    """Returns the number of end of lines (LF, CR or CRLF) in `data[start:end]'
+    and whether it ends with a CR. `cr' tells whether the preceding byte was a
+    CR, whose LF must not be counted again."""
+    if _use_numpy(end - start):
+        codes = numpy.frombuffer(data, dtype=numpy.uint8)[start:end]
+        count = int(numpy.count_nonzero(codes == 10))
+        cr_count = int(numpy.count_nonzero(codes == 13))
+    else:
+        count = data.count(b"\n", start, end)
+        cr_count = int(data.find(b"\r", start, end) >= 0)
+    if cr and data[start:start + 1] == b"\n":
+        count -= 1
+    if cr_count:
+        count += (data.count(b"\r", start, end)
+                  - data.count(b"\r\n", start, end))
+    return count, end > start and data[end - 1:end] == b"\r"
+
+class Utf8Validator(object):
+    """Incremental UTF-8 decoder recording invalid byte sequences.
+
+    Can be given to `read_text' instead of its strict decoder. Text is
+    decoded as with the "replace" error handler (encoded surrogates
+    included), and blocks where the decoder had to replace something are
+    scanned again to find each invalid sequence. Sequences are split where
+    the decoder splits them, so that each one is one U+FFFD of the text: an
+    overlong C0 AF, for instance, is two invalid sequences. Valid blocks are
+    only searched for end of lines, to number the lines of the next invalid
+    sequences.
+
+    Attributes:
+        err_count: number of invalid sequences found.
+        errors: list of the first LINE_ERR_LIM EncodingError.
+    """
+    def __init__(self, offset=0):
+        self._decoder = codecs.getincrementaldecoder("UTF-8")(
+            "moclib.replace")
+        self.offset = offset # Of the first byte not scanned yet
+        self.line_no = 1     # Line of this byte
+        self._cr = False     # Whether the byte before it is a CR
+        self._carry = b""    # Bytes left to scan with the next block
+        self._rescan = False # Whether they may be invalid
+        self.err_count = 0
+        self.errors = []
+
+    def decode(self, data, final=False):
+        """Decodes a block of bytes, see `codecs.IncrementalDecoder'."""
+        replacements = getattr(_replacements, "count", 0)
+        text = self._decoder.decode(data, final)
+        replaced = getattr(_replacements, "count", 0) != replacements
+        carry = self._carry
+        block = carry + data if carry else data
+        end = len(block)
+        if not final:
+            # Bytes the decoder did not decode yet are scanned with the next
+            # block, where their replacement characters will show up.
+            end = min(_sequence_end(block),
+                      end - len(self._decoder.getstate()[0]))
+        if _use_numpy(len(block)):
+            surrogates = numpy.any(
+                numpy.frombuffer(block, dtype=numpy.uint8) == 0xed)
+        else:
+            surrogates = b"\xed" in block
+        surrogates = (surrogates
+                      and _ENCODED_SURROGATE_RE.search(block) is not None)
+        if surrogates:
+            text = _SURROGATE_RE.sub(u"\ufffd", text)
+        if self._rescan or surrogates or replaced:
+            self._scan(block, end)
+        self._carry = block[end:]
+        self._rescan = bool(self._carry) and (surrogates or replaced)
+        count, self._cr = _count_eols(block, 0, end, self._cr)
+        self.line_no += count
+        self.offset += end
+        return text
+
+    def _scan(self, block, end):
+        """Records the invalid sequences of `block[:end]', which starts at
+        `offset'."""
+        pos = 0
+        line_pos = 0 # Where the line count of `line_no' stops
+        line_no = self.line_no
+        cr = self._cr
+        size = _MIN_VALIDATION_WINDOW
+        while pos < end:
+            stop = min(end, pos + size)
+            try:
+                consumed = codecs.utf_8_decode(block[pos:stop], "strict",
+                                               stop >= end)[1]
+                invalid = None
+            except UnicodeDecodeError as exc:
+                consumed = exc.start
+                invalid = pos + exc.start
+                length = exc.end - exc.start
+            match = _ENCODED_SURROGATE_RE.search(block, pos, pos + consumed)
+            if match is not None:
+                invalid = match.start()
+                length = match.end() - invalid
+            if invalid is None:
+                pos += consumed
+                size = min(2 * size, _VALIDATION_WINDOW)
+                continue
+            size = _MIN_VALIDATION_WINDOW
+            if invalid > line_pos:
+                count, cr = _count_eols(block, line_pos, invalid, cr)
+                line_no += count
+                line_pos = invalid
+            self.err_count += 1
+            if len(self.errors) < LINE_ERR_LIM:
+                sequence = block[invalid:invalid + length]
+                self.errors.append(EncodingError(
+                    self.offset + invalid, line_no, sequence,
+                    _invalid_reason(sequence)))
+            pos = invalid + length
+
+    def add_to(self, report):
+        """Records the invalid sequences found in a Report, returns it."""
+        report.encoding_err_count += self.err_count
+        report.encoding_errors.extend(
+            self.errors[:LINE_ERR_LIM - len(report.encoding_errors)])
+        return report
+
+def format_encoding_error(encoding_error):
+    """Returns the message describing an EncodingError."""
+    offset, line_no, data, reason = encoding_error
+    return ("Invalid UTF-8 sequence at byte %d (line %d): %s (%s)"
+            % (offset, line_no,
+               " ".join("%02X" % byte for byte in bytearray(data)), reason))
+
+def format_encoding_errors(report):
+    """Returns messages describing the invalid UTF-8 sequences of a Report,
+    as a list of strings."""
+    messages = [format_encoding_error(encoding_error)
+                for encoding_error in report.encoding_errors]
+    if report.encoding_err_count > len(report.encoding_errors):
+        messages.append("\t ... and %d other(s)."
+                        % (report.encoding_err_count
+                           - len(report.encoding_errors)))
+    return messages
+
+def encoding_error_to_json(encoding_error):
+    """Returns an EncodingError as an [offset, line_no, hex bytes, reason]
+    list."""
+    offset, line_no, data, reason = encoding_error
+    return [offset, line_no, codecs.encode(data, "hex").decode("ascii"),
+            reason]
+
+def encoding_error_from_json(value):
+    """Returns the EncodingError given by `encoding_error_to_json'."""
+    offset, line_no, data, reason = value
+    return EncodingError(offset, line_no,
+                         codecs.decode(data.encode("ascii"), "hex"), reason)
+
+# ==============================================================================
+# Compressed files and archives
+# Compression of files according to their extension.
+_COMPRESSIONS = {".gz": "gz", ".tgz": "gz", ".bz2": "bz2", ".tbz": "bz2",
+                 ".tbz2": "bz2", ".xz": "xz", ".txz": "xz"}
+
+_TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz", ".tbz2",
+                   ".tar.xz", ".txz")
+
+def _compression(path):
+    """Returns the compression of a file ("gz", "bz2" or "xz"), or None."""
+    if path == STDIO_PATH:
+        return None
+    return _COMPRESSIONS.get(os.path.splitext(path)[1].lower())
+
+def open_compressed(path, mode="rb"):
+    """Opens a file for binary reading or writing like `open_path', which is
+    decompressed or compressed on the fly if its extension is .gz, .bz2 or
+    .xz (which requires the lzma module, or its backport on Python 2)."""
+    compression = _compression(path)
+    if compression == "gz":
+        return gzip.GzipFile(path, mode)
+    if compression == "bz2":
+        return bz2.BZ2File(path, mode)
+    if compression == "xz":
+        if lzma is None:
+            raise IOError("xz files require the lzma module: %s" % path)
+        return lzma.LZMAFile(path, mode)
+    return open_path(path, mode)
+
+class _EncodedOutput(object):
+    """UTF-8 text output over a binary file object, which is closed with
+    it."""
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, text):
+        self.raw.write(text.encode("UTF-8"))
+
+    def flush(self):
+        self.raw.flush()
+
+    def close(self):
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def is_archive(path):
+    """Tells whether a file is a zip or tar archive, from its extension."""
+    name = path.lower()
+    return name.endswith(".zip") or name.endswith(_TAR_EXTENSIONS)
+
+def iter_archive(path):
+    """Iterates over the regular files of a zip or tar archive.
+
+    Yields a (member name, binary file object) pair for each of them. Members
+    are read straight from the archive, in order: nothing is extracted, and
+    memory use does not depend on the size of the archive. Each file object
+    is only valid until the next pair is requested.
+    """
+    if path.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if info.filename.endswith("/"):
+                    continue
+                member = archive.open(info)
+                try:
+                    yield info.filename, member
+                finally:
+                    member.close()
+    else:
+        with open_compressed(path, "rb") as raw:
+            archive = tarfile.open(fileobj=raw, mode="r|")
+            try:
+                for info in archive:
+                    if info.isfile():
+                        yield info.name, archive.extractfile(info)
+            finally:
+                archive.close()
+
+class ArchiveWriter(object):
+    """Writes files to a new zip or tar archive, compressed according to its
+    extension (see `open_compressed'). Can be used in a with statement."""
+    def __init__(self, path):
+        self._zip = None
+        self._tar = None
+        self._raw = None
+        if path.lower().endswith(".zip"):
+            self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED,
+                                        allowZip64=True)
+        else:
+            self._raw = open_compressed(path, "wb")
+            self._tar = tarfile.open(fileobj=self._raw, mode="w|")
+
+    def add(self, name, file_path):
+        """Adds the file `file_path' to the archive as `name'."""
+        if self._zip is not None:
+            self._zip.write(file_path, name)
+        else:
+            self._tar.add(file_path, arcname=name, recursive=False)
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+        else:
+            self._tar.close()
+            self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _member_path(output_dir, name):
+    """Returns the path a member is extracted to, refusing names which would
+    end up outside of `output_dir'."""
+    relative = os.path.normpath(name)
+    if (os.path.isabs(relative) or relative == os.pardir
+            or relative.startswith(os.pardir + os.sep)):
+        raise IOError("Unsafe archive member name: %s" % name)
+    return os.path.join(output_dir, relative)
+
+def _member_callback(on_error, name):
+    if on_error is None:
+        return None
+    return functools.partial(on_error, name)
+
+def check_archive(path, on_error=None, buffer_size=BUFFER_SIZE,
+                  max_errors=None, char_err_lim=CHAR_ERR_LIM, on_chars=None):
+    """Checks every member of a zip or tar archive, see `iter_archive'.
+
+    Yields a (member name, Report) pair for each member. `on_error' and
+    `on_chars' are called with the member name first, and `max_errors'
+    applies to the whole archive; see `check_text' otherwise.
+    """
+    err_count = 0
+    for name, member in iter_archive(path):
+        member_max_errors = None
+        if max_errors:
+            member_max_errors = max_errors - err_count
+        validator = Utf8Validator()
+        report = validator.add_to(check_text(
+            read_text(member, buffer_size, validator),
+            _member_callback(on_error, name), member_max_errors,
+            char_err_lim, _member_callback(on_chars, name)))
+        err_count += report.err_count
+        yield name, report
+        if report.truncated:
+            return
+
+def normalize_archive(input_path, output_path, on_error=None,
+                      buffer_size=BUFFER_SIZE, char_err_lim=CHAR_ERR_LIM,
+                      on_chars=None):
+    """Normalizes every member of a zip or tar archive, see `iter_archive'.
+
+    Members are written under the same name to `output_path', which is a
+    new archive if it has an archive extension (see `is_archive'), or a
+    directory otherwise. Members are normalized to a temporary file before
+    being added to an archive, so that memory use does not depend on their
+    size. Yields a (member name, Report) pair for each member. `on_error'
+    and `on_chars' are called with the member name first; see `check_text'
+    otherwise.
+    """
+    writer = None
+    if is_archive(output_path):
+        writer = ArchiveWriter(output_path)
+    try:
+        for name, member in iter_archive(input_path):
+            if writer is None:
+                member_output = _member_path(output_path, name)
+                if not os.path.isdir(os.path.dirname(member_output)):
+                    os.makedirs(os.path.dirname(member_output))
+            else:
+                handle, member_output = tempfile.mkstemp(suffix=".txt")
+                os.close(handle)
+            try:
+                validator = Utf8Validator()
+                with open_output(member_output, buffer_size) as dst:
+                    report = normalize_stream(
+                        read_text(member, buffer_size, validator), dst,
+                        _member_callback(on_error, name),
+                        char_err_lim=char_err_lim,
+                        on_chars=_member_callback(on_chars, name))
+                validator.add_to(report)
+                if writer is not None:
+                    writer.add(name, member_output)
+            finally:
+                if writer is not None:
+                    os.remove(member_output)
+            yield name, report
+    finally:
+        if writer is not None:
+            writer.close()
+
+# ==============================================================================
+# Result cache
+# Entries of the result cache are identified by a hash of the input file and
+# of `_result_cache_fingerprint', so that they are ignored as soon as the
+# character set, the transformations, the Unicode database or the program
+# change.
+RESULT_CACHE_VERSION = 2
+
+# Default directory and maximum size of the result cache, in bytes.
+RESULT_CACHE_DIR = os.path.join(CACHE_DIR, "results")
+RESULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+# Temporary files older than this (in seconds) were left by a dead process.
+_STALE_TMP_AGE = 3600
+
+def _result_cache_fingerprint(version):
+    return "%s-%d-%s" % (_norm_table_key(), RESULT_CACHE_VERSION, version)
+
+def _limit_line_error(line_error, char_err_lim):
+    """Returns a LineError keeping only its first `char_err_lim' illegal
+    characters (all of them if None)."""
+    if char_err_lim is None or len(line_error.extra_chars) <= char_err_lim:
+        return line_error
+    return line_error._replace(extra_chars=line_error.extra_chars[:char_err_lim])
+
+def _report_from_json(content, char_err_lim):
+    report = Report()
+    for name in ("line_count", "err_count", "line_err_count", "truncated"):
+        setattr(report, name, content[name])
+    report.char_counts = dict(content["char_counts"])
+    report.char_positions = dict(
+        (char, [tuple(position) for position in positions])
+        for char, positions in content["char_positions"])
+    report.line_errors = [
+        _limit_line_error(line_error_from_json(line_error), char_err_lim)
+        for line_error in content["line_errors"][:LINE_ERR_LIM]]
+    report.encoding_err_count = content["encoding_err_count"]
+    report.encoding_errors = [encoding_error_from_json(encoding_error)
+                              for encoding_error in content["encoding_errors"]]
+    return report
+
+class ResultCache(object):
+    """On-disk cache of normalized files and of their reports.
+
+    Entries are keyed on the content of the input file, so a file which was
+    already normalized is copied from the cache instead, whatever its path.
+    Each entry is made of the normalized text (`<key>.txt') and of its Report
+    (`<key>.json'), bounded like a Report: the first LINE_ERR_LIM LineError,
+    with their first CHAR_ERR_LIM illegal characters, and the counts of the
+    others. Results needing more characters per line are not cached, and an
+    entry which lost line errors is not used when each of them must be
+    reported again (`on_error'). Entries are written to temporary
+    files and renamed, so several processes can share the same cache. When
+    the cache gets bigger than `max_size' bytes, the least recently used
+    entries are removed.
+
+    `version' identifies the program using the cache, whose entries are not
+    shared with other versions. Like the normalization table cache, the cache
+    is only an optimization: files are simply normalized when it cannot be
+    read or written.
+
+    Attributes:
+        hits, misses: number of files found, and not found, in the cache.
+    """
+    def __init__(self, directory=RESULT_CACHE_DIR, max_size=RESULT_CACHE_SIZE,
+                 version=""):
+        self.directory = directory
+        self.max_size = max_size
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, input_path, buffer_size=BUFFER_SIZE):
+        """Returns the key of the entry of an input file."""
+        digest = hashlib.sha1(
+            _result_cache_fingerprint(self.version).encode("UTF-8"))
+        with io.open(input_path, "rb") as raw:
+            for block in iter(functools.partial(raw.read, buffer_size), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def _tmp_path(self, key, extension):
+        return self._path(key, "%s.%d.tmp" % (extension, os.getpid()))
+
+    def get(self, key, output_path, on_error=None, buffer_size=BUFFER_SIZE,
+            char_err_lim=CHAR_ERR_LIM):
+        """Copies the normalized text of an entry to `output_path' (see
+        `open_compressed'), calls `on_error' with each LineError, and returns
+        the Report. Returns None if there is no such entry, or if `on_error'
+        is given and the entry only has the first LINE_ERR_LIM LineError."""
+        try:
+            with io.open(self._path(key, ".json"), "rb") as file_report:
+                content = json.loads(file_report.read().decode("UTF-8"))
+            if (on_error is not None and content["line_err_count"]
+                    > len(content["line_errors"])):
+                return None
+            text = io.open(self._path(key, ".txt"), "rb")
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        with text:
+            with open_compressed(output_path, "wb") as file_output:
+                shutil.copyfileobj(text, file_output, buffer_size)
+        try:
+            os.utime(self._path(key, ".json"), None)
+        except OSError:
+            pass # Evicted in the meantime
+        if on_error:
+            for line_error in content["line_errors"]:
+                on_error(_limit_line_error(line_error_from_json(line_error),
+                                           char_err_lim))
+        return _report_from_json(content, char_err_lim)
+
+    def normalize_file(self, input_path, output_path, on_error=None,
+                       buffer_size=BUFFER_SIZE, char_err_lim=CHAR_ERR_LIM,
+                       function=None, on_chars=None, **kwargs):
+        """Normalizes a file like `normalize_file', unless its result is in
+        the cache. Returns a Report.
+
+        Results are computed with `function', `normalize_file' by default,
+        called with the input path, an output path, `on_error' and
+        `char_err_lim' as keyword arguments, and `kwargs'. The cache is not
+        used when `on_chars' is given.
+        """
+        if function is None:
+            function = normalize_file
+            kwargs["buffer_size"] = buffer_size
+        if on_chars is not None:
+            # Entries do not keep every illegal character
+            return function(input_path, output_path, on_error=on_error,
+                            char_err_lim=char_err_lim, on_chars=on_chars,
+                            **kwargs)
+        if char_err_lim is None or char_err_lim > CHAR_ERR_LIM:
+            # Entries only keep CHAR_ERR_LIM characters per line
+            return function(input_path, output_path, on_error=on_error,
+                            char_err_lim=char_err_lim, **kwargs)
+        try:
+            key = self.key(input_path, buffer_size)
+        except (IOError, OSError):
+            key = None # Let `function' report the error
+        if key is not None:
+            report = self.get(key, output_path, on_error, buffer_size,
+                              char_err_lim)
+            if report is not None:
+                self.hits += 1
+                return report
+        self.misses += 1
+        text_path = None
+        if key is not None:
+            try:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                text_path = self._tmp_path(key, ".txt")
+                io.open(text_path, "wb").close()
+            except (IOError, OSError):
+                logger.debug("Could not use the result cache at %s."
+                             % self.directory)
+                text_path = None
+        if text_path is None:
+            return function(input_path, output_path, on_error=on_error,
+                            char_err_lim=char_err_lim, **kwargs)
+
+        def limit(line_error):
+            on_error(_limit_line_error(line_error, char_err_lim))
+        try:
+            # Like the Report, the entry keeps the first LINE_ERR_LIM lines
+            report = function(input_path, text_path,
+                              on_error=limit if on_error else None,
+                              char_err_lim=CHAR_ERR_LIM, **kwargs)
+            with io.open(text_path, "rb") as text:
+                with open_compressed(output_path, "wb") as file_output:
+                    shutil.copyfileobj(text, file_output, buffer_size)
+            self._put(key, text_path, report)
+        finally:
+            if os.path.exists(text_path):
+                os.remove(text_path)
+        report.line_errors = [_limit_line_error(line_error, char_err_lim)
+                              for line_error in report.line_errors]
+        return report
+
+    def _put(self, key, text_path, report):
+        """Adds the entry of a normalized text, then evicts old entries."""
+        content = {
+            "line_count": report.line_count,
+            "err_count": report.err_count,
+            "line_err_count": report.line_err_count,
+            "truncated": report.truncated,
+            "char_counts": sorted(report.char_counts.items()),
+            "char_positions": sorted(report.char_positions.items()),
+            "line_errors": [line_error_to_json(line_error)
+                            for line_error in report.line_errors],
+            "encoding_err_count": report.encoding_err_count,
+            "encoding_errors": [encoding_error_to_json(encoding_error)
+                                for encoding_error in report.encoding_errors],
+            }
+        report_path = self._tmp_path(key, ".json")
+        try:
+            with io.open(report_path, "wb") as file_report:
+                file_report.write(json.dumps(content).encode("UTF-8"))
+            # The text comes first: entries are looked up by their report
+            os.rename(text_path, self._path(key, ".txt"))
+            os.rename(report_path, self._path(key, ".json"))
+        except (IOError, OSError):
+            logger.debug("Could not add %s to the result cache." % key)
+            if os.path.exists(report_path):
+                os.remove(report_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """Removes the least recently used entries until the cache is not
+        bigger than `max_size', and temporary files left by dead processes.
+
+        Does nothing if another process is already evicting entries.
+        """
+        try:
+            lock = io.open(os.path.join(self.directory, "lock"), "ab")
+        except (IOError, OSError):
+            return
+        with lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except (IOError, OSError):
+                    return
+            entries = {}
+            total = 0
+            now = time.time()
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith(".tmp"):
+                    if stat.st_mtime < now - _STALE_TMP_AGE:
+                        _remove_quietly(path)
+                    continue
+                key, extension = os.path.splitext(name)
+                if extension not in (".txt", ".json"):
+                    continue
+                total += stat.st_size
+                entry = entries.setdefault(key, [0, 0])
+                entry[0] += stat.st_size
+                if extension == ".json":
+                    entry[1] = stat.st_mtime
+            for key, (size, used) in sorted(entries.items(),
+                                            key=lambda item: item[1][1]):
+                if total <= self.max_size:
+                    break
+                # The report goes first, so that no entry is left without text
+                _remove_quietly(self._path(key, ".json"))
+                _remove_quietly(self._path(key, ".txt"))
+                total -= size
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass # Removed by another process, or still open on Windows
+
+# ==============================================================================
+# Batch processing
+# Outcome of the processing of one file of a batch. report is None and message
+# explains the failure when the file could not be processed.
+BatchResult = namedtuple("BatchResult",
+                         ["input_path", "output_path", "ret_code", "report",
+                          "message"])
+
+class _CharSpool(object):
+    """Temporary file keeping the lists of illegal characters given to
+    `on_chars' in a worker process, to be passed on in the main process (see
+    `_replay_chars')."""
+    def __init__(self):
+        handle, self.path = tempfile.mkstemp(suffix=".chars")
+        self._file = os.fdopen(handle, "wb")
+
+    def write(self, chars):
+        self._file.write(json.dumps(chars).encode("UTF-8") + b"\n")
+
+    def close(self):
+        self._file.close()
+        return self.path
+
+    def discard(self):
+        self._file.close()
+        _remove_quietly(self.path)
+
+def _replay_chars(path, on_chars, line_offset=0):
+    """Calls `on_chars' with each list of illegal characters of a _CharSpool
+    file, shifting their line numbers by `line_offset', then removes it."""
+    try:
+        with io.open(path, "rb") as spool:
+            for record in spool:
+                on_chars([(line_no + line_offset, char, char_no)
+                          for line_no, char, char_no
+                          in json.loads(record.decode("UTF-8"))])
+    finally:
+        _remove_quietly(path)
+
+def list_batch_jobs(source, output_dir, pattern="*.txt"):
+    """Lists the (input path, output path) pairs of a batch.
+
+    `source' is either a directory, which is walked for files matching
+    `pattern', or a manifest file listing one input path per line (relative
+    paths are relative to the manifest; empty lines and lines starting with
+    '#' are ignored). Output paths mirror the input tree under `output_dir'.
+    """
+    inputs = []
+    if os.path.isdir(source):
+        base = os.path.abspath(source)
+        for dirpath, dirnames, filenames in os.walk(base):
+            dirnames.sort()
+            for filename in sorted(fnmatch.filter(filenames, pattern)):
+                inputs.append(os.path.join(dirpath, filename))
+    else:
+        manifest_dir = os.path.dirname(os.path.abspath(source))
+        with io.open(source, "rt", encoding="UTF-8") as manifest:
+            for entry in manifest:
+                entry = entry.strip()
+                if entry and not entry.startswith(u"#"):
+                    inputs.append(os.path.normpath(
+                        os.path.join(manifest_dir, entry)))
+        # Mirror the tree from the deepest directory common to all entries
+        base = os.path.commonprefix([os.path.dirname(path) + os.sep
+                                     for path in inputs])
+        base = base[:base.rfind(os.sep) + 1]
+    return [(path, os.path.join(output_dir, os.path.relpath(path, base)))
+            for path in inputs]
+
+def _normalize_job(job):
+    """Normalizes one (input path, output path) pair. Returns a BatchResult
+    and the path of a _CharSpool file if `spool_chars' is set (None
+    otherwise).
+
+    If `char_err_lim' is None, the report keeps every LineError with all the
+    illegal characters of its line. Results are looked up in `cache' if it
+    is a ResultCache.
+    """
+    input_path, output_path, char_err_lim, cache, spool_chars = job
+    normalize = normalize_file
+    if cache is not None:
+        normalize = cache.normalize_file
+    spool = _CharSpool() if spool_chars else None
+    try:
+        output_dir = os.path.dirname(output_path)
+        if output_dir and not os.path.isdir(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except OSError:
+                # Another worker may have created it in the meantime
+                if not os.path.isdir(output_dir):
+                    raise
+        on_chars = spool.write if spool is not None else None
+        if char_err_lim is None:
+            line_errors = []
+            report = normalize(input_path, output_path, line_errors.append,
+                               char_err_lim=None, on_chars=on_chars)
+            report.line_errors = line_errors
+        else:
+            report = normalize(input_path, output_path,
+                               char_err_lim=char_err_lim, on_chars=on_chars)
+    except (IOError, OSError, UnicodeError) as exc:
+        if spool is not None:
+            spool.discard()
+        return BatchResult(input_path, output_path, ERRCODE_IOERROR, None,
+                           str(exc)), None
+    return (BatchResult(input_path, output_path, report.ret_code, report, None),
+            spool.close() if spool is not None else None)
+
+def _pool_map(function, jobs, processes=None, ordered=True):
+    """Applies `function' to each job over a pool of worker processes.
+
+    Yields the results in job order, or in completion order if `ordered' is
+    False. No pool is started for a single process or a single job.
+    """
+    if processes == 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield function(job)
+        return
+    pool = multiprocessing.Pool(processes)
+    try:
+        if ordered:
+            results = pool.imap(function, jobs)
+        else:
+            results = pool.imap_unordered(function, jobs)
+        for result in results:
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def normalize_batch(jobs, processes=None, char_err_lim=CHAR_ERR_LIM,
+                    cache=None, on_chars=None):
+    """Normalizes a list of (input path, output path) pairs in parallel.
+
+    Files are spread over a pool of `processes' worker processes (the number
+    of CPUs by default). Yields a BatchResult for each file, in completion
+    order. If `char_err_lim' is None, reports keep every LineError, with all
+    the illegal characters of their line (see `check_text'). If given,
+    `on_chars' is called with the input path and each list of illegal
+    characters of a file, before its BatchResult is yielded; workers keep
+    them in temporary files meanwhile. Files already normalized are copied
+    from `cache' if it is a ResultCache.
+    """
+    jobs = [(input_path, output_path, char_err_lim, cache,
+             on_chars is not None)
+            for input_path, output_path in jobs]
+    for result, spool_path in _pool_map(_normalize_job, jobs, processes,
+                                        ordered=False):
+        if spool_path is not None:
+            _replay_chars(spool_path,
+                          functools.partial(on_chars, result.input_path))
+        yield result
+
+# ==============================================================================
+# Parallel processing of a single file
+# Approximate size of the chunks a file is split into, in bytes.
+CHUNK_SIZE = 8 * 1024 * 1024
+
+_EOL_BYTES_RE = re.compile(b"\r\n|\r|\n")
+
+def find_chunks(path, chunk_size=CHUNK_SIZE):
+    """Splits a file into (start, end) byte ranges ending at line boundaries.
+
+    Each range but the last one ends right after a LF, CR or CRLF end of
+    line, so ranges can be decoded and normalized independently: none of
+    these bytes can appear inside a multi-byte UTF-8 sequence.
+    """
+    size = os.path.getsize(path)
+    chunks = []
+    start = 0
+    with open(path, "rb") as file_input:
+        while start < size:
+            end = start + chunk_size
+            if end < size:
+                file_input.seek(end)
+                end = size
+                offset = start + chunk_size
+                block = file_input.read(64 * 1024)
+                while block:
+                    match = _EOL_BYTES_RE.search(block)
+                    if match is None:
+                        offset += len(block)
+                        block = file_input.read(64 * 1024)
+                        continue
+                    end = offset + match.end()
+                    # A CR at the end of the block may start a CRLF
+                    if (match.group() == b"\r" and match.end() == len(block)
+                            and file_input.read(1) == b"\n"):
+                        end += 1
+                    break
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+def _normalize_chunk(job):
+    """Normalizes a byte range of a file.
+
+    Returns the UTF-8 encoded output, the Report of the range, with line
+    numbers counted from the start of the range, its Stats if requested and
+    the path of a _CharSpool file if `spool_chars' is set (None otherwise).
+    The report keeps all the LineError of the range, so that they can all be
+    passed to `on_error'.
+    """
+    path, start, end, with_stats, char_err_lim, spool_chars = job
+    stats = Stats() if with_stats else None
+    with open(path, "rb") as file_input:
+        file_input.seek(start)
+        data = file_input.read(end - start)
+    output = io.StringIO()
+    line_errors = []
+    validator = Utf8Validator(start)
+    spool = _CharSpool() if spool_chars else None
+    try:
+        report = normalize_stream(
+            read_text(io.BytesIO(data), validator=validator), output,
+            line_errors.append, stats, char_err_lim,
+            spool.write if spool is not None else None)
+    except:
+        if spool is not None:
+            spool.discard()
+        raise
+    report.line_errors = line_errors
+    validator.add_to(report)
+    data = output.getvalue().encode("UTF-8")
+    if stats is not None:
+        stats.bytes_read += end - start
+    return data, report, stats, spool.close() if spool is not None else None
+
+def normalize_file_parallel(input_path, output_path, processes=None,
+                            chunk_size=CHUNK_SIZE, on_error=None, stats=None,
+                            char_err_lim=CHAR_ERR_LIM, on_chars=None):
+    """Normalizes a UTF-8 text file like `normalize_file', in parallel.
+
+    The file is split at line boundaries into chunks of about `chunk_size'
+    bytes, which are normalized by a pool of `processes' worker processes
+    (the number of CPUs by default) and written back in order. The output and
+    the returned Report are the same as with `normalize_file'. Times recorded
+    in `stats' are summed over the workers. The input must be a regular,
+    uncompressed file; the output may be STDIO_PATH or a compressed file.
+    `on_chars' is called once the chunk holding the characters is written,
+    the workers keeping them in temporary files meanwhile.
+    """
+    jobs = [(input_path, start, end, stats is not None, char_err_lim,
+             on_chars is not None)
+            for start, end in find_chunks(input_path, chunk_size)]
+    report = Report()
+    with open_compressed(output_path, "wb") as file_output:
+        for data, chunk_report, chunk_stats, spool_path in _pool_map(
+                _normalize_chunk, jobs, processes):
+            start = default_timer()
+            file_output.write(data)
+            if spool_path is not None:
+                _replay_chars(spool_path, on_chars, report.line_count)
+            report.merge(chunk_report, on_error)
+            if stats is not None:
+                stats.merge(chunk_stats)
+                stats.times["write"] += default_timer() - start
+    return report
+
+# ==============================================================================
+# Resumable normalization
+# Files which only grow, such as results streamed by an OCR engine, can be
+# normalized again by only processing what was appended since the last run.
+# A checkpoint saved next to the output records where the complete lines of
+# the input end, how many lines and illegal characters they had, how much of
+# the output they produced, and a SHA-1 hash of this whole part of the input,
+# to detect files which were rewritten. The hash of the new part is computed
+# as it is read, but the part already processed is read again (without being
+# decoded) to check it against the checkpoint.
+CHECKPOINT_VERSION = 3
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+class _LimitedReader(object):
+    """Binary input wrapper stopping after `size' bytes."""
+    def __init__(self, raw, size):
+        self.raw = raw
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.raw.read(size)
+        self.remaining -= len(data)
+        return data
+
+class _HashingReader(object):
+    """Binary input wrapper adding the bytes read to a hash object."""
+    def __init__(self, raw, digest):
+        self.raw = raw
+        self.digest = digest
+
+    def read(self, size=-1):
+        data = self.raw.read(size)
+        self.digest.update(data)
+        return data
+
+def _prefix_hash(raw, size, buffer_size=BUFFER_SIZE):
+    """Returns a SHA-1 hash object fed with the first `size' bytes of a
+    file, read by blocks of `buffer_size' bytes."""
+    digest = hashlib.sha1()
+    raw.seek(0)
+    reader = _HashingReader(_LimitedReader(raw, size), digest)
+    while reader.read(buffer_size):
+        pass
+    return digest
+
+def _last_line_end(raw, start, end, buffer_size=BUFFER_SIZE):
+    """Returns the offset following the last end of line of a file between
+    `start' and `end', or `start' if there is none. A CR ending the range
+    does not count, as it may be followed by a LF later on."""
+    if end > start:
+        raw.seek(end - 1)
+        if raw.read(1) == b"\r":
+            end -= 1
+    while end > start:
+        block_start = max(start, end - buffer_size)
+        raw.seek(block_start)
+        block = raw.read(end - block_start)
+        pos = max(block.rfind(b"\n"), block.rfind(b"\r"))
+        if pos >= 0:
+            return block_start + pos + 1
+        end = block_start
+    return start
+
+def _load_checkpoint(path, key):
+    try:
+        with io.open(path, "rb") as file_checkpoint:
+            checkpoint = json.loads(file_checkpoint.read().decode("UTF-8"))
+        if checkpoint["key"] == key:
+            return checkpoint
+        logger.debug("Ignoring checkpoint %s: key mismatch." % path)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        logger.debug("No valid checkpoint at %s." % path)
+    return None
+
+def normalize_file_resumable(input_path, output_path, on_error=None,
+                             buffer_size=BUFFER_SIZE,
+                             char_err_lim=CHAR_ERR_LIM, checkpoint_path=None,
+                             on_chars=None):
+    """Normalizes a growing UTF-8 text file like `normalize_file', only
+    processing what was appended to it since the previous call.
+
+    The state of the previous call is read from `checkpoint_path' (the
+    output path followed by CHECKPOINT_SUFFIX by default). The output is
+    then truncated after the complete lines already normalized, and the
+    normalization of the following lines is appended to it. The last line,
+    if it has no end of line yet, is normalized but processed again on the
+    next call. The whole file is normalized if the checkpoint is missing,
+    was written for other tables, or if the input or the output does not
+    match it anymore.
+
+    Returns a Report and the input offset normalization resumed from (0
+    for a full run). Counts of the report cover the whole file, while its
+    LineError are only the ones found in the processed part; `on_error' is
+    called with them, and `on_chars' with the illegal characters of this
+    part, with line numbers counted from the start of the file.
+    """
+    if checkpoint_path is None:
+        checkpoint_path = output_path + CHECKPOINT_SUFFIX
+    key = "%s-%d" % (_norm_table_key(), CHECKPOINT_VERSION)
+    checkpoint = _load_checkpoint(checkpoint_path, key)
+    line_errors = []
+    def shifted(chars):
+        # Lines of the part being processed follow the ones of `total'
+        on_chars([(line_no + total.line_count, char, char_no)
+                  for line_no, char, char_no in chars])
+    with io.open(input_path, "rb") as raw:
+        size = os.fstat(raw.fileno()).st_size
+        total = Report()
+        offset = 0
+        output_size = 0
+        digest = hashlib.sha1() # Of the input before `offset'
+        if checkpoint is not None:
+            try:
+                valid = (checkpoint["offset"] <= size
+                         and os.path.getsize(output_path)
+                             >= checkpoint["output_size"])
+            except OSError:
+                valid = False
+            if valid:
+                prefix_digest = _prefix_hash(raw, checkpoint["offset"],
+                                             buffer_size)
+                valid = (prefix_digest.hexdigest()
+                         == checkpoint["prefix_hash"])
+            if valid:
+                digest = prefix_digest
+                offset = checkpoint["offset"]
+                output_size = checkpoint["output_size"]
+                total.line_count = checkpoint["line_count"]
+                total.err_count = checkpoint["err_count"]
+                total.encoding_err_count = checkpoint["encoding_err_count"]
+            else:
+                logger.debug("Input or output changed since %s."
+                             % checkpoint_path)
+        cut = _last_line_end(raw, offset, size, buffer_size)
+        mode = "r+b" if output_size else "wb"
+        with io.open(output_path, mode) as file_output:
+            file_output.truncate(output_size)
+            file_output.seek(output_size)
+            dst = _EncodedOutput(file_output)
+            for part, (start, end) in enumerate(((offset, cut), (cut, size))):
+                raw.seek(start)
+                validator = Utf8Validator(start)
+                reader = _LimitedReader(raw, end - start)
+                if part == 0: # Complete lines, which the checkpoint covers
+                    reader = _HashingReader(reader, digest)
+                pieces = read_text(reader, buffer_size, validator)
+                report = _process_lines(pieces, line_errors.append, dst,
+                                        char_err_lim=char_err_lim,
+                                        on_chars=shifted if on_chars else None)
+                report.line_errors = line_errors
+                validator.add_to(report)
+                line_errors = []
+                total.merge(report, on_error)
+                if part == 0: # Complete lines
+                    file_output.flush()
+                    new_checkpoint = {
+                        "key": key,
+                        "offset": cut,
+                        "line_count": total.line_count,
+                        "err_count": total.err_count,
+                        "encoding_err_count": total.encoding_err_count,
+                        "pending_size": size - cut,
+                        "output_size": file_output.tell(),
+                        "prefix_hash": digest.hexdigest(),
+                        }
+    tmp_path = "%s.%d.tmp" % (checkpoint_path, os.getpid())
+    with io.open(tmp_path, "wb") as file_checkpoint:
+        file_checkpoint.write(json.dumps(new_checkpoint).encode("UTF-8"))
+    os.rename(tmp_path, checkpoint_path)
+    return total, offset
+
+# ==============================================================================
+# Character histogram
+# Number of occurrences of a character in a corpus, whether it is allowed, and
+# its normalized form (NFKC then TRANSFORMATIONS).
+CharCount = namedtuple("CharCount", ["char", "count", "legal", "normalized"])
+
+def count_chars(text, counts=None):
+    """Adds the number of occurrences of each character of a text to the
+    `counts' dict (a new one if None), returns it."""
+    if counts is None:
+        counts = {}
+    if _use_numpy(len(text)):
+        if _UNIT_SIZE == 4:
+            codes = _code_units(text)
+        else: # Count code points, not UTF-16 code units
+            codes = numpy.frombuffer(text.encode("UTF-32-LE"), dtype="<u4")
+        bins = numpy.bincount(codes)
+        for code in numpy.flatnonzero(bins).tolist():
+            char = _unichr(code)
+            counts[char] = counts.get(char, 0) + int(bins[code])
+    else:
+        for char in set(text):
+            counts[char] = counts.get(char, 0) + text.count(char)
+    return counts
+
+def _count_chunk(job):
+    """Counts the characters of a byte range of a file, read with universal
+    newlines and invalid UTF-8 sequences read as U+FFFD. Returns (path,
+    counts, error message or None)."""
+    path, start, end = job
+    counts = {}
+    try:
+        with open(path, "rb") as file_input:
+            file_input.seek(start)
+            data = file_input.read(end - start)
+        for piece in read_text(io.BytesIO(data), validator=Utf8Validator()):
+            count_chars(piece, counts)
+    except (IOError, OSError, UnicodeError) as exc:
+        return path, counts, str(exc)
+    return path, counts, None
+
+def char_histogram(paths, processes=None, chunk_size=CHUNK_SIZE,
+                   on_error=None):
+    """Counts the characters of a corpus of UTF-8 text files.
+
+    Files are split into chunks of about `chunk_size' bytes (see
+    `find_chunks') counted over a pool of `processes' worker processes (the
+    number of CPUs by default), and the counts are merged. `on_error' is
+    called with the path and a message for each file (or chunk) which cannot
+    be read; the characters read before the error are still counted.
+
+    Returns a list of CharCount, most frequent first.
+    """
+    jobs = []
+    for path in paths:
+        try:
+            jobs.extend((path, start, end)
+                        for start, end in find_chunks(path, chunk_size))
+        except (IOError, OSError) as exc:
+            if on_error:
+                on_error(path, str(exc))
+    counts = {}
+    for path, chunk_counts, message in _pool_map(_count_chunk, jobs,
+                                                 processes, ordered=False):
+        if message is not None and on_error:
+            on_error(path, message)
+        for char, count in chunk_counts.items():
+            counts[char] = counts.get(char, 0) + count
+    return [CharCount(char, count, char in ALLOWED_CHARS,
+                      _normalize_full(char))
+            for char, count in sorted(counts.items(),
+                                      key=lambda item: (-item[1], item[0]))]
+
+# ==============================================================================
+# OCR accuracy
+# Edit distances are computed with the bit-parallel algorithm of Myers (1999),
+# in the formulation of Hyyro (2001), using Python integers as bit vectors:
+# each column of the dynamic programming matrix costs a few operations on
+# integers of one bit per element of the first sequence.
+#
+# Long sequences are compared within a diagonal band (Ukkonen, 1985): only the
+# cells which can lie on a path of cost at most `k' are computed, the others
+# counting as infinite. Bit vectors then only cover the band, which slides down
+# one row per column. The band is widened until the distance found fits in it.
+
+# Sequences shorter than this are compared without a band.
+BAND_MIN_LENGTH = 4096
+
+# Initial cost allowed by the band, as a fraction of the longest sequence.
+BAND_INITIAL_RATIO = 0.05
+
+# Segments of the bit vectors of the first sequence, to extract the bits of the
+# band without shifting integers as long as the sequence.
+_BAND_SEGMENT = 4096
+
+# Character and word error counts of a submission against its ground truth:
+# char_errors and word_errors are edit distances, char_count and word_count the
+# lengths of the ground truth.
+Score = namedtuple("Score", ["char_errors", "char_count", "word_errors",
+                             "word_count"])
+
+def _match_vectors(seq):
+    """Returns a dict mapping each element of a sequence to the bit vector of
+    its positions."""
+    vectors = {}
+    bit = 1
+    for item in seq:
+        vectors[item] = vectors.get(item, 0) | bit
+        bit <<= 1
+    return vectors
+
+def _banded_distance(a, b, k):
+    """Returns the edit distance between `a' and `b' computed within the band
+    of cost `k' (k >= abs(len(b) - len(a))). It is exact if it is at most
+    `k', and larger than `k' otherwise."""
+    m, n = len(a), len(b)
+    delta = n - m
+    spread = (k - abs(delta)) // 2
+    d_lo = min(0, delta) - spread # Band of diagonals j - i
+    d_hi = max(0, delta) + spread
+    vectors = _match_vectors(a)
+    full = d_hi >= n and d_lo <= -m
+    if not full:
+        segments = {}
+        for item, vector in vectors.items():
+            segments[item] = [
+                (vector >> start) & ((1 << _BAND_SEGMENT) - 1)
+                for start in range(0, m + _BAND_SEGMENT, _BAND_SEGMENT)]
+    # Column 0: rows 1 to bot, with D[i][0] = i
+    top = 1
+    bot = min(m, -d_lo)
+    width = bot
+    mask = (1 << width) - 1
+    pv = mask
+    mv = 0
+    score = bot # D[bot][j]
+    for j in range(1, n + 1):
+        if j - d_lo <= m:
+            # New row at the bottom, as if its left neighbor was infinite
+            pv |= 1 << width
+            width += 1
+            score += 1
+        if j - d_hi > top:
+            # Drop the top row, as if the rows above were infinite
+            pv >>= 1
+            mv >>= 1
+            width -= 1
+            top += 1
+        mask = (1 << width) - 1
+        if full:
+            eq = vectors.get(b[j - 1], 0)
+        else:
+            item_segments = segments.get(b[j - 1])
+            eq = 0
+            if item_segments is not None:
+                index, offset = divmod(top - 1, _BAND_SEGMENT)
+                eq = item_segments[index] >> offset
+                shift = _BAND_SEGMENT - offset
+                while shift < width:
+                    index += 1
+                    eq |= item_segments[index] << shift
+                    shift += _BAND_SEGMENT
+                eq &= mask
+        # Hyyro's column step, with a +1 horizontal delta entering the top
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        score += ((ph >> (width - 1)) & 1) - ((mh >> (width - 1)) & 1)
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+    return score
+
+def edit_distance(a, b):
+    """Returns the Levenshtein distance between two sequences (strings, or
+    lists of hashable items such as words).
+
+    Sequences longer than BAND_MIN_LENGTH are compared within a band, which
+    is widened until it holds an optimal alignment.
+    """
+    if len(a) < len(b):
+        a, b = b, a # The bit vectors cover the longest sequence
+    if not b:
+        return len(a)
+    longest = max(len(a), len(b))
+    if longest < BAND_MIN_LENGTH:
+        return _banded_distance(a, b, len(a) + len(b))
+    k = max(abs(len(a) - len(b)), int(longest * BAND_INITIAL_RATIO), 1)
+    while True:
+        distance = _banded_distance(a, b, k)
+        if distance <= k or k >= len(a) + len(b):
+            return distance
+        k = min(2 * k, len(a) + len(b))
+
+def score_texts(text, reference):
+    """Returns the Score of a text against its reference text. Words are
+    the items separated by white space."""
+    words = text.split()
+    reference_words = reference.split()
+    return Score(edit_distance(text, reference), len(reference),
+                 edit_distance(words, reference_words), len(reference_words))
+
+def read_normalized(path, buffer_size=BUFFER_SIZE):
+    """Returns the normalized text of a UTF-8 text file (see
+    `open_compressed'), and its Report. Invalid UTF-8 sequences are read as
+    U+FFFD and listed in the report."""
+    output = io.StringIO()
+    validator = Utf8Validator()
+    with open_compressed(path, "rb") as raw:
+        report = normalize_stream(read_text(raw, buffer_size, validator),
+                                  output)
+    return output.getvalue(), validator.add_to(report)
+
+# Outcome of scoring one submission: the Score, the number of illegal
+# characters and of invalid UTF-8 sequences of the submission, and the
+# messages describing the invalid sequences of both files, each starting
+# with the file path; or an error message if it could not be scored.
+ScoreResult = namedtuple("ScoreResult", ["path", "reference_path", "score",
+                                         "err_count", "message",
+                                         "encoding_err_count",
+                                         "encoding_errors"])
+
+def _score_job(job):
+    path, reference_path = job
+    try:
+        text, report = read_normalized(path)
+        reference, reference_report = read_normalized(reference_path)
+    except (IOError, OSError, UnicodeError) as exc:
+        return ScoreResult(path, reference_path, None, None, str(exc), None,
+                           None)
+    encoding_errors = [
+        "%s: %s" % (file_path, message)
+        for file_path, file_report in ((path, report),
+                                       (reference_path, reference_report))
+        for message in format_encoding_errors(file_report)]
+    return ScoreResult(path, reference_path, score_texts(text, reference),
+                       report.err_count, None, report.encoding_err_count,
+                       encoding_errors)
+
+def score_batch(pairs, processes=None):
+    """Scores (submission path, ground truth path) pairs in parallel.
+
+    Both files of each pair are normalized like `normalize_file' before
+    their character and word edit distances are computed. Pairs are spread
+    over a pool of `processes' worker processes (the number of CPUs by
+    default). Yields a ScoreResult for each pair, in order.
+    """
+    return _pool_map(_score_job, list(pairs), processes)
+
+# ==============================================================================
+# Line index
+# A line index gives the byte offset of one line out of LINE_INDEX_STEP, so
+# that a range of lines of a big file can be read without decoding what
+# precedes it. Lines end with LF, CR or CRLF, like text files opened with
+# newline=''. The index of a file is saved next to it, and rebuilt when the
+# size or modification time of the file change.
+LINE_INDEX_VERSION = 1
+LINE_INDEX_STEP = 1024
+LINE_INDEX_SUFFIX = ".lineidx"
+
+# Description of the lines of a file: offsets[i] is the byte offset of line
+# i * step + 1, and size and mtime those of the indexed file.
+LineIndex = namedtuple("LineIndex",
+                       ["line_count", "step", "offsets", "size", "mtime"])
+
+def build_line_index(path, step=LINE_INDEX_STEP, buffer_size=BUFFER_SIZE):
+    """Reads a file once, returns its LineIndex."""
+    offsets = [0]
+    line_count = 0 # Ends of lines read
+    line_end = 0   # Offset following the last end of line
+    base = 0       # Offset of the current block
+    carry = b""    # CR ending the previous block, maybe followed by LF
+    with io.open(path, "rb") as raw:
+        stat = os.fstat(raw.fileno())
+        for block in iter(functools.partial(raw.read, buffer_size), b""):
+            block = carry + block
+            carry = b""
+            if block.endswith(b"\r"):
+                carry = b"\r"
+                block = block[:-1]
+            match = None
+            for match in _EOL_BYTES_RE.finditer(block):
+                line_count += 1
+                if line_count % step == 0:
+                    offsets.append(base + match.end())
+            if match is not None:
+                line_end = base + match.end()
+            base += len(block)
+        if carry:
+            line_count += 1
+            base += 1
+            line_end = base
+            if line_count % step == 0:
+                offsets.append(base)
+    if base > line_end:
+        line_count += 1 # Last line has no end of line
+    return LineIndex(line_count, step, offsets, stat.st_size, stat.st_mtime)
+
+def load_line_index(path, step=LINE_INDEX_STEP, buffer_size=BUFFER_SIZE):
+    """Returns the LineIndex of a file, from the index saved next to it if
+    it is still valid, or builds it and tries to save it."""
+    index_path = path + LINE_INDEX_SUFFIX
+    stat = os.stat(path)
+    try:
+        with io.open(index_path, "rb") as file_index:
+            content = json.loads(file_index.read().decode("UTF-8"))
+        if (content["version"] == LINE_INDEX_VERSION
+                and content["step"] == step
+                and content["size"] == stat.st_size
+                and content["mtime"] == stat.st_mtime):
+            return LineIndex(content["line_count"], step, content["offsets"],
+                             stat.st_size, stat.st_mtime)
+        logger.debug("Ignoring outdated line index %s." % index_path)
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        logger.debug("No valid line index at %s." % index_path)
+
+    index = build_line_index(path, step, buffer_size)
+    content = dict(index._asdict(), version=LINE_INDEX_VERSION)
+    tmp_path = "%s.%d.tmp" % (index_path, os.getpid())
+    try:
+        with io.open(tmp_path, "wb") as file_index:
+            file_index.write(json.dumps(content).encode("UTF-8"))
+        os.rename(tmp_path, index_path)
+    except (IOError, OSError):
+        logger.debug("Could not save line index to %s." % index_path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return index
+
+def read_lines(path, first_line=1, last_line=None, buffer_size=BUFFER_SIZE):
+    """Yields the lines `first_line' to `last_line' (to the end of the file
+    if None) of a UTF-8 text file, with their end of line.
+
+    Unless the lines are close to the beginning of the file or `path' is
+    STDIO_PATH, reading starts from the closest line given by the index of
+    the file (see `load_line_index'). Invalid UTF-8 sequences are read as
+    U+FFFD REPLACEMENT CHARACTER (but encoded surrogates as themselves on
+    Python 2), so that they can be located.
+    """
+    line_no = 1
+    offset = 0
+    if path != STDIO_PATH and first_line > LINE_INDEX_STEP:
+        index = load_line_index(path, buffer_size=buffer_size)
+        if first_line > index.line_count:
+            return
+        position = (first_line - 1) // index.step
+        line_no = position * index.step + 1
+        offset = index.offsets[position]
+    with open_path(path, "rb") as raw:
+        if offset:
+            raw.seek(offset)
+        text = io.TextIOWrapper(raw, encoding="UTF-8", errors="replace",
+                                newline='')
+        for line in text:
+            if last_line is not None and line_no > last_line:
+                break
+            if line_no >= first_line:
+                yield line
+            line_no += 1
+
+# ==============================================================================
+# Directory watching
+# Files dropped in a directory tree are checked and normalized once they stopped
+# changing. Results are written next to each file, with the following suffixes:
+# normalized text, illegal characters as JSON Lines (see DiagnosticWriter), and
+# the report as JSON (see `handle_request'), which is written last.
+WATCH_OUTPUT_SUFFIX = ".normalized"
+WATCH_DIAGNOSTICS_SUFFIX = ".diagnostics.jsonl"
+WATCH_REPORT_SUFFIX = ".report.json"
+_WATCH_SUFFIXES = (WATCH_OUTPUT_SUFFIX, WATCH_DIAGNOSTICS_SUFFIX,
+                   WATCH_REPORT_SUFFIX, ".tmp")
+
+# Seconds a file must stay unchanged before it is processed, seconds between
+# two scans of the tree when polling, and maximum number of files waiting for
+# or being processed by the workers.
+WATCH_SETTLE_TIME = 2.0
+WATCH_INTERVAL = 1.0
+WATCH_QUEUE_SIZE = 16
+
+# inotify(7) constants.
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_Q_OVERFLOW = 0x00004000
+_IN_ISDIR = 0x40000000
+_IN_EVENT = struct.Struct("iIII")
+
+class _Inotify(object):
+    """Watches a directory tree with the inotify API of Linux, through ctypes.
+
+    `read' returns the paths which changed, new directories being watched
+    (and their files returned) as soon as they appear.
+    """
+    MASK = (_IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO
+            | _IN_CREATE)
+
+    def __init__(self, directory):
+        if ctypes is None or not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c")
+                                     or "libc.so.6", use_errno=True)
+            self.fd = self._libc.inotify_init()
+        except (OSError, AttributeError):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        if self.fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self._dirs = {} # Watch descriptor -> directory
+        self.add_tree(directory)
+
+    def add_tree(self, directory):
+        """Watches a directory and its subdirectories, returns the paths of
+        the files they contain."""
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            wd = self._libc.inotify_add_watch(self.fd, dirpath.encode(
+                sys.getfilesystemencoding() or "UTF-8")
+                if not isinstance(dirpath, bytes) else dirpath, self.MASK)
+            if wd < 0:
+                code = ctypes.get_errno()
+                logger.debug("Cannot watch %s: %s"
+                             % (dirpath, os.strerror(code)))
+                continue
+            self._dirs[wd] = dirpath
+            paths.extend(os.path.join(dirpath, name) for name in filenames)
+        return paths
+
+    def read(self, timeout):
+        """Waits up to `timeout' seconds for events, returns the set of
+        paths which changed, or None if events were lost."""
+        changed = set()
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return changed
+        data = os.read(self.fd, 64 * 1024)
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = _IN_EVENT.unpack_from(data, pos)
+            name = data[pos + _IN_EVENT.size:pos + _IN_EVENT.size + length]
+            pos += _IN_EVENT.size + length
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if wd not in self._dirs:
+                continue
+            path = os.path.join(self._dirs[wd], name.rstrip(b"\0"))
+            if not mask & _IN_ISDIR:
+                changed.add(path)
+            elif mask & (_IN_CREATE | _IN_MOVED_TO):
+                changed.update(self.add_tree(path))
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+class DirectoryWatcher(object):
+    """Finds the files of a directory tree matching `pattern' which were
+    created or modified, once they stopped changing.
+
+    Changes are noticed with inotify when it is available and `use_inotify'
+    is set, by comparing the size and modification time of every file at
+    each call of `poll' otherwise. A file is ready when its size and
+    modification time did not change for `settle_time' seconds. Files whose
+    report (see WATCH_REPORT_SUFFIX) is newer than them were already
+    processed and are ignored until they change again.
+
+    Attributes:
+        pending: dict mapping the files which changed and were not returned
+            yet to their (size, modification time, time of the last change).
+    """
+    def __init__(self, directory, pattern="*.txt",
+                 settle_time=WATCH_SETTLE_TIME, use_inotify=True):
+        self.directory = directory
+        self.pattern = pattern
+        self.settle_time = settle_time
+        self.pending = {}
+        self._done = {} # File -> (size, modification time) when returned
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = _Inotify(directory)
+            except OSError as exc:
+                logger.debug("Polling %s: %s" % (directory, exc))
+        for path in self._scan():
+            try:
+                stat = os.stat(path)
+                processed = (os.stat(path + WATCH_REPORT_SUFFIX).st_mtime
+                             >= stat.st_mtime)
+            except OSError:
+                processed = False
+            if processed:
+                self._done[path] = (stat.st_size, stat.st_mtime)
+        self._update(self._scan(), time.time())
+
+    @property
+    def uses_inotify(self):
+        return self._inotify is not None
+
+    def _matches(self, path):
+        name = os.path.basename(path)
+        return (fnmatch.fnmatch(name, self.pattern)
+                and not name.endswith(_WATCH_SUFFIXES))
+
+    def _scan(self):
+        paths = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            dirnames.sort()
+            paths.extend(os.path.join(dirpath, name)
+                         for name in sorted(filenames))
+        return [path for path in paths if self._matches(path)]
+
+    def _update(self, paths, now):
+        """Records the files of `paths' whose size or modification time
+        changed."""
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError: # Removed or renamed
+                self.pending.pop(path, None)
+                continue
+            signature = (stat.st_size, stat.st_mtime)
+            if self._done.get(path) == signature:
+                continue
+            entry = self.pending.get(path)
+            if entry is None or entry[:2] != signature:
+                # A file copied with its original dates may look old
+                self.pending[path] = signature + (
+                    max(now, stat.st_mtime) if entry else stat.st_mtime,)
+
+    def poll(self, timeout=WATCH_INTERVAL, limit=None):
+        """Waits up to `timeout' seconds for changes, then returns the list
+        of the files which are ready, oldest first, at most `limit' of them.
+        Other ready files are returned by the next calls."""
+        if self._inotify is not None:
+            paths = self._inotify.read(timeout)
+            if paths is None:
+                logger.debug("Lost inotify events, scanning %s."
+                             % self.directory)
+                paths = self._scan()
+            paths = [path for path in paths if self._matches(path)]
+        else:
+            time.sleep(timeout)
+            paths = self._scan()
+        now = time.time()
+        # Pending files are checked again, in case some change was missed.
+        self._update(set(paths) | set(self.pending), now)
+        ready = sorted((entry[2], path)
+                       for path, entry in self.pending.items()
+                       if now - entry[2] >= self.settle_time)
+        ready = [path for changed, path in ready[:limit]]
+        for path in ready:
+            self._done[path] = self.pending.pop(path)[:2]
+        return ready
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+def _watch_job(path):
+    """Normalizes a file of a watched directory, writing its outputs next to
+    it (see WATCH_OUTPUT_SUFFIX). Returns a BatchResult.
+
+    Outputs are written to temporary files and renamed, the report last, so
+    that a report always comes with complete outputs.
+    """
+    outputs = [path + suffix for suffix in (WATCH_OUTPUT_SUFFIX,
+                                            WATCH_DIAGNOSTICS_SUFFIX,
+                                            WATCH_REPORT_SUFFIX)]
+    tmp_paths = ["%s.%d.tmp" % (output, os.getpid()) for output in outputs]
+    try:
+        with io.open(tmp_paths[1], "wb") as stream:
+            on_error, on_chars = DiagnosticWriter(stream).callbacks(path)
+            report = normalize_file(path, tmp_paths[0], on_error=on_error,
+                                    on_chars=on_chars)
+        with io.open(tmp_paths[2], "wb") as file_report:
+            file_report.write(json.dumps(_report_to_json(report))
+                              .encode("UTF-8"))
+        for tmp_path, output in zip(tmp_paths, outputs):
+            os.rename(tmp_path, output)
+    except (IOError, OSError, UnicodeError) as exc:
+        for tmp_path in tmp_paths:
+            _remove_quietly(tmp_path)
+        return BatchResult(path, outputs[0], ERRCODE_IOERROR, None, str(exc))
+    return BatchResult(path, outputs[0], report.ret_code, report, None)
+
+def watch_directory(directory, pattern="*.txt", processes=None,
+                    queue_size=WATCH_QUEUE_SIZE,
+                    settle_time=WATCH_SETTLE_TIME, interval=WATCH_INTERVAL,
+                    use_inotify=True, once=False, initializer=None):
+    """Checks and normalizes the files of a directory tree as they arrive.
+
+    Files are found by a DirectoryWatcher, and processed by a pool of
+    `processes' worker processes (the number of CPUs by default), their
+    outputs being written next to them (see WATCH_OUTPUT_SUFFIX). At most
+    `queue_size' files wait for or are being processed by the workers: new
+    files stay pending until some of them are done. Yields a BatchResult for
+    each file, in completion order, forever, or until no file is left if
+    `once' is set. Workers call `initializer' when they start, if given.
+    """
+    pool = multiprocessing.Pool(processes, initializer)
+    watcher = DirectoryWatcher(directory, pattern, settle_time, use_inotify)
+    logger.debug("Watching %s with %s." % (
+        directory, "inotify" if watcher.uses_inotify else "polling"))
+    queue = []
+    try:
+        while True:
+            for result in [result for result in queue if result.ready()]:
+                queue.remove(result)
+                yield result.get()
+            if once and not queue and not watcher.pending:
+                return
+            # Results are collected quickly while workers are busy.
+            timeout = min(interval, 0.1) if queue else interval
+            for path in watcher.poll(timeout, queue_size - len(queue)):
+                queue.append(pool.apply_async(_watch_job, (path,)))
+    finally:
+        watcher.close()
+        pool.terminate()
+        pool.join()
+
+# ==============================================================================
+# Server protocol
+# Clients send requests to a server (see `server.py') as JSON objects, one per
+# line, and get one response line per request, in the same order.
+DEFAULT_SERVER_ADDRESS = "127.0.0.1:2015"
+
+# Maximum size of a request line, in bytes.
+MAX_REQUEST_SIZE = 64 * 1024 * 1024
+
+def parse_address(address):
+    """Returns the (socket family, socket address) of a server address, which
+    is either "host:port" or the path to a Unix socket."""
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit() and os.sep not in address:
+        return socket.AF_INET, (host or "127.0.0.1", int(port))
+    return socket.AF_UNIX, address
+
+def is_loopback_host(host):
+    """Tells whether a host name or IPv4 address only designates the loopback
+    interface."""
+    try:
+        infos = socket.getaddrinfo(host, None, socket.AF_INET)
+    except socket.error:
+        return False
+    return bool(infos) and all(info[4][0].startswith("127.") for info in infos)
+
+def line_error_to_json(line_error):
+    """Returns a LineError as a [line_no, err_count, [[char, char_no], ...]]
+    list."""
+    line_no, err_count, extra_chars = line_error
+    return [line_no, err_count,
+            [[char, char_no] for char, char_no in extra_chars]]
+
+def line_error_from_json(value):
+    """Returns the LineError given by `line_error_to_json'."""
+    line_no, err_count, extra_chars = value
+    return LineError(line_no, err_count,
+                     [(char, char_no) for char, char_no in extra_chars])
+
+def _report_to_json(report):
+    return {"ret_code": report.ret_code,
+            "err_count": report.err_count,
+            "line_count": report.line_count,
+            "line_err_count": report.line_err_count,
+            "truncated": report.truncated,
+            "line_errors": [line_error_to_json(line_error)
+                            for line_error in report.line_errors],
+            "encoding_err_count": report.encoding_err_count,
+            "encoding_errors": [encoding_error_to_json(encoding_error)
+                                for encoding_error in report.encoding_errors]}
+
+def handle_request(request):
+    """Processes a server request, returns its response.
+
+    Requests are dicts with a "command": "ping", "check" or "normalize".
+    Texts to check or normalize are given either as the path of a file on the
+    server side ("input"), or inline ("text"). Normalizing a file requires an
+    "output" path, while normalized texts are returned in the "text" field of
+    the response. "max_errors" may be given to check requests, and "id" is
+    copied to the response.
+
+    Responses are dicts with a "ret_code" (one of the ERRCODE_* values). Check
+    and normalize responses also have the "err_count", "line_count",
+    "line_err_count", "truncated", "line_errors", "encoding_err_count" and
+    "encoding_errors" fields of the Report (where only the first LINE_ERR_LIM
+    line errors and invalid sequences are listed), with line errors as given
+    by `line_error_to_json' and invalid UTF-8 sequences as given by
+    `encoding_error_to_json'. Failed requests have an "error" message.
+    """
+    response = {}
+    if isinstance(request, dict) and "id" in request:
+        response["id"] = request["id"]
+    try:
+        command = request["command"]
+        if command == "ping":
+            response["ret_code"] = ERRCODE_OK
+            return response
+        if command not in ("check", "normalize"):
+            raise ValueError("unknown command: %r" % (command,))
+        if "text" in request:
+            raw = io.BytesIO(request["text"].encode("UTF-8"))
+            if command == "check":
+                report = check_text(read_text(raw),
+                                     max_errors=request.get("max_errors"))
+            else:
+                output = io.StringIO()
+                report = normalize_stream(read_text(raw), output)
+                response["text"] = output.getvalue()
+        elif command == "check":
+            report = check_file(request["input"],
+                                max_errors=request.get("max_errors"))
+        else:
+            report = normalize_file(request["input"], request["output"])
+    except UnicodeError as exc:
+        response.update(ret_code=ERRCODE_IOERROR, error=str(exc))
+        return response
+    except (KeyError, ValueError, TypeError, AttributeError) as exc:
+        response.update(ret_code=ERRCODE_BADREQUEST,
+                        error="Bad request: %s" % exc)
+        return response
+    except (IOError, OSError) as exc:
+        ret_code = ERRCODE_IOERROR
+        if exc.errno == errno.ENOENT:
+            ret_code = ERRCODE_NOFILE
+        response.update(ret_code=ret_code, error=str(exc))
+        return response
+    response.update(_report_to_json(report))
+    return response
+
+def warm_up():
+    """Builds the lookup tables, so that the first request is not slower."""
+    _get_norm_tables()
+    if _use_numpy(NUMPY_MIN_LENGTH):
+        _get_legal_table()
+
+class ServerClient(object):
+    """Connection to a server, see `handle_request'. Can be used in a with
+    statement."""
+    def __init__(self, address=DEFAULT_SERVER_ADDRESS, timeout=None):
+        family, socket_address = parse_address(address)
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.settimeout(timeout)
+        self._socket.connect(socket_address)
+        self._file = self._socket.makefile("rb")
+
+    def request(self, request):
+        """Sends a request dict, returns the response dict."""
+        self._socket.sendall(json.dumps(request).encode("UTF-8") + b"\n")
+        line = self._file.readline()
+        if not line:
+            raise IOError("Connection closed by the server")
+        return json.loads(line.decode("UTF-8"))
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
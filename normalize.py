@@ -29,7 +29,8 @@ context of the challenge 2 "Mobile OCR Challenge" of the SmartDOC competition
 at ICDAR 2015. 
 
 Input restrictions:
-    - Encoding MUST BE UTF-8.
+    - Encoding MUST BE UTF-8. Invalid byte sequences are reported with their
+      byte offset, and written as U+FFFD REPLACEMENT CHARACTER.
     - End of line MUST BE either CRLF (Windows), CR (old Macintosh) or LF (OSX,
       *nix).
 
@@ -39,6 +40,16 @@ Output post-conditions:
 
 Sample usage:
     normalize.py /path/to/utf-8/text/file.txt /path/to/normalized/output.txt
+    normalize.py --batch /path/to/results/dir /path/to/normalized/dir
+    normalize.py --batch /path/to/manifest.txt /path/to/normalized/dir
+    normalize.py --split /path/to/huge/file.txt /path/to/normalized/output.txt
+    normalize.py --stats /path/to/utf-8/text/file.txt /path/to/output.txt
+    normalize.py --format csv --diagnostics report.csv input.txt output.txt
+    gunzip -c result.txt.gz | normalize.py - - | gzip > normalized.txt.gz
+    normalize.py /path/to/result.txt.gz /path/to/normalized.txt.xz
+    normalize.py /path/to/results.tar.gz /path/to/normalized.zip
+    normalize.py --cache --batch /path/to/results/ /path/to/normalized/
+    normalize.py --resume /path/to/growing/file.txt /path/to/output.txt
 
 
 Copyright (c) 2015 - J. Chazalon, S. Eskenazi 
@@ -53,8 +64,21 @@ conditions; see `LICENCE' file for details.
 import logging
 import argparse
 import sys
-import unicodedata
-import io
+import json
+
+from moclib import (ERRCODE_OK, ERRCODE_IOERROR, ERRCODE_EXTRACHAR,
+                    BUFFER_SIZE, CHUNK_SIZE, normalize_file,
+                    normalize_file_parallel, format_line_error,
+                    list_batch_jobs, normalize_batch, Stats,
+                    DIAGNOSTIC_FORMATS, DiagnosticWriter, STDIO_PATH, Report,
+                    is_archive, normalize_archive, ResultCache,
+                    RESULT_CACHE_DIR, RESULT_CACHE_SIZE,
+                    normalize_file_resumable, CHECKPOINT_SUFFIX,
+                    format_encoding_errors)
+# Not used here: constants this program used to define itself, which other
+# programs may still import from it.
+from moclib import (ERRCODE_NOFILE, ALLOWED_INPUT, TRANSFORMATIONS,
+                    CHAR_ERR_LIM)
 
 # ==============================================================================
 # Logging
@@ -66,84 +90,7 @@ PROG_VERSION = "2.2"
 PROG_DESCR = "OCR Result Normalizer for ICDAR15 SmartDOC"
 PROG_NAME = "moc_norm"
 
-ERRCODE_OK = 0
-ERRCODE_NOFILE = 10
-ERRCODE_EXTRACHAR = 50
-
-ALLOWED_INPUT = (
-    u""" !"#$%&'()*+,-./0123456789:;<=>?@ABCDEFGHIJKLMNOPQRSTUVWXYZ[\]^_`abc"""
-    u"""defghijklmnopqrstuvwxyz{|}~ ¡¢£¤¥¦§¨©ª«¬­®¯°±²³´µ¶·¸¹º»¼½¾¿ÀÁÂÃÄÅÆÇÈÉ"""
-    u"""ÊËÌÍÎÏÐÑÒÓÔÕÖ×ØÙÚÛÜÝÞßàáâãäåæçèéêëìíîïðñòóôõö÷øùúûüýþÿŒœŠšŸŽžƒˆ˜–—‘’"""
-    u"""‚“”„†‡•…‰‹›€™ﬁﬂﬀﬃﬄ"""
-# Horizontal tab added separately for convenience
-    u"\u0009"
-# additions due to Unicode normalization:
-# - 0308 COMBINING DIAERESIS
-# - 0301 COMBINING ACUTE ACCENT 
-# - 03BC GREEK SMALL LETTER MU  
-# - 0327 COMBINING CEDILLA  
-# - 0303 COMBINING TILDE
-# - 0304 COMBINING MACRON   
-# - 2044 FRACTION SLASH 
-    u"\u0308\u0301\u03BC\u0327\u0303\u0304\u2044"
-# ZERO WIDTH NO-BREAK SPACE    
-    u"\ufeff"
-    )
-
-TRANSFORMATIONS = [
-    (u"\u0009", u" "), # HTAB to SPACE
-    (u"\u00A0", u" "), # NBSP to SPACE
-    (u"¦", u"|"), # U+00A6 # Commonly interchanged
-# ¨ U+00A8 to U+0020 U+0308    ̈
-# ª U+00AA to U+0061  a
-    (u"«", u"\""), # U+00AB
-    (u"\u00AD", u""), # remove SOFT HYPHEN
-# ¯ U+00AF to U+0020 U+0304    ̄
-# ² U+00B2 to U+0032  2
-# ³ U+00B3 to U+0033  3
-# ´ U+00B4 to U+0020 U+0301    ́
-# µ U+00B5 to U+03BC  μ
-# ¸ U+00B8 to U+0020 U+0327    ̧
-# ¹ U+00B9 to U+0031  1
-# º U+00BA to U+006F  o
-    (u"»", u"\""), # U+00BB
-# ¼ U+00BC to U+0031 U+002F U+0034  1/4 # done by FRACTION SLASH replace after norm.
-# ½ U+00BD to U+0031 U+002F U+0032  1/2 # done by FRACTION SLASH replace after norm.
-# ¾ U+00BE to U+0033 U+002F U+0034  3/4 # done by FRACTION SLASH replace after norm.
-    (u"Æ", u"AE"), # U+00C6
-    (u"æ", u"ae"), # U+00E6
-    (u"Œ", u"OE"), # U+0152
-    (u"œ", u"oe"), # U+0153
-#˜   U+02DC to U+0020 U+0303    ̃
-    (u"–", u"-"), # U+2013
-    (u"—", u"-"), # U+2014
-    (u"‘", u"\'"), # U+2018
-    (u"’", u"\'"), # U+2019
-    (u"‚", u"\'"), # U+201A
-    (u"“", u"\""), # U+201C
-    (u"”", u"\""), # U+201D
-    (u"„", u"\""), # U+201E
-# …   U+2026 to U+002E U+002E U+002E    ...
-    (u"‹", u"\'"), # U+2039
-    (u"›", u"\'"), # U+203A
-# ™   U+2122 to U+0054 U+004D   TM
-    # (u"\uFB00", u"ff"),  # Replace ff, fi, fl, ffi, ffl ligatures with separated 
-    # (u"\uFB01", u"fi"),  # chars. before Unicode normalization inserts
-    # (u"\uFB02", u"fl"),  # "200c ZERO WIDTH NON-JOINER"
-    # (u"\uFB03", u"ffi"), # (actually not wrote to UTF-8 output so not done here)
-    # (u"\uFB04", u"ffl"),
-    (u"⁄", u"/"), # FRACTION SLASH U+2044
-    (u"\ufeff", u""), # ZERO WIDTH NO-BREAK SPACE // Byte Order Mark
-    ]
-
-CHAR_ERR_LIM = 5
-
-# ==============================================================================
-def _transform(unistr):
-    s2 = unistr
-    for fr, to in TRANSFORMATIONS:
-        s2 = s2.replace(fr, to)
-    return s2
+_COMPRESSED = (".gz", ".bz2", ".xz")
 
 # ==============================================================================
 # Utility private functions
@@ -172,8 +119,105 @@ def _initLogger(logger, debug=False):
         level = logging.DEBUG
     logger.setLevel(level)
 
-def _unichr2str(unichar):
-    return unicodedata.name(unichar, repr(unichar))
+def _logLineError(line_error):
+    for message in format_line_error(line_error):
+        logger.error(message)
+
+def _openDiagnostics(args):
+    """Returns the DiagnosticWriter selected by the command line options, or
+    None for text diagnostics."""
+    if args.format == "text":
+        return None
+    stream = sys.stdout
+    if args.diagnostics != STDIO_PATH:
+        stream = open(args.diagnostics, "wb")
+    return DiagnosticWriter(stream, args.format, args.per_line)
+
+class _MemberLogger(object):
+    """Logs the LineError of archive members, naming each member before its
+    first error."""
+    def __init__(self):
+        self.name = None
+
+    def __call__(self, name, line_error):
+        if name != self.name:
+            logger.error("In %s:" % name)
+            self.name = name
+        _logLineError(line_error)
+
+def _memberCallbacks(args, diagnostics):
+    """Returns the (on_error, on_chars) pair of callbacks for the members of
+    an archive (see `normalize_archive')."""
+    if diagnostics is None:
+        return _MemberLogger(), None
+    if args.per_line:
+        return (lambda name, line_error: diagnostics.write(
+                    "%s:%s" % (args.input, name), line_error)), None
+    return None, lambda name, chars: diagnostics.write_chars(
+        "%s:%s" % (args.input, name), chars)
+
+def _normalizeArchive(args, diagnostics):
+    """Normalizes the members of an archive. Returns a Report with the total
+    number of illegal characters."""
+    on_error, on_chars = _memberCallbacks(args, diagnostics)
+    total = Report()
+    for name, report in normalize_archive(args.input, args.output, on_error,
+                                          args.buffer_size,
+                                          on_chars=on_chars):
+        logger.debug("%s: %d illegal character(s)."
+                     % (name, report.err_count))
+        for message in format_encoding_errors(report):
+            logger.error("%s: %s" % (name, message))
+        total.err_count += report.err_count
+        total.encoding_err_count += report.encoding_err_count
+    return total
+
+def _openCache(args):
+    """Returns the ResultCache selected by the command line options, or
+    None."""
+    if args.cache is None:
+        return None
+    return ResultCache(args.cache, args.cache_size * 1024 * 1024,
+                       "%s-%s" % (PROG_NAME, PROG_VERSION))
+
+def _runBatch(args, diagnostics=None):
+    jobs = list_batch_jobs(args.input, args.output, args.pattern)
+    logger.debug("Batch of %d file(s)." % len(jobs))
+    ret_code = ERRCODE_OK
+    counts = {ERRCODE_OK: 0, ERRCODE_EXTRACHAR: 0, ERRCODE_IOERROR: 0}
+    err_count = 0
+    on_chars = None
+    if diagnostics is not None and not args.per_line:
+        on_chars = diagnostics.write_chars
+    for result in normalize_batch(jobs, args.jobs, cache=_openCache(args),
+                                  on_chars=on_chars):
+        counts[result.ret_code] += 1
+        ret_code = max(ret_code, result.ret_code)
+        if result.report is None:
+            logger.error("%s: %s" % (result.input_path, result.message))
+        elif result.report.err_count > 0:
+            err_count += result.report.err_count
+            logger.error("%s: %d illegal character(s)."
+                         % (result.input_path, result.report.err_count))
+            for message in format_encoding_errors(result.report):
+                logger.debug(message)
+            for line_error in result.report.line_errors:
+                if diagnostics is not None:
+                    if args.per_line:
+                        diagnostics.write(result.input_path, line_error)
+                    continue
+                for message in format_line_error(line_error):
+                    logger.debug(message)
+        else:
+            logger.debug("%s: OK" % result.input_path)
+
+    if ret_code != ERRCODE_OK:
+        logger.error(_DBGSEP)
+    logger.info("Processed %d file(s): %d clean, %d with illegal characters "
+                "(%d in total), %d failed."
+                % (len(jobs), counts[ERRCODE_OK], counts[ERRCODE_EXTRACHAR],
+                   err_count, counts[ERRCODE_IOERROR]))
+    return ret_code
 
 # ==============================================================================
 # Main function
@@ -187,10 +231,82 @@ def main():
     parser.add_argument('-d', '--debug', 
         action="store_true", 
         help="Activate debug output.")
+    parser.add_argument('--buffer-size', 
+        type=int, default=BUFFER_SIZE, 
+        help="Size of the blocks files are read and written by, in bytes "
+             "(default: %(default)s).")
+    parser.add_argument('-b', '--batch', 
+        action="store_true", 
+        help="Batch mode: input is a directory tree or a manifest file "
+             "listing input files (one per line), and output is the "
+             "directory where normalized files are written, mirroring the "
+             "input tree.")
+    parser.add_argument('-s', '--split', 
+        action="store_true", 
+        help="Split the input file into chunks normalized in parallel. "
+             "Output and messages are the same as without this option.")
+    parser.add_argument('--chunk-size', 
+        type=int, default=CHUNK_SIZE, 
+        help="Approximate size of the chunks in bytes with --split "
+             "(default: %(default)s).")
+    parser.add_argument('-j', '--jobs', 
+        type=int, default=None, 
+        help="Number of worker processes in batch and split modes "
+             "(default: number of CPUs).")
+    parser.add_argument('-p', '--pattern', 
+        default="*.txt", 
+        help="Files to process when walking a directory in batch mode "
+             "(default: %(default)s).")
+    parser.add_argument('--stats', 
+        action="store_true", 
+        help="Print statistics of the normalization as JSON on the standard "
+             "output: time spent in each stage, bytes, characters and lines "
+             "processed, lines changed by NFKC and number of times each "
+             "transformation fired. Not available in batch mode.")
+    parser.add_argument('--cache', 
+        nargs="?", const=RESULT_CACHE_DIR, default=None, metavar='DIR',
+        help="Copy the result of files already normalized from a cache "
+             "directory instead of normalizing them again, and add new "
+             "results to it. Files are identified by their content "
+             "(default directory: %s)." % RESULT_CACHE_DIR)
+    parser.add_argument('--cache-size', 
+        type=int, default=RESULT_CACHE_SIZE // (1024 * 1024), metavar='MB',
+        help="Maximum size of the cache, in MiB: the least recently used "
+             "results are removed beyond it (default: %(default)s).")
+    parser.add_argument('--resume', 
+        action="store_true",
+        help="Only normalize what was appended to the input since the "
+             "previous run with this option, and append it to the output. "
+             "The state of the previous run is kept in a file named after "
+             "the output, followed by %s; the whole file is normalized "
+             "again if the input was modified otherwise, which is checked "
+             "by reading the part already normalized again to hash it "
+             "(without decoding it). Only the illegal characters of the new "
+             "lines are reported, but the return code covers the whole "
+             "file." % CHECKPOINT_SUFFIX)
+    parser.add_argument('--format', 
+        choices=("text",) + DIAGNOSTIC_FORMATS, default="text", 
+        help="Format of the illegal character diagnostics: text messages in "
+             "the log, or records streamed as JSON Lines or CSV with file, "
+             "line, column, code_point, name and count fields "
+             "(default: %(default)s).")
+    parser.add_argument('--per-line', 
+        action="store_true", 
+        help="With --format jsonl or csv, write one record per line with "
+             "illegal characters instead of one per illegal character.")
+    parser.add_argument('--diagnostics', 
+        default=STDIO_PATH, metavar='FILE',
+        help="File the jsonl or csv diagnostics are written to "
+             "(default: standard output).")
     parser.add_argument('input', 
-        help='Input text file with UTF-8 encoding.')
+        help="Input text file with UTF-8 encoding, or %s for the standard "
+             "input. It may be compressed (.gz, .bz2, .xz), or be a zip or "
+             "tar archive whose files are all normalized." % STDIO_PATH)
     parser.add_argument('output', 
-        help="Path to normalized output file.")
+        help="Path to normalized output file, or %s for the standard "
+             "output. It is compressed if its extension is .gz, .bz2 or "
+             ".xz. For an archive input, it is a zip or tar archive if it "
+             "has such an extension, or a directory otherwise." % STDIO_PATH)
     args = parser.parse_args()
 
     # --------------------------------------------------------------------------
@@ -207,58 +323,107 @@ def main():
     logger.debug(_DBGSEP)
 
     # --------------------------------------------------------------------------
-    charset = ALLOWED_INPUT + u'\u000a' # Tolerate '\n' (LF) EOL
-    
-    err_count = 0
-    with io.open(args.output, "wt", encoding="UTF-8", newline='', 
-                 errors="strict") as file_output:
-        # output lines are utf-8-encoded and have LF EOL
-        logger.debug("--- Process started. ---")
-        line_no = 0
-        with io.open(args.input, "rt", encoding="UTF-8", newline=None, 
-                     errors="strict") as file_input:
-            # input lines are Unicode code point sequences with LF-normalized EOL
-            for line in file_input:
-                line_no += 1
-
-                # Check input
-                extra_chars = []
-                char_no = 0
-                for char in line:
-                    char_no += 1
-                    if char not in charset:
-                        extra_chars.append((char, char_no))
-                        err_count += 1
-                    # logger.debug("\tl:%03d c:%03d %04x %s" 
-                    #     % (line_no, char_no, ord(char), _unichr2str(char)))
-                if extra_chars:
-                    logger.error("Got %d illegal character(s) in line %d : " 
-                                 % (len(extra_chars), line_no))
-                    for i in range(min(CHAR_ERR_LIM, len(extra_chars))):
-                        char, pos = extra_chars[i]
-                        logger.error("\tl:%03d c:%03d %s" 
-                                     % (line_no, pos, _unichr2str(char)))
-                    if len(extra_chars) > CHAR_ERR_LIM:
-                        logger.error("\t ... and %d other(s)." 
-                                     % (len(extra_chars) - CHAR_ERR_LIM))
-
-                # Unicode normalization
-                line_norm = unicodedata.normalize('NFKC', line)
-                
-                # Perform custom translations
-                line_tr = _transform(line_norm)
-
-                # Output new line
-                file_output.write(line_tr) 
+    if args.batch and args.stats:
+        parser.error("--stats cannot be used with --batch")
+    if args.batch and STDIO_PATH in (args.input, args.output):
+        parser.error("standard input and output cannot be used with --batch")
+    if args.split and args.input == STDIO_PATH:
+        parser.error("standard input cannot be used with --split")
+    if ((args.split or args.batch) 
+            and (is_archive(args.input) or args.input.endswith(_COMPRESSED))):
+        parser.error("compressed files and archives cannot be used with "
+                     "--split or --batch")
+    if args.cache is not None and (args.stats or args.input == STDIO_PATH
+                                   or is_archive(args.input)):
+        parser.error("--cache cannot be used with --stats, the standard "
+                     "input or archives")
+    if args.resume and (args.batch or args.split or args.stats
+                        or args.cache is not None
+                        or STDIO_PATH in (args.input, args.output)
+                        or is_archive(args.input)
+                        or args.input.endswith(_COMPRESSED)
+                        or args.output.endswith(_COMPRESSED)):
+        parser.error("--resume only works on plain files, without --batch, "
+                     "--split, --stats or --cache")
+    if is_archive(args.input) and (args.stats or args.output == STDIO_PATH):
+        parser.error("--stats and standard output cannot be used with "
+                     "archives")
+    stdout_users = [name for name, used in (
+        ("output", args.output == STDIO_PATH), ("--stats", args.stats),
+        ("--format " + args.format,
+         args.format != "text" and args.diagnostics == STDIO_PATH)) if used]
+    if len(stdout_users) > 1:
+        parser.error("%s cannot both use the standard output, please use a "
+                     "file for one of them" % " and ".join(stdout_users))
+    diagnostics = _openDiagnostics(args)
+    if args.batch:
+        logger.debug("--- Batch process started. ---")
+        ret_code = _runBatch(args, diagnostics)
+        if diagnostics is not None and args.diagnostics != STDIO_PATH:
+            diagnostics.stream.close()
+        logger.debug("--- Batch process complete. ---")
+        logger.debug("Clean exit.")
+        logger.debug(_DBGSEP)
+        return ret_code
+
+    # --------------------------------------------------------------------------
+    # output lines are utf-8-encoded and have LF EOL
+    logger.debug("--- Process started. ---")
+    stats = Stats() if args.stats else None
+    on_error, on_chars = _logLineError, None
+    if diagnostics is not None:
+        on_error, on_chars = diagnostics.callbacks(args.input)
+    cache = _openCache(args)
+    if is_archive(args.input):
+        report = _normalizeArchive(args, diagnostics)
+    elif args.resume:
+        report, offset = normalize_file_resumable(
+            args.input, args.output, on_error=on_error,
+            buffer_size=args.buffer_size, on_chars=on_chars)
+        if offset:
+            logger.debug("Resumed from byte %d of the input." % offset)
+    elif cache is not None:
+        function = None
+        kwargs = {}
+        if args.split:
+            function = normalize_file_parallel
+            kwargs = dict(processes=args.jobs, chunk_size=args.chunk_size)
+        report = cache.normalize_file(args.input, args.output,
+                                      on_error=on_error,
+                                      buffer_size=args.buffer_size,
+                                      function=function, on_chars=on_chars,
+                                      **kwargs)
+        if cache.hits:
+            logger.debug("Result found in cache.")
+    elif args.split:
+        report = normalize_file_parallel(args.input, args.output, args.jobs,
+                                         args.chunk_size, on_error=on_error,
+                                         stats=stats, on_chars=on_chars)
+    else:
+        report = normalize_file(args.input, args.output, 
+                                on_error=on_error,
+                                buffer_size=args.buffer_size, stats=stats,
+                                on_chars=on_chars)
+    if diagnostics is not None and args.diagnostics != STDIO_PATH:
+        diagnostics.stream.close()
 
     logger.debug("--- Process complete. ---")
+    if stats is not None:
+        json.dump(stats.as_dict(), sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
     # --------------------------------------------------------------------------
 
-    ret_code = ERRCODE_OK
-    if err_count > 0:
+    ret_code = report.ret_code
+    if report.err_count > 0 or report.encoding_err_count > 0:
         logger.error(_DBGSEP)
-        logger.error("Input file contains %d illegal characters." % err_count)
-        ret_code = ERRCODE_EXTRACHAR
+        if report.encoding_err_count > 0:
+            for message in format_encoding_errors(report):
+                logger.error(message)
+            logger.error("Input file contains %d invalid UTF-8 sequence(s), "
+                         "written as U+FFFD REPLACEMENT CHARACTER."
+                         % report.encoding_err_count)
+        logger.error("Input file contains %d illegal characters."
+                     % report.err_count)
     else:
         logger.debug("Input file contains only legal characters.")
 
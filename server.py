@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC server. Checks and normalizes files for local clients.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program runs a long-lived server which checks and normalizes files for
+local clients, so that they do not pay for the interpreter startup and the
+building of the lookup tables on each file.
+
+Clients connect to a Unix socket or to a TCP port of the loopback interface
+(the server has no authentication, so other interfaces are refused) and send
+requests as JSON objects, one per line; the server answers each of them with
+one JSON line, in the same order. Requests are processed concurrently by a
+pool of worker processes. See `moclib.handle_request' for the content of
+requests and responses, and `client.py' and `loadtest.py' for clients.
+
+Sample usage:
+    server.py
+    server.py --address /tmp/moc.sock --jobs 4
+
+
+Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+                   - L3i / University of La Rochelle, France
+This program comes with ABSOLUTELY NO WARRANTY; for details see `LICENCE' file.
+This is free software, and you are welcome to redistribute it under certain
+conditions; see `LICENCE' file for details.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import os
+import json
+import multiprocessing
+import signal
+import socket
+import stat
+import SocketServer
+
+from moclib import (ERRCODE_OK, ERRCODE_BADREQUEST, DEFAULT_SERVER_ADDRESS,
+                    ERRCODE_IOERROR, MAX_REQUEST_SIZE, parse_address,
+                    is_loopback_host, handle_request, warm_up)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_DESCR = "OCR Result Checking and Normalization Server for ICDAR15 SmartDOC"
+PROG_NAME = "moc_server"
+
+# ==============================================================================
+# Utility private functions
+def _dumpArgs(args, logger=logger):
+    logger.debug("Arguments:")
+    for (k, v) in args.__dict__.items():
+        logger.debug("    %-20s = %s" % (k, v))
+
+_DBGLINELEN = 80
+_DBGSEP = "-"*_DBGLINELEN
+
+def _programHeader(logger, prog_name, prog_version):
+    logger.debug(_DBGSEP)
+    dbg_head = "%s - v. %s" % (prog_name, prog_version)
+    dbg_head_pre = " " * (max(0, (_DBGLINELEN - len(dbg_head)))/2)
+    logger.debug(dbg_head_pre + dbg_head)
+
+def _initLogger(logger, debug=False):
+    format="%(module)-9s %(levelname)-7s: %(message)s"
+    formatter = logging.Formatter(format)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+    logger.setLevel(level)
+
+def _workerInit():
+    # Let the main process handle interruptions
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    warm_up()
+
+class _RequestHandler(SocketServer.StreamRequestHandler):
+    """Answers the requests of a connection, one line each."""
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_SIZE + 1)
+            if not line:
+                break
+            if not line.strip():
+                continue
+            if len(line) > MAX_REQUEST_SIZE:
+                self._respond({"ret_code": ERRCODE_BADREQUEST,
+                               "error": "Request too large."})
+                break
+            try:
+                request = json.loads(line.decode("UTF-8"))
+            except ValueError as exc:
+                response = {"ret_code": ERRCODE_BADREQUEST,
+                            "error": "Bad request: %s" % exc}
+            else:
+                response = self.server.pool.apply(handle_request, (request,))
+            logger.debug("Request %s: %d"
+                         % (response.get("id", "-"), response["ret_code"]))
+            self._respond(response)
+
+    def _respond(self, response):
+        self.wfile.write(json.dumps(response).encode("UTF-8") + b"\n")
+        self.wfile.flush()
+
+class _TCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+class _UnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+def _makeServer(address):
+    family, socket_address = parse_address(address)
+    if family == socket.AF_UNIX:
+        # Only replace the socket a previous server left behind
+        try:
+            mode = os.lstat(socket_address).st_mode
+        except OSError:
+            mode = None
+        if mode is not None:
+            if not stat.S_ISSOCK(mode):
+                raise IOError("%s exists and is not a socket." % address)
+            os.remove(socket_address)
+        return _UnixServer(socket_address, _RequestHandler)
+    return _TCPServer(socket_address, _RequestHandler)
+
+# ==============================================================================
+# Main function
+def main():
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=PROG_DESCR,
+        epilog=__doc__,
+        version=PROG_VERSION)
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+    parser.add_argument('-a', '--address',
+        default=DEFAULT_SERVER_ADDRESS,
+        help="Address to listen to: host:port, with a loopback host, or the "
+             "path of a Unix socket (default: %(default)s).")
+    parser.add_argument('-j', '--jobs',
+        type=int, default=None,
+        help="Number of worker processes (default: number of CPUs).")
+    args = parser.parse_args()
+    family, socket_address = parse_address(args.address)
+    if family != socket.AF_UNIX and not is_loopback_host(socket_address[0]):
+        # Clients may read and write any file the server can.
+        parser.error("the server has no authentication and only listens on "
+                     "the loopback interface, not on %s" % socket_address[0])
+
+    # --------------------------------------------------------------------------
+    # Logger activation
+    _initLogger(logger)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    # --------------------------------------------------------------------------
+    # Output log header
+    _programHeader(logger, PROG_NAME, PROG_VERSION)
+    logger.debug(_DBGSEP)
+    _dumpArgs(args, logger)
+    logger.debug(_DBGSEP)
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    try:
+        server = _makeServer(args.address)
+    except (IOError, OSError, socket.error) as exc:
+        logger.error("Cannot listen on %s: %s" % (args.address, exc))
+        return ERRCODE_IOERROR
+    pool = multiprocessing.Pool(args.jobs, _workerInit)
+    server.pool = pool
+    # Stop cleanly on SIGTERM as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(ERRCODE_OK))
+    logger.info("Listening on %s." % args.address)
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Shutting down.")
+    finally:
+        server.server_close()
+        pool.terminate()
+        pool.join()
+        if parse_address(args.address)[0] == socket.AF_UNIX:
+            try:
+                os.remove(args.address)
+            except OSError:
+                pass
+
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+
+    logger.debug("Clean exit.")
+    logger.debug(_DBGSEP)
+    return ERRCODE_OK
+    # --------------------------------------------------------------------------
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC edit distance checks. Regression checks of the scoring engine.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program checks that `edit_distance', computed with bit vectors within a
+diagonal band, gives the same distances as the plain dynamic programming
+algorithm, on random strings and lists of words, and on pairs long enough to
+be compared within a band (BAND_MIN_LENGTH and the segments of the bit vectors
+are made small for this, so that the plain algorithm stays fast). It also
+checks that a distance computed within a too narrow band is larger than the
+cost of the band.
+
+It returns 0 if every check passed, 1 otherwise.
+
+Sample usage:
+    python test/check_edit_distance.py
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import sys
+import os
+import random
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT_DIR)
+
+import moclib
+from moclib import edit_distance, _banded_distance
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+_ALPHABET = u"ab cé€"
+_WORDS = [u"un", u"café", u"crème", u"à", u"la", u"fin"]
+_PAIR_COUNT = 300
+_SEED = 2015
+
+# ==============================================================================
+# Checks
+def _expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError("%s: got %r, expected %r"
+                             % (what, actual, expected))
+
+def _plainDistance(a, b):
+    """Levenshtein distance by the plain dynamic programming algorithm."""
+    previous = list(range(len(b) + 1))
+    for i, item in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (item != other)))
+        previous = current
+    return previous[-1]
+
+def _randomText(rnd, length, items):
+    return [rnd.choice(items) for _ in range(length)]
+
+def _edited(rnd, text, items, edit_count):
+    """Returns a copy of `text' with random insertions, deletions and
+    substitutions."""
+    text = list(text)
+    for _ in range(edit_count):
+        pos = rnd.randint(0, len(text))
+        kind = rnd.randint(0, 2)
+        if kind == 0 or pos == len(text):
+            text.insert(pos, rnd.choice(items))
+        elif kind == 1:
+            del text[pos]
+        else:
+            text[pos] = rnd.choice(items)
+    return text
+
+def _pairs(rnd, max_length):
+    """Yields random pairs of strings and of lists of words, either
+    unrelated or close to each other."""
+    for index in range(_PAIR_COUNT):
+        items = _ALPHABET if index % 2 else _WORDS
+        a = _randomText(rnd, rnd.randint(0, max_length), items)
+        if index % 3:
+            b = _edited(rnd, a, items, rnd.randint(0, max_length // 4 + 1))
+        else:
+            b = _randomText(rnd, rnd.randint(0, max_length), items)
+        if items is _ALPHABET:
+            a, b = u"".join(a), u"".join(b)
+        yield a, b
+
+def checkShortPairs():
+    """Sequences compared without a band."""
+    rnd = random.Random(_SEED)
+    for a, b in _pairs(rnd, 40):
+        _expect(edit_distance(a, b), _plainDistance(a, b), "%r, %r" % (a, b))
+
+def _checkBandedPairs():
+    rnd = random.Random(_SEED + 1)
+    for a, b in _pairs(rnd, 120):
+        _expect(edit_distance(a, b), _plainDistance(a, b), "%r, %r" % (a, b))
+
+def _checkNarrowBands():
+    rnd = random.Random(_SEED + 2)
+    for a, b in _pairs(rnd, 30):
+        if len(a) < len(b):
+            a, b = b, a
+        if not b:
+            continue
+        expected = _plainDistance(a, b)
+        for k in range(len(a) - len(b), len(a) + len(b) + 1):
+            distance = _banded_distance(a, b, k)
+            what = "%r, %r within %d" % (a, b, k)
+            if expected <= k:
+                _expect(distance, expected, what)
+            elif distance <= k:
+                raise AssertionError("%s: got %d, expected more than %d"
+                                     % (what, distance, k))
+
+def _withSmallBands(check):
+    """Runs `check' with bands used from 16 items and segments of 8 bits."""
+    def run():
+        saved = moclib.BAND_MIN_LENGTH, moclib._BAND_SEGMENT
+        moclib.BAND_MIN_LENGTH, moclib._BAND_SEGMENT = 16, 8
+        try:
+            check()
+        finally:
+            moclib.BAND_MIN_LENGTH, moclib._BAND_SEGMENT = saved
+    run.__name__ = check.__name__.lstrip("_")
+    return run
+
+checkBandedPairs = _withSmallBands(_checkBandedPairs)
+checkNarrowBands = _withSmallBands(_checkNarrowBands)
+
+_CHECKS = [checkShortPairs, checkBandedPairs, checkNarrowBands]
+
+# ==============================================================================
+# Main function
+def main():
+    logging.basicConfig(format="%(levelname)-7s: %(message)s",
+                        level=logging.INFO)
+    failures = 0
+    for check in _CHECKS:
+        try:
+            check()
+        except AssertionError as exc:
+            failures += 1
+            logger.error("%s FAILED: %s" % (check.__name__, exc))
+        else:
+            logger.info("%s OK" % check.__name__)
+    return 1 if failures else 0
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
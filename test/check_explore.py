@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC explore checks. Regression checks of line ranges.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program checks that the lines read through a line index (see
+`explore.py --lines') are the same as those of a plain split of the file, with
+LF, CR and CR LF end of lines split between blocks, that the index is rebuilt
+when the file changes, and that `explore.py --lines' on a missing file exits
+with ERRCODE_IOERROR instead of a traceback.
+
+It returns 0 if every check passed, 1 otherwise.
+
+Sample usage:
+    python test/check_explore.py
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import sys
+import os
+import io
+import shutil
+import subprocess
+import tempfile
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT_DIR)
+
+from moclib import (ERRCODE_IOERROR, LINE_INDEX_STEP, LINE_INDEX_SUFFIX,
+                    build_line_index, read_lines)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+_EXPLORE = os.path.join(_ROOT_DIR, "explore.py")
+_EOLS = [u"\n", u"\r", u"\r\n"]
+_LINE_COUNT = 5 * LINE_INDEX_STEP + 7
+
+# ==============================================================================
+# Checks
+def _expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError("%s: got %r, expected %r"
+                             % (what, actual, expected))
+
+def _writeLines(path, line_count, tag):
+    """Writes numbered lines with every kind of end of line, the last one
+    without any. Returns the lines as a plain split gives them."""
+    with io.open(path, "wb") as file_output:
+        for line_no in range(1, line_count + 1):
+            eol = _EOLS[line_no % 3] if line_no < line_count else u""
+            file_output.write((u"%s %d déjà\t%s" % (tag, line_no, eol))
+                              .encode("UTF-8"))
+    with io.open(path, encoding="UTF-8", newline="") as file_input:
+        return file_input.readlines()
+
+def _ranges(line_count):
+    step = LINE_INDEX_STEP
+    return [(1, None), (1, 3), (step, step + 1), (step + 1, step + 1),
+            (2 * step + 5, 4 * step), (line_count - 2, None),
+            (line_count, line_count), (line_count + 1, None)]
+
+def checkLinesMatchSplit():
+    """Ranges of lines read through the index are slices of a plain split."""
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "lines.txt")
+        lines = _writeLines(path, _LINE_COUNT, u"a")
+        for buffer_size in (1, 7, 4096):
+            index = build_line_index(path, buffer_size=buffer_size)
+            _expect(index.line_count, len(lines),
+                    "line count by blocks of %d" % buffer_size)
+        for first_line, last_line in _ranges(len(lines)):
+            expected = lines[first_line - 1:last_line]
+            actual = list(read_lines(path, first_line, last_line,
+                                     buffer_size=7))
+            _expect(actual, expected, "lines %s-%s" % (first_line, last_line))
+        _expect(os.path.exists(path + LINE_INDEX_SUFFIX), True,
+                "saved line index")
+    finally:
+        shutil.rmtree(directory)
+
+def checkIndexRebuilt():
+    """A saved index is not used once the file changed."""
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "lines.txt")
+        _writeLines(path, _LINE_COUNT, u"a")
+        first_line = 3 * LINE_INDEX_STEP
+        list(read_lines(path, first_line))
+        lines = _writeLines(path, _LINE_COUNT + 100, u"changed")
+        # Same modification time: only the size tells the index is outdated
+        os.utime(path, (0, 0))
+        actual = list(read_lines(path, first_line))
+        _expect(actual, lines[first_line - 1:], "lines of the changed file")
+    finally:
+        shutil.rmtree(directory)
+
+def checkMissingFile():
+    """explore.py --lines on a missing file fails cleanly."""
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "missing.txt")
+        process = subprocess.Popen([sys.executable, _EXPLORE, "--lines",
+                                    "3000", path], stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        _output, errors = process.communicate()
+        _expect(process.returncode, ERRCODE_IOERROR, "exit code")
+        _expect("Traceback" in errors, False, "traceback in %r" % errors)
+    finally:
+        shutil.rmtree(directory)
+
+_CHECKS = [checkLinesMatchSplit, checkIndexRebuilt, checkMissingFile]
+
+# ==============================================================================
+# Main function
+def main():
+    logging.basicConfig(format="%(levelname)-7s: %(message)s",
+                        level=logging.INFO)
+    failures = 0
+    for check in _CHECKS:
+        try:
+            check()
+        except AssertionError as exc:
+            failures += 1
+            logger.error("%s FAILED: %s" % (check.__name__, exc))
+        else:
+            logger.info("%s OK" % check.__name__)
+    return 1 if failures else 0
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
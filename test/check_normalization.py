@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC normalization checks. Regression checks of the fast paths.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program checks that `normalize_line', which skips NFKC on ASCII lines and
+translates lines of allowed characters with a table, gives the same result as
+the full pipeline (NFKC then TRANSFORMATIONS) on every line of the test files,
+read with universal end of lines and with their own end of lines (CR, CR LF),
+and on every allowed character alone.
+
+It returns 0 if every line gave the same result, 1 otherwise.
+
+Sample usage:
+    python test/check_normalization.py
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import sys
+import os
+import io
+import glob
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT_DIR)
+
+from moclib import ALLOWED_INPUT, normalize_line, _normalize_full
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+_TEST_DIR = os.path.join(_ROOT_DIR, "test")
+
+# ==============================================================================
+# Checks
+def _checkLines(lines, what):
+    """Compares both normalizations on each line, returns the number of
+    mismatches."""
+    mismatches = 0
+    for line_no, line in enumerate(lines, 1):
+        expected = _normalize_full(line)
+        actual = normalize_line(line)
+        if actual != expected:
+            mismatches += 1
+            logger.error("%s, line %d: %r gives %r instead of %r"
+                         % (what, line_no, line, actual, expected))
+    return mismatches
+
+def checkFixtures():
+    mismatches = 0
+    for path in sorted(glob.glob(os.path.join(_TEST_DIR, "*.txt"))):
+        name = os.path.basename(path)
+        # None: universal end of lines; "": lines keep their CR or CR LF
+        for newline, mode in ((None, "universal"), ("", "raw")):
+            with io.open(path, encoding="UTF-8", newline=newline) as lines:
+                mismatches += _checkLines(lines, "%s (%s end of lines)"
+                                                 % (name, mode))
+    return mismatches
+
+def checkAllowedChars():
+    return _checkLines(ALLOWED_INPUT, "allowed characters")
+
+# ==============================================================================
+# Main function
+def main():
+    logging.basicConfig(format="%(levelname)-7s: %(message)s",
+                        level=logging.INFO)
+    failures = 0
+    for check in (checkFixtures, checkAllowedChars):
+        mismatches = check()
+        if mismatches:
+            failures += 1
+            logger.error("%s FAILED: %d mismatch(es)"
+                         % (check.__name__, mismatches))
+        else:
+            logger.info("%s OK" % check.__name__)
+    return 1 if failures else 0
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC resume checks. Regression checks of resumable normalization.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program checks that normalizing a growing file with
+`normalize.py --resume' after each append gives the same output and counts as
+normalizing the whole file at once, including when an append completes a line
+or a CR LF pair, and that a change in the middle of the part already
+processed, far from its beginning and its end, makes the whole file be
+normalized again.
+
+It returns 0 if every check passed, 1 otherwise.
+
+Sample usage:
+    python test/check_resume.py
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import sys
+import os
+import io
+import hashlib
+import shutil
+import tempfile
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT_DIR)
+
+from moclib import normalize_file, normalize_file_resumable
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+_LINE = u"Un café crème à la ﬁn — naïve été ı ½ « déjà »\r\n"
+_LINE_COUNT = 4000 # About 200 KB
+_BUFFER_SIZE = 4096
+
+# ==============================================================================
+# Checks
+def _expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError("%s: got %r, expected %r"
+                             % (what, actual, expected))
+
+def _append(path, data):
+    with io.open(path, "ab") as file_input:
+        file_input.write(data)
+
+def _digest(path):
+    with io.open(path, "rb") as file_input:
+        return hashlib.sha1(file_input.read()).hexdigest()
+
+def _counts(report):
+    return (report.line_count, report.err_count, report.encoding_err_count,
+            report.ret_code)
+
+def _compare(directory, input_path, what):
+    """Resumes the normalization of `input_path' and compares it with a full
+    run. Returns the offset normalization resumed from."""
+    output_path = os.path.join(directory, "resumed.txt")
+    expected_path = os.path.join(directory, "expected.txt")
+    report, offset = normalize_file_resumable(input_path, output_path,
+                                              buffer_size=_BUFFER_SIZE)
+    expected = normalize_file(input_path, expected_path,
+                              buffer_size=_BUFFER_SIZE)
+    _expect(_digest(output_path), _digest(expected_path),
+            "SHA-1 of the output, " + what)
+    _expect(_counts(report), _counts(expected), "counts, " + what)
+    return offset
+
+def checkAppends():
+    """Appended data is normalized like a full run would."""
+    directory = tempfile.mkdtemp()
+    try:
+        input_path = os.path.join(directory, "input.txt")
+        data = (_LINE * _LINE_COUNT).encode("UTF-8")
+        _append(input_path, data[:-5])
+        _expect(_compare(directory, input_path, "first run"), 0,
+                "offset of the first run")
+        # Ends the last line, with a CR waiting for its LF
+        appends = [data[-5:-1], b"\n", b"abc \xc0\xaf", b"e\xcc\x81\r",
+                   b"\ndef\n"]
+        for index, data in enumerate(appends):
+            offset = _compare(directory, input_path, "append %d" % index)
+            if offset == 0:
+                raise AssertionError("append %d: not resumed" % index)
+            _append(input_path, data)
+        _compare(directory, input_path, "last append")
+    finally:
+        shutil.rmtree(directory)
+
+def checkRewrittenMiddle():
+    """A change in the middle of the processed part is noticed."""
+    directory = tempfile.mkdtemp()
+    try:
+        input_path = os.path.join(directory, "input.txt")
+        data = (_LINE * _LINE_COUNT).encode("UTF-8")
+        _append(input_path, data)
+        _compare(directory, input_path, "first run")
+        middle = len(data) // 2
+        with io.open(input_path, "r+b") as file_input:
+            file_input.seek(middle)
+            file_input.write(b"X")
+        _append(input_path, b"new line\n")
+        _expect(_compare(directory, input_path, "rewritten middle"), 0,
+                "offset after rewriting the middle")
+    finally:
+        shutil.rmtree(directory)
+
+_CHECKS = [checkAppends, checkRewrittenMiddle]
+
+# ==============================================================================
+# Main function
+def main():
+    logging.basicConfig(format="%(levelname)-7s: %(message)s",
+                        level=logging.INFO)
+    failures = 0
+    for check in _CHECKS:
+        try:
+            check()
+        except AssertionError as exc:
+            failures += 1
+            logger.error("%s FAILED: %s" % (check.__name__, exc))
+        else:
+            logger.info("%s OK" % check.__name__)
+    return 1 if failures else 0
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
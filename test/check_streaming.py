@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC streaming checks. Regression checks of block-based reading.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program checks that files are checked and normalized the same way
+whatever the blocks they are read by, including when a combining mark or a
+CR LF pair is split between two blocks, that `check_lines' still takes one
+line per item while `check_text' takes any pieces of text, and that each
+invalid UTF-8 sequence found is one U+FFFD of the decoded text.
+
+With --large, it also generates a file made of a single line of 1 GiB (or
+--size bytes) in a temporary directory (see TMPDIR), normalizes it with
+`normalize.py' using several --buffer-size values, and checks that the outputs
+are all as expected and that the peak memory use of `normalize.py' is about
+the same as on a small file. This takes a few minutes and needs twice the
+size of the file on disk.
+
+It returns 0 if every check passed, 1 otherwise.
+
+Sample usage:
+    python test/check_streaming.py
+    python test/check_streaming.py --large
+    python test/check_streaming.py --large --size 100000000
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import os
+import io
+import hashlib
+import shutil
+import subprocess
+import tempfile
+
+_ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT_DIR)
+
+from moclib import (ERRCODE_EXTRACHAR, BUFFER_SIZE, LineError, check_lines,
+                    check_text, check_file, normalize_file, normalize_text,
+                    read_text, Utf8Validator)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+_TEST_DIR = os.path.join(_ROOT_DIR, "test")
+_FIXTURES = ["extra_chars.txt", "input-nixEOL-utf8.txt"]
+_NORMALIZE = os.path.join(_ROOT_DIR, "normalize.py")
+
+# Text the large file is made of: non-ASCII characters, combining marks that
+# NFKC composes and characters it expands. Its length in bytes is odd, so that
+# block boundaries fall anywhere in it.
+_PATTERN = u"Un café crème à la ﬁn — naïve e\u0301te\u0301 ½ « déjà »... "
+_LARGE_SIZE = 1024 ** 3
+_LARGE_BUFFER_SIZES = [BUFFER_SIZE, 65537, 4 * 1024 * 1024 + 3]
+_SMALL_SIZE = 16 * 1024 * 1024
+
+# Peak memory use on the large file may only exceed the one on a small file by
+# this much, in bytes.
+_RSS_MARGIN = 32 * 1024 * 1024
+
+# glibc raises its mmap threshold each time a large block is freed, after which
+# blocks of several MiB come from the heap and fragment it: the peak memory use
+# then grows with the size of the file although nothing is kept. A fixed
+# threshold measures what normalize.py actually keeps.
+_MALLOC_ENV = {"MALLOC_MMAP_THRESHOLD_": str(1024 * 1024)}
+
+# ==============================================================================
+# Checks
+def _expect(actual, expected, what):
+    if actual != expected:
+        raise AssertionError("%s: got %r, expected %r"
+                             % (what, actual, expected))
+
+def checkLinesPerItem():
+    """One item is one line, whether it ends with LF or not."""
+    dotless_i = u"ı"
+    expected = [LineError(2, 1, [(dotless_i, 2)])]
+    for lines in ([u"abc", u"d" + dotless_i],
+                  [u"abc\n", u"d" + dotless_i + u"\n"],
+                  [u"abc", u"d" + dotless_i + u"\n"]):
+        report = check_lines(lines)
+        _expect(report.line_errors, expected, "check_lines(%r)" % lines)
+        _expect(report.line_count, 2, "line count of %r" % lines)
+    report = check_lines([u"", u"", dotless_i])
+    _expect(report.line_errors, [LineError(3, 1, [(dotless_i, 1)])],
+            "check_lines with empty lines")
+
+def checkTextPieces():
+    """Pieces are split at LF only, wherever they start and end."""
+    dotless_i = u"ı"
+    for pieces in ([u"abc\nd" + dotless_i],
+                   [u"ab", u"c\nd", dotless_i],
+                   [u"abc", u"\n", u"d", dotless_i, u"\n"]):
+        report = check_text(pieces)
+        _expect(report.line_errors, [LineError(2, 1, [(dotless_i, 2)])],
+                "check_text(%r)" % pieces)
+        _expect(report.line_count, 2, "line count of %r" % pieces)
+
+def checkLinesMatchFile():
+    """Lines of a file give the same report as the file read by blocks."""
+    for name in _FIXTURES:
+        path = os.path.join(_TEST_DIR, name)
+        with io.open(path, encoding="UTF-8") as lines:
+            by_line = check_lines(lines, char_err_lim=None)
+        for buffer_size in (1, 7, 4096):
+            by_block = check_file(path, buffer_size=buffer_size,
+                                  char_err_lim=None)
+            _expect(by_block.line_errors, by_line.line_errors,
+                    "%s by blocks of %d" % (name, buffer_size))
+            _expect(by_block.line_count, by_line.line_count,
+                    "line count of %s by blocks of %d" % (name, buffer_size))
+
+def checkSplitSequences():
+    """Combining marks and CR LF pairs split between two blocks are read as if
+    they were not."""
+    directory = tempfile.mkdtemp()
+    try:
+        input_path = os.path.join(directory, "input.txt")
+        output_path = os.path.join(directory, "output.txt")
+        for offset in range(8):
+            text = u"a" * offset + u"e\u0301\r\nxı\r\ne\u0301"
+            with io.open(input_path, "wb") as file_input:
+                file_input.write(text.encode("UTF-8"))
+            expected = normalize_text(text)
+            for buffer_size in range(1, 9):
+                what = "offset %d, blocks of %d" % (offset, buffer_size)
+                report = normalize_file(input_path, output_path,
+                                        buffer_size=buffer_size)
+                with io.open(output_path, encoding="UTF-8",
+                             newline="") as file_output:
+                    _expect(file_output.read(), expected, what)
+                _expect(report.line_errors, [LineError(2, 1, [(u"ı", 2)])],
+                        what)
+                _expect(report.line_count, 3, "line count, " + what)
+    finally:
+        shutil.rmtree(directory)
+
+def checkInvalidSequences():
+    """Invalid UTF-8 sequences are split where the decoder replaces them."""
+    samples = [(b"w\xc0\xafrld", [b"\xc0", b"\xaf"]),
+               (b"\xe0\x80\x80\n\xed\xa0\x80", [b"\xe0\x80", b"\x80",
+                                                b"\xed\xa0\x80"]),
+               (b"\xf4\x90\x80\x80\xf8\x88\r\n\xe2\x82A\xe2\x82\xac\xf0\x9f",
+                [b"\xf4\x90\x80", b"\x80", b"\xf8", b"\x88", b"\xe2\x82",
+                 b"\xf0\x9f"])]
+    for data, sequences in samples:
+        for buffer_size in range(1, 9):
+            what = "%r, blocks of %d" % (data, buffer_size)
+            validator = Utf8Validator()
+            text = u"".join(read_text(io.BytesIO(data), buffer_size,
+                                      validator))
+            _expect(validator.err_count, text.count(u"\ufffd"), what)
+            _expect([error.data for error in validator.errors], sequences,
+                    what)
+
+_CHECKS = [checkLinesPerItem, checkTextPieces, checkLinesMatchFile,
+           checkSplitSequences, checkInvalidSequences]
+
+# ------------------------------------------------------------------------------
+# Large file
+def _writeSingleLine(path, size):
+    """Writes a single line of at least `size' bytes made of _PATTERN and
+    ending with an illegal character, without end of line. Returns the
+    number of blocks of _PATTERN, and the SHA-1 digest of the expected
+    normalized file."""
+    block = _PATTERN * (BUFFER_SIZE // len(_PATTERN))
+    data = block.encode("UTF-8")
+    normalized = normalize_text(block).encode("UTF-8")
+    digest = hashlib.sha1()
+    count = 0
+    with io.open(path, "wb") as file_input:
+        while count * len(data) < size:
+            file_input.write(data)
+            digest.update(normalized)
+            count += 1
+        file_input.write(u"ı".encode("UTF-8"))
+    digest.update(u"ı".encode("UTF-8"))
+    return count, digest.hexdigest()
+
+def _fileDigest(path):
+    digest = hashlib.sha1()
+    with io.open(path, "rb") as file_input:
+        for block in iter(lambda: file_input.read(BUFFER_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _normalizeRss(input_path, output_path, buffer_size):
+    """Runs normalize.py, returns its exit code and peak RSS in bytes."""
+    env = dict(os.environ, **_MALLOC_ENV)
+    process = subprocess.Popen([sys.executable, _NORMALIZE, "--buffer-size",
+                                str(buffer_size), input_path, output_path],
+                               stderr=open(os.devnull, "wb"), env=env)
+    _pid, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.WEXITSTATUS(status)
+    # ru_maxrss is in kilobytes on Linux, in bytes on Mac OS X
+    if sys.platform == "darwin":
+        return process.returncode, usage.ru_maxrss
+    return process.returncode, usage.ru_maxrss * 1024
+
+def checkLargeSingleLine(size):
+    """A single line of `size' bytes is normalized identically whatever the
+    size of the blocks, in constant memory."""
+    directory = tempfile.mkdtemp()
+    try:
+        small_path = os.path.join(directory, "small.txt")
+        large_path = os.path.join(directory, "large.txt")
+        output_path = os.path.join(directory, "output.txt")
+        _writeSingleLine(small_path, _SMALL_SIZE)
+        count, expected = _writeSingleLine(large_path, size)
+        logger.info("Generated a single line of %d bytes."
+                    % os.path.getsize(large_path))
+        report = check_file(large_path)
+        column = count * len(_PATTERN * (BUFFER_SIZE // len(_PATTERN))) + 1
+        _expect(report.line_errors, [LineError(1, 1, [(u"ı", column)])],
+                "errors of the large file")
+        _expect(report.line_count, 1, "line count of the large file")
+        for buffer_size in _LARGE_BUFFER_SIZES:
+            what = "blocks of %d" % buffer_size
+            ret_code, small_rss = _normalizeRss(small_path, output_path,
+                                                buffer_size)
+            _expect(ret_code, ERRCODE_EXTRACHAR, "exit code, small file, "
+                                                 + what)
+            ret_code, large_rss = _normalizeRss(large_path, output_path,
+                                                buffer_size)
+            _expect(ret_code, ERRCODE_EXTRACHAR, "exit code, " + what)
+            _expect(_fileDigest(output_path), expected, "output, " + what)
+            logger.info("Peak RSS by %s: %.1f MiB, %.1f MiB on a small file."
+                        % (what, large_rss / 1048576.0,
+                           small_rss / 1048576.0))
+            if large_rss > small_rss + _RSS_MARGIN:
+                raise AssertionError("peak RSS grew from %d to %d bytes, %s"
+                                     % (small_rss, large_rss, what))
+    finally:
+        shutil.rmtree(directory)
+
+# ==============================================================================
+# Main function
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="Regression checks of block-based reading.",
+        epilog=__doc__)
+    parser.add_argument('--large',
+        action="store_true",
+        help="Also check a large file made of a single line.")
+    parser.add_argument('--size',
+        type=int, default=_LARGE_SIZE,
+        help="Size of the large file, in bytes (default: %(default)s).")
+    args = parser.parse_args()
+
+    logging.basicConfig(format="%(levelname)-7s: %(message)s",
+                        level=logging.INFO)
+    checks = [(check.__name__, check) for check in _CHECKS]
+    if args.large:
+        checks.append(("checkLargeSingleLine",
+                       lambda: checkLargeSingleLine(args.size)))
+    failures = 0
+    for name, check in checks:
+        try:
+            check()
+        except AssertionError as exc:
+            failures += 1
+            logger.error("%s FAILED: %s" % (name, exc))
+        else:
+            logger.info("%s OK" % name)
+    return 1 if failures else 0
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# SmartDOC-MOC watcher. Checks and normalizes files as they arrive.
+# Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+#                    - L3i / University of La Rochelle, France
+# For contact information, please see: <http://l3i.univ-larochelle.fr>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This program watches a directory tree where participants drop their OCR
+results, and checks and normalizes each file matching a pattern once it has
+stopped changing for a few seconds. For a file "result.txt", it writes next to
+it:
+ - "result.txt.normalized": the normalized text;
+ - "result.txt.diagnostics.jsonl": the illegal characters, one JSON object per
+   line (see `normalize.py --diagnostics');
+ - "result.txt.report.json": the report, as a `server.py' response, written
+   last.
+Files whose report is newer than them are not processed again, and a file is
+processed again if it changes.
+
+Changes are noticed with inotify on Linux, and by scanning the tree at regular
+intervals otherwise. Files are processed by a pool of worker processes; when
+too many files are waiting, new ones are left pending until the workers catch
+up.
+
+Sample usage:
+    watch.py /path/to/submissions
+    watch.py --pattern "*.txt" --jobs 4 --settle-time 5 /path/to/submissions
+    watch.py --once /path/to/submissions
+
+
+Copyright (c) 2015 - J. Chazalon, S. Eskenazi
+                   - L3i / University of La Rochelle, France
+This program comes with ABSOLUTELY NO WARRANTY; for details see `LICENCE' file.
+This is free software, and you are welcome to redistribute it under certain
+conditions; see `LICENCE' file for details.
+"""
+
+# ==============================================================================
+# Imports
+import logging
+import argparse
+import sys
+import os
+import signal
+
+from moclib import (ERRCODE_OK, ERRCODE_EXTRACHAR, ERRCODE_IOERROR,
+                    WATCH_INTERVAL, WATCH_SETTLE_TIME, WATCH_QUEUE_SIZE,
+                    watch_directory, format_encoding_errors, warm_up)
+
+# ==============================================================================
+# Logging
+logger = logging.getLogger(__name__)
+
+# ==============================================================================
+# Constants
+PROG_VERSION = "1.0"
+PROG_DESCR = "OCR Result Watcher for ICDAR15 SmartDOC"
+PROG_NAME = "moc_watch"
+
+# ==============================================================================
+# Utility private functions
+def _dumpArgs(args, logger=logger):
+    logger.debug("Arguments:")
+    for (k, v) in args.__dict__.items():
+        logger.debug("    %-20s = %s" % (k, v))
+
+_DBGLINELEN = 80
+_DBGSEP = "-"*_DBGLINELEN
+
+def _programHeader(logger, prog_name, prog_version):
+    logger.debug(_DBGSEP)
+    dbg_head = "%s - v. %s" % (prog_name, prog_version)
+    dbg_head_pre = " " * (max(0, (_DBGLINELEN - len(dbg_head)))/2)
+    logger.debug(dbg_head_pre + dbg_head)
+
+def _initLogger(logger, debug=False):
+    format="%(module)-9s %(levelname)-7s: %(message)s"
+    formatter = logging.Formatter(format)
+    ch = logging.StreamHandler()
+    ch.setFormatter(formatter)
+    logger.addHandler(ch)
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+    logger.setLevel(level)
+
+def _workerInit():
+    # Let the main process handle interruptions
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    warm_up()
+
+def _logResult(result):
+    if result.report is None:
+        logger.error("%s: %s" % (result.input_path, result.message))
+    elif result.report.ret_code != ERRCODE_OK:
+        logger.error("%s: %d illegal character(s)."
+                     % (result.input_path, result.report.err_count))
+        for message in format_encoding_errors(result.report):
+            logger.debug(message)
+    else:
+        logger.info("%s: OK" % result.input_path)
+
+# ==============================================================================
+# Main function
+def main():
+    # Option parsing
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description=PROG_DESCR,
+        epilog=__doc__,
+        version=PROG_VERSION)
+    parser.add_argument('-d', '--debug',
+        action="store_true",
+        help="Activate debug output.")
+    parser.add_argument('-p', '--pattern',
+        default="*.txt",
+        help="Name pattern of the files to process (default: %(default)s).")
+    parser.add_argument('-j', '--jobs',
+        type=int, default=None,
+        help="Number of worker processes (default: number of CPUs).")
+    parser.add_argument('--queue-size',
+        type=int, default=WATCH_QUEUE_SIZE,
+        help="Maximum number of files waiting for or being processed by the "
+             "workers (default: %(default)s).")
+    parser.add_argument('--settle-time',
+        type=float, default=WATCH_SETTLE_TIME,
+        help="Seconds a file must stay unchanged before it is processed "
+             "(default: %(default)s).")
+    parser.add_argument('--interval',
+        type=float, default=WATCH_INTERVAL,
+        help="Seconds between two scans of the directory when polling "
+             "(default: %(default)s).")
+    parser.add_argument('--polling',
+        action="store_true",
+        help="Scan the directory at regular intervals even if inotify is "
+             "available.")
+    parser.add_argument('--once',
+        action="store_true",
+        help="Exit once every file present or arriving meanwhile has been "
+             "processed.")
+    parser.add_argument('directory',
+        help="Directory to watch, with its subdirectories.")
+    args = parser.parse_args()
+
+    # --------------------------------------------------------------------------
+    # Logger activation
+    _initLogger(logger)
+    if args.debug:
+        logger.setLevel(logging.DEBUG)
+
+    # --------------------------------------------------------------------------
+    # Output log header
+    _programHeader(logger, PROG_NAME, PROG_VERSION)
+    logger.debug(_DBGSEP)
+    _dumpArgs(args, logger)
+    logger.debug(_DBGSEP)
+
+    # --------------------------------------------------------------------------
+    logger.debug("--- Process started. ---")
+    if not os.path.isdir(args.directory):
+        logger.error("Not a directory: %s" % args.directory)
+        return ERRCODE_IOERROR
+    if args.jobs is not None and args.jobs < 1 or args.queue_size < 1:
+        parser.error("--jobs and --queue-size must be at least 1.")
+    # Stop cleanly on SIGTERM as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(ERRCODE_OK))
+    logger.info("Watching %s." % args.directory)
+    ret_code = ERRCODE_OK
+    counts = {ERRCODE_OK: 0, ERRCODE_EXTRACHAR: 0, ERRCODE_IOERROR: 0}
+    try:
+        for result in watch_directory(args.directory, args.pattern, args.jobs,
+                                      args.queue_size, args.settle_time,
+                                      args.interval, not args.polling,
+                                      args.once, _workerInit):
+            counts[result.ret_code] += 1
+            ret_code = max(ret_code, result.ret_code)
+            _logResult(result)
+    except (KeyboardInterrupt, SystemExit):
+        logger.info("Shutting down.")
+    logger.info("Processed %d file(s): %d clean, %d with illegal characters, "
+                "%d failed."
+                % (sum(counts.values()), counts[ERRCODE_OK],
+                   counts[ERRCODE_EXTRACHAR], counts[ERRCODE_IOERROR]))
+
+    logger.debug("--- Process complete. ---")
+    # --------------------------------------------------------------------------
+
+    logger.debug("Clean exit.")
+    logger.debug(_DBGSEP)
+    return ret_code if args.once else ERRCODE_OK
+    # --------------------------------------------------------------------------
+
+# ==============================================================================
+# Entry point
+if __name__ == "__main__":
+    sys.exit(main())